@@ -0,0 +1,12 @@
+"""
+Gunicorn settings, picked up automatically from the working directory
+
+Set TAXI_WARMUP_MONTHS (e.g. "2023-01") to have every worker load those
+months in the background before real traffic needs them.
+"""
+
+
+def post_worker_init(worker):
+    from taxi_api.warmup import start_background_warmup
+
+    start_background_warmup()
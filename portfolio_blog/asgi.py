@@ -0,0 +1,7 @@
+# portfolio_blog/asgi.py
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "portfolio_blog.settings")
+application = get_asgi_application()
@@ -42,7 +42,7 @@ MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "portfolio_blog.middleware.WWWRedirectMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "portfolio_blog.middleware.AsyncWhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -102,3 +102,75 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+
+# NYC taxi data service settings
+TAXI_BASE_URL = os.getenv(
+    "TAXI_BASE_URL", "https://d37ci6vzurychx.cloudfront.net/trip-data"
+)
+# Shared on-disk parquet store used by every gunicorn worker
+TAXI_CACHE_DIR = os.getenv("TAXI_CACHE_DIR", "/tmp/taxi_cache")
+TAXI_CACHE_MAX_BYTES = int(os.getenv("TAXI_CACHE_MAX_BYTES", 2 * 1024**3))
+# How often a worker re-checks the upstream size/ETag of a cached month
+TAXI_CACHE_REVALIDATE_SECONDS = int(
+    os.getenv("TAXI_CACHE_REVALIDATE_SECONDS", 24 * 60 * 60)
+)
+# How long a worker reuses an upstream size/ETag lookup, failed ones included
+TAXI_FINGERPRINT_TTL_SECONDS = int(os.getenv("TAXI_FINGERPRINT_TTL_SECONDS", 60))
+# Upstream files are fetched as this many concurrent HTTP range requests of
+# at least TAXI_DOWNLOAD_MIN_SEGMENT_BYTES each, resumed after failures
+TAXI_DOWNLOAD_SEGMENTS = int(os.getenv("TAXI_DOWNLOAD_SEGMENTS", 8))
+TAXI_DOWNLOAD_MIN_SEGMENT_BYTES = int(
+    os.getenv("TAXI_DOWNLOAD_MIN_SEGMENT_BYTES", 8 * 1024**2)
+)
+TAXI_DOWNLOAD_RETRIES = int(os.getenv("TAXI_DOWNLOAD_RETRIES", 5))
+TAXI_DOWNLOAD_TIMEOUT = int(os.getenv("TAXI_DOWNLOAD_TIMEOUT", 30))
+# Cursors per worker on the shared in-memory DuckDB database
+TAXI_DUCKDB_POOL_SIZE = int(os.getenv("TAXI_DUCKDB_POOL_SIZE", 8))
+TAXI_DUCKDB_POOL_TIMEOUT = int(os.getenv("TAXI_DUCKDB_POOL_TIMEOUT", 30))
+# Retry-After hint of the 503 sent when no cursor freed up in time
+TAXI_DUCKDB_POOL_RETRY_AFTER = int(os.getenv("TAXI_DUCKDB_POOL_RETRY_AFTER", 5))
+# Threads running taxi API views under ASGI, one pooled cursor each
+TAXI_VIEW_WORKERS = int(os.getenv("TAXI_VIEW_WORKERS", TAXI_DUCKDB_POOL_SIZE))
+# Memory cap of each worker's DuckDB database, beyond which queries spill
+# to TAXI_DUCKDB_TEMP_DIR; TAXI_DUCKDB_THREADS=0 keeps DuckDB's default
+TAXI_DUCKDB_MEMORY_LIMIT = os.getenv("TAXI_DUCKDB_MEMORY_LIMIT", "2GB")
+TAXI_DUCKDB_THREADS = int(os.getenv("TAXI_DUCKDB_THREADS", 0))
+TAXI_DUCKDB_TEMP_DIR = os.getenv("TAXI_DUCKDB_TEMP_DIR", "/tmp/taxi_duckdb_spill")
+# "view" reads months lazily from parquet, "table" materializes every month,
+# "remote" queries months not cached locally in place over HTTP range requests
+TAXI_ENGINE_MODE = os.getenv("TAXI_ENGINE_MODE", "view")
+# Block cache of the byte ranges read from upstream files in remote mode
+TAXI_REMOTE_CACHE_DIR = os.getenv("TAXI_REMOTE_CACHE_DIR", "/tmp/taxi_remote_blocks")
+TAXI_REMOTE_CACHE_MAX_BYTES = int(os.getenv("TAXI_REMOTE_CACHE_MAX_BYTES", 1024**3))
+# Small blocks waste less on the edges of the column chunks a query reads
+TAXI_REMOTE_BLOCK_BYTES = int(os.getenv("TAXI_REMOTE_BLOCK_BYTES", 64 * 1024))
+# Comma separated YYYY-MM months kept in memory as tables, e.g. "2023-01"
+TAXI_MATERIALIZED_MONTHS = os.getenv("TAXI_MATERIALIZED_MONTHS", "")
+# Least recently used month tables are dropped beyond this many bytes, once
+# they have not been used for TAXI_MATERIALIZED_MIN_IDLE_SECONDS
+TAXI_MATERIALIZED_MAX_BYTES = int(os.getenv("TAXI_MATERIALIZED_MAX_BYTES", 1024**3))
+TAXI_MATERIALIZED_MIN_IDLE_SECONDS = int(
+    os.getenv("TAXI_MATERIALIZED_MIN_IDLE_SECONDS", 30)
+)
+# Precomputed monthly aggregates, built once per month from the parquet cache
+TAXI_ROLLUP_DIR = os.getenv("TAXI_ROLLUP_DIR", "/tmp/taxi_rollups")
+# Hive-partitioned, sorted copy of downloaded months, see build_taxi_lake
+TAXI_LAKE_DIR = os.getenv("TAXI_LAKE_DIR", "/tmp/taxi_lake")
+TAXI_LAKE_ROW_GROUP_SIZE = int(os.getenv("TAXI_LAKE_ROW_GROUP_SIZE", 32_768))
+# Month trip files sorted on pickup time, used to page through trips
+TAXI_SORTED_DIR = os.getenv("TAXI_SORTED_DIR", "/tmp/taxi_sorted")
+# Months of a start/end range are loaded concurrently on this many threads
+TAXI_RANGE_WORKERS = int(os.getenv("TAXI_RANGE_WORKERS", os.cpu_count() or 4))
+TAXI_MAX_RANGE_MONTHS = int(os.getenv("TAXI_MAX_RANGE_MONTHS", 24))
+# Largest limit a list endpoint accepts; larger limits are clamped to it
+TAXI_MAX_PAGE_SIZE = int(os.getenv("TAXI_MAX_PAGE_SIZE", 1000))
+# Seconds a request waits for another request loading the same month before
+# giving up with a 503 and a Retry-After hint
+TAXI_COLD_LOAD_WAIT = int(os.getenv("TAXI_COLD_LOAD_WAIT", 60))
+TAXI_COLD_LOAD_RETRY_AFTER = int(os.getenv("TAXI_COLD_LOAD_RETRY_AFTER", 10))
+# Comma separated YYYY-MM months each gunicorn worker warms at startup
+TAXI_WARMUP_MONTHS = os.getenv("TAXI_WARMUP_MONTHS", "")
+# Percentage of each month sampled to answer ?approx=true requests
+TAXI_APPROX_SAMPLE_PERCENT = float(os.getenv("TAXI_APPROX_SAMPLE_PERCENT", 5))
+# Rows per record batch pulled from DuckDB while streaming a trip export
+TAXI_EXPORT_BATCH_SIZE = int(os.getenv("TAXI_EXPORT_BATCH_SIZE", 50_000))
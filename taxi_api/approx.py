@@ -0,0 +1,55 @@
+"""
+Approximate answers with error bounds, for exploring months without rollups
+
+Measures are estimated from a system sample of each month relation, scaled
+up by the exact number of trips, which only needs a scan of the narrow
+pickup column. Distinct zone counts come exactly from that same scan, as
+an estimate would cost as much. Every estimate comes with a <name>_moe
+margin of error at 95% confidence.
+
+Only months already on disk are fast to approximate: in view mode a month
+not cached yet is downloaded in full first, like for exact queries.
+
+The margins assume independently sampled rows. System sampling picks
+whole vectors of rows, so they are somewhat optimistic when rows are
+clustered, e.g. by pickup time.
+"""
+
+# Two-sided 95% confidence
+Z = 1.96
+
+# Exact trip count of the population and size of the sample, as provided
+# by the population and sample CTEs of approximate queries
+POPULATION = "(SELECT trips FROM population)"
+SAMPLE_SIZE = "NULLIF((SELECT COUNT(*) FROM sample), 0)"
+
+
+def sampled(relation: str, percent: float) -> str:
+    """A month relation read through a system sample"""
+    return f"{relation} TABLESAMPLE {percent}% (system)"
+
+
+def estimate_total(column: str, name: str, integer: bool = False) -> str:
+    """
+    Population total of a column over the rows of the current group
+
+    Scales the sample sum by population / sample size. Pass column="1"
+    to estimate a row count.
+    """
+    mean = f"SUM({column}) / {SAMPLE_SIZE}"
+    variance = f"SUM({column} * {column}) / {SAMPLE_SIZE} - POWER({mean}, 2)"
+    estimate = f"{POPULATION} * {mean}"
+    if integer:
+        estimate = f"ROUND({estimate})::BIGINT"
+    return f"""
+        {estimate} AS {name},
+        {Z} * {POPULATION} * SQRT(GREATEST({variance}, 0) / {SAMPLE_SIZE})
+            AS {name}_moe"""
+
+
+def estimate_mean(column: str, name: str) -> str:
+    """Population mean of a column over the rows of the current group"""
+    return f"""
+        AVG({column}) AS {name},
+        {Z} * STDDEV_SAMP({column}) / SQRT(NULLIF(COUNT({column}), 0))
+            AS {name}_moe"""
@@ -0,0 +1,361 @@
+"""
+Offline benchmarks of the taxi data service on synthetic months
+
+generate_month() writes a parquet file with the schema of the TLC yellow
+taxi files: skewed pickup and dropoff zones, a daily demand curve, fares
+derived from distance and duration, card tips and the usual surcharges,
+plus a few of the quirks of the real data (null passenger counts, negative
+fares, pickups outside the file's month). Values are derived from hashes
+of the row number, so a given seed always produces the same file.
+
+run_benchmark() installs such months in the parquet cache as if they had
+been downloaded, then times every service method and endpoint against
+them. Each case reports its cold latency (the first call, which builds
+rollups and other derived files) and percentiles of the warm calls.
+"""
+
+import os
+import resource
+import time
+
+import duckdb
+import numpy as np
+from django.test import Client
+
+from .filters import TripFilters
+from .parquet_cache import ParquetCache
+from .pool import get_connection_pool
+from .services import TaxiDataService, decode_cursor, month_range
+
+# Zones with the most pickups first; the remaining zones follow in order
+BUSY_ZONES = [237, 161, 236, 162, 132, 230, 186, 142, 170, 163, 239, 141, 234, 48]
+
+# Uniform value in [0, 1) for row i and draw k, reproducible for a seed
+UNIFORM = "(hash(i, {k}, {seed}) / 18446744073709551616.0)"
+
+
+def uniform(k: int, seed: int) -> str:
+    return UNIFORM.format(k=k, seed=seed)
+
+
+def zone_expression(k: int, seed: int, skew: float) -> str:
+    """SQL zone ID drawn with a power-law skew towards the busy zones"""
+    ranked = BUSY_ZONES + [z for z in range(1, 266) if z not in BUSY_ZONES]
+    rank = f"CAST(FLOOR(265 * POW({uniform(k, seed)}, {skew})) AS INTEGER)"
+    return f"{ranked}[{rank} + 1]"
+
+
+def generate_month(path: str, year: int, month: int, rows: int, seed: int = 0):
+    """Write a synthetic yellow taxi month of `rows` trips to a parquet file"""
+    u = [uniform(k, seed) for k in range(16)]
+    month_start = f"TIMESTAMP '{year}-{month:02d}-01'"
+    month_end = f"({month_start} + INTERVAL 1 MONTH)"
+
+    conn = duckdb.connect()
+    try:
+        conn.execute(
+            f"""
+            COPY (
+                WITH draws AS (
+                    SELECT
+                        i,
+                        -- Busy daytime hours on top of round-the-clock demand
+                        CASE
+                            WHEN {u[0]} < 0.0005
+                                THEN {month_start} - INTERVAL 1 DAY
+                            ELSE {month_start}
+                                + TO_SECONDS(CAST(FLOOR({u[1]} * EPOCH(
+                                    {month_end} - {month_start}) / 86400
+                                ) AS BIGINT) * 86400)
+                                + TO_SECONDS(CAST(CASE
+                                    WHEN {u[2]} < 0.6 THEN 7 + FLOOR({u[3]} * 16)
+                                    ELSE FLOOR({u[3]} * 24)
+                                END AS BIGINT) * 3600)
+                                + TO_SECONDS(CAST(FLOOR({u[4]} * 3600) AS BIGINT))
+                        END AS pickup,
+                        CASE
+                            WHEN {u[5]} < 0.01 THEN 0.0
+                            ELSE ROUND(LEAST(-LN(1 - {u[5]}) * 3.0, 60), 2)
+                        END AS distance,
+                        {u[6]} < 0.03 AS missing_passengers,
+                        {u[7]} AS passengers_draw,
+                        {zone_expression(8, seed, 3)} AS pickup_zone,
+                        {zone_expression(9, seed, 2)} AS dropoff_zone,
+                        {u[10]} AS payment_draw,
+                        {u[11]} AS tip_draw,
+                        {u[12]} < 0.01 AS refund,
+                        {u[13]} < 0.03 AS toll,
+                        {u[14]} AS duration_draw,
+                        {u[15]} AS vendor_draw
+                    FROM range({rows}) t(i)
+                ),
+                trips AS (
+                    SELECT
+                        *,
+                        pickup + TO_SECONDS(CAST(
+                            distance / 11 * 3600 + 60 + duration_draw * 300
+                        AS BIGINT)) AS dropoff,
+                        CASE
+                            WHEN missing_passengers THEN 0
+                            WHEN payment_draw < 0.78 THEN 1
+                            WHEN payment_draw < 0.97 THEN 2
+                            WHEN payment_draw < 0.99 THEN 4
+                            ELSE 3
+                        END AS payment,
+                        ROUND(
+                            3 + 2.5 * distance
+                            + 0.6 * (distance / 11 * 60 + 1 + duration_draw * 5),
+                            2
+                        ) * CASE WHEN refund THEN -1 ELSE 1 END AS fare
+                    FROM draws
+                ),
+                priced AS (
+                    SELECT
+                        *,
+                        CASE WHEN HOUR(pickup) >= 20 OR HOUR(pickup) < 6
+                            THEN 1.0 ELSE 0.0 END AS extra,
+                        CASE WHEN payment = 1 AND NOT refund
+                            THEN ROUND(fare * (0.1 + 0.2 * tip_draw), 2)
+                            ELSE 0.0 END AS tip,
+                        CASE WHEN toll THEN 6.55 ELSE 0.0 END AS tolls,
+                        CASE WHEN pickup_zone IN (132, 138)
+                            THEN 1.25 ELSE 0.0 END AS airport_fee
+                    FROM trips
+                )
+                SELECT
+                    CASE WHEN vendor_draw < 0.3 THEN 1 ELSE 2 END::BIGINT
+                        AS VendorID,
+                    pickup AS tpep_pickup_datetime,
+                    dropoff AS tpep_dropoff_datetime,
+                    CASE
+                        WHEN missing_passengers THEN NULL
+                        WHEN passengers_draw < 0.02 THEN 0
+                        WHEN passengers_draw < 0.74 THEN 1
+                        WHEN passengers_draw < 0.88 THEN 2
+                        WHEN passengers_draw < 0.93 THEN 3
+                        WHEN passengers_draw < 0.96 THEN 4
+                        WHEN passengers_draw < 0.98 THEN 5
+                        ELSE 6
+                    END::DOUBLE AS passenger_count,
+                    distance AS trip_distance,
+                    CASE
+                        WHEN missing_passengers THEN NULL
+                        WHEN pickup_zone = 132 THEN 2
+                        ELSE 1
+                    END::DOUBLE AS RatecodeID,
+                    CASE WHEN missing_passengers THEN NULL ELSE 'N' END
+                        AS store_and_fwd_flag,
+                    pickup_zone::BIGINT AS PULocationID,
+                    dropoff_zone::BIGINT AS DOLocationID,
+                    payment::BIGINT AS payment_type,
+                    fare AS fare_amount,
+                    extra::DOUBLE AS extra,
+                    0.5::DOUBLE AS mta_tax,
+                    tip::DOUBLE AS tip_amount,
+                    tolls::DOUBLE AS tolls_amount,
+                    1.0::DOUBLE AS improvement_surcharge,
+                    ROUND(fare + extra + 0.5 + tip + tolls + 1.0 + 2.5 + airport_fee, 2)
+                        AS total_amount,
+                    2.5::DOUBLE AS congestion_surcharge,
+                    airport_fee::DOUBLE AS airport_fee
+                FROM priced
+            ) TO '{path}' (FORMAT PARQUET)
+            """
+        )
+    finally:
+        conn.close()
+
+
+def install_month(
+    cache: ParquetCache, year: int, month: int, rows: int, seed: int = 0
+) -> str:
+    """
+    Put a synthetic month in the parquet cache as if it had been downloaded
+
+    The file is generated only if the cache does not have it yet.
+    """
+    key = cache.month_key(year, month)
+    fingerprint = cache.make_fingerprint(rows, f"synthetic-{seed}")
+    path = cache.path_for(key, fingerprint)
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        generate_month(tmp_path, year, month, rows, seed)
+        os.replace(tmp_path, path)
+        cache.remove_stale(key, keep=path)
+    cache.mark_validated(key, fingerprint)
+    return path
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process so far"""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(func, iterations: int) -> dict:
+    """Time one cold call and `iterations` warm calls of func"""
+    started = time.perf_counter()
+    func()
+    cold = time.perf_counter() - started
+
+    timings = []
+    for _ in range(max(iterations, 1)):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    timings_ms = np.array(timings) * 1000
+    return {
+        "cold_ms": round(cold * 1000, 2),
+        "iterations": len(timings),
+        "mean_ms": round(float(timings_ms.mean()), 2),
+        **{
+            f"p{q}_ms": round(float(np.percentile(timings_ms, q)), 2)
+            for q in (50, 90, 99)
+        },
+        "max_ms": round(float(timings_ms.max()), 2),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def service_cases(year: int, month: int, end: tuple) -> dict:
+    """Service method calls to time, each on a fresh pooled service"""
+    filters = TripFilters(hours=[7, 8, 9], pickup_zones=[132, 161, 237])
+    deep_cursor = {}
+
+    def call(method, *args, filtered=False, **kwargs):
+        def run():
+            service = TaxiDataService(pool=get_connection_pool())
+            if filtered:
+                service.filters = filters
+            try:
+                return getattr(service, method)(*args, **kwargs)
+            finally:
+                service.close()
+
+        return run
+
+    def deep_page():
+        # The cursor after the first 100,000 trips, found on the cold call
+        if "next" not in deep_cursor:
+            _, deep_cursor["next"] = call(
+                "get_sample_trips", year, month, limit=100_000, end=end
+            )()
+        cursor = decode_cursor(deep_cursor["next"])
+        return call("get_sample_trips", year, month, end=end, cursor=cursor)()
+
+    def export():
+        service = TaxiDataService(pool=get_connection_pool())
+        try:
+            reader = service.get_trip_batches(year, month, end, limit=1_000_000)
+            for _ in reader:
+                pass
+            reader.close()
+        finally:
+            service.close()
+
+    return {
+        "summary": call("get_trip_summary", year, month, end=end),
+        "summary_approx": call("get_trip_summary", year, month, end=end, approx=True),
+        "summary_filtered": call(
+            "get_trip_summary", year, month, end=end, filtered=True
+        ),
+        "heatmap": call("get_heatmap_data", year, month, end=end),
+        "heatmap_approx": call("get_heatmap_data", year, month, end=end, approx=True),
+        "revenue": call("get_revenue_analytics", year, month, end=end),
+        "stats": call("get_trip_stats", year, month, end=end),
+        "stats_approx": call("get_trip_stats", year, month, end=end, approx=True),
+        "dashboard": call("get_dashboard", year, month, end=end),
+        "trips": call("get_sample_trips", year, month, end=end),
+        "trips_deep_page": deep_page,
+        "trips_filtered": call("get_sample_trips", year, month, end=end, filtered=True),
+        "flows": call("get_flows", year, month, end=end),
+        "flows_origin": call("get_flows", year, month, origin=132, end=end),
+        "flows_filtered": call("get_flows", year, month, end=end, filtered=True),
+        "export_1m_rows": export,
+    }
+
+
+def endpoint_cases(year: int, month: int, end: tuple) -> dict:
+    """Requests to time against the API, through the whole Django stack"""
+    client = Client()
+    period = f"start={year}-{month:02d}&end={end[0]}-{end[1]:02d}"
+    filters = "hours=7-9&pickup_zone=132,161,237"
+
+    def get(path, query=""):
+        url = f"/api/taxi-data/{path}/?{period}&{query}"
+
+        def run():
+            response = client.get(url, HTTP_HOST="localhost")
+            if response.status_code != 200:
+                raise RuntimeError(f"GET {url} returned {response.status_code}")
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+
+        return run
+
+    return {
+        "summary": get("summary"),
+        "summary_columnar": get("summary", "layout=columnar"),
+        "summary_approx": get("summary", "approx=true"),
+        "summary_filtered": get("summary", filters),
+        "heatmap": get("heatmap"),
+        "revenue": get("revenue"),
+        "stats": get("stats"),
+        "trips": get("trips"),
+        "dashboard": get("dashboard"),
+        "flows": get("flows"),
+        "export_csv_100k_rows": get("trips/export", "format=csv&limit=100000"),
+        "metrics": get("metrics"),
+    }
+
+
+def run_benchmark(
+    rows: int,
+    months: int = 1,
+    iterations: int = 10,
+    seed: int = 0,
+    start: tuple = (2023, 1),
+    progress=None,
+) -> dict:
+    """
+    Benchmark the service on synthetic months of `rows` trips each
+
+    Settings must point the parquet cache and derived file stores at
+    directories reserved for the benchmark, see the benchmark_taxi command.
+    """
+    progress = progress or print
+    year, month = start
+    last = year * 12 + month - 1 + months - 1
+    end = (last // 12, last % 12 + 1)
+
+    # Months already generated by an earlier run are reused
+    cache = ParquetCache()
+    started = time.perf_counter()
+    for y, m in month_range(start, end):
+        install_month(cache, y, m, rows, seed)
+    setup_seconds = time.perf_counter() - started
+    progress(f"{months} month(s) of {rows:,} rows ready in {setup_seconds:.1f}s")
+
+    results = {}
+    for kind, cases in (
+        ("service", service_cases(year, month, end)),
+        ("endpoint", endpoint_cases(year, month, end)),
+    ):
+        for name, func in cases.items():
+            result = results[f"{kind}.{name}"] = measure(func, iterations)
+            progress(
+                f"{kind}.{name}: cold {result['cold_ms']}ms, "
+                f"p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms"
+            )
+
+    return {
+        "rows_per_month": rows,
+        "months": months,
+        "seed": seed,
+        "iterations": iterations,
+        "setup_seconds": round(setup_seconds, 2),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "cases": results,
+    }
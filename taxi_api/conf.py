@@ -0,0 +1,28 @@
+"""
+Settings lookup for the taxi data service
+
+The service is also used outside of Django (see test_duckdb.py), so settings
+fall back to environment variables and then to the given default.
+"""
+
+import os
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+def get_setting(name: str, default):
+    """Read a TAXI_* setting from Django settings or the environment"""
+    try:
+        return getattr(settings, name, default)
+    except ImproperlyConfigured:
+        pass
+
+    value = os.getenv(name)
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value == "True"
+    if isinstance(default, int):
+        return int(value)
+    return value
@@ -0,0 +1,59 @@
+"""
+Bulk loading of Arrow record batches into PostgreSQL with COPY
+
+copy_batches() writes each batch as CSV straight into COPY ... FROM STDIN
+on a temporary staging table, without building row objects, then moves
+the rows into the real table with one INSERT ... SELECT.
+"""
+
+import io
+
+import pyarrow.csv as pa_csv
+
+
+def quote_name(name: str) -> str:
+    """Quote a PostgreSQL identifier"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def copy_batches(
+    cursor, batches, table: str, columns: list, replace=False, progress=None
+) -> int:
+    """
+    Copy record batches into table's columns, returning the rows copied
+
+    Must run inside a transaction: the staging table is dropped on commit,
+    and with replace=True the old rows are deleted in the same transaction
+    that inserts the new ones, so readers see either the old rows or all of
+    the new ones. Batch columns must be in the order of columns.
+    """
+    staging = quote_name(f"{table}_staging")
+    table = quote_name(table)
+    column_list = ", ".join(quote_name(column) for column in columns)
+    write_options = pa_csv.WriteOptions(include_header=False)
+
+    cursor.execute(
+        f"""
+        CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS
+        SELECT {column_list} FROM {table} WITH NO DATA
+        """
+    )
+
+    copied = 0
+    for batch_num, batch in enumerate(batches, start=1):
+        buffer = io.BytesIO()
+        pa_csv.write_csv(batch, buffer, write_options)
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+        copied += batch.num_rows
+        if progress:
+            progress(batch_num, copied)
+
+    if replace:
+        cursor.execute(f"DELETE FROM {table}")
+    cursor.execute(
+        f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging}"
+    )
+    return copied
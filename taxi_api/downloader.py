@@ -0,0 +1,306 @@
+"""
+Parallel, resumable HTTP downloads of upstream taxi files
+
+download_file() asks the server for the size and ETag of a file, then
+fetches it as concurrent HTTP Range segments written in place into a
+".part" file next to the destination. Segment progress is saved alongside,
+so a download that failed or was interrupted resumes where each segment
+stopped. Segments are requested with If-Range, so a file that changed
+upstream in the meantime is fetched again from scratch rather than mixed.
+Servers without range support get a single stream instead.
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .conf import get_setting
+from .metrics import DOWNLOADED_BYTES, timed
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+)
+
+
+class DownloadError(Exception):
+    """Raised when a file could not be downloaded completely"""
+
+
+class UpstreamChanged(DownloadError):
+    """Raised when the upstream file changed while it was being downloaded"""
+
+
+class RangeDownloader:
+    """
+    Download files as concurrent byte ranges, resuming partial downloads
+    """
+
+    def __init__(
+        self,
+        segments: int = None,
+        min_segment_bytes: int = None,
+        retries: int = None,
+        timeout: float = None,
+        chunk_bytes: int = 64 * 1024,
+        session: requests.Session = None,
+    ):
+        self.segments = segments or get_setting("TAXI_DOWNLOAD_SEGMENTS", 8)
+        self.min_segment_bytes = min_segment_bytes or get_setting(
+            "TAXI_DOWNLOAD_MIN_SEGMENT_BYTES", 8 * 1024**2
+        )
+        self.retries = (
+            retries if retries is not None else get_setting("TAXI_DOWNLOAD_RETRIES", 5)
+        )
+        self.timeout = timeout or get_setting("TAXI_DOWNLOAD_TIMEOUT", 30)
+        self.chunk_bytes = chunk_bytes
+        self.session = session or requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+
+    def download(self, url: str, path: str) -> dict:
+        """
+        Download url to path, returning transfer statistics
+
+        The file only appears at path once complete and verified. Processes
+        downloading the same path take turns, so they never write the same
+        part file at once. Bytes are written as they arrive, in chunks of
+        chunk_bytes, so a dropped connection loses at most one chunk.
+        """
+        part_path = f"{path}.part"
+        lock_path = f"{part_path}.lock"
+        while True:
+            with open(lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # The lock file is deleted after a download completes, so
+                    # a waiter can wake up holding a lock nobody else sees
+                    if not self._is_current(lock_file, lock_path):
+                        continue
+                    with timed("download"):
+                        try:
+                            stats = self._download(url, path, part_path)
+                        except UpstreamChanged as e:
+                            print(f"{e}, restarting download")
+                            self._discard(part_path)
+                            stats = self._download(url, path, part_path)
+                    try:
+                        os.unlink(lock_path)
+                    except FileNotFoundError:
+                        pass
+                    return stats
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _is_current(self, lock_file, lock_path: str) -> bool:
+        """Whether an open lock file is still the one at lock_path"""
+        try:
+            return os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_path))
+        except FileNotFoundError:
+            return False
+
+    def _download(self, url: str, path: str, part_path: str) -> dict:
+        started = time.perf_counter()
+        size, etag, ranges = self.probe(url)
+
+        if not ranges or not size:
+            self._discard(part_path)
+            downloaded = self.fetch_whole(url, part_path, size)
+            state = None
+        else:
+            state = self.load_state(part_path, url, size, etag)
+            already = sum(done for _, _, done in state["segments"])
+            self.fetch_segments(url, part_path, state)
+            downloaded = size - already
+
+        actual = os.path.getsize(part_path)
+        if size is not None and actual != size:
+            raise DownloadError(f"{url}: expected {size} bytes, got {actual}")
+
+        os.replace(part_path, path)
+        if state is not None:
+            os.unlink(f"{part_path}.json")
+
+        seconds = time.perf_counter() - started
+        stats = {
+            "bytes": actual,
+            "downloaded_bytes": downloaded,
+            "seconds": round(seconds, 3),
+            "mib_per_second": round(downloaded / 1024**2 / max(seconds, 1e-6), 1),
+            "segments": len(state["segments"]) if state else 1,
+            "resumed": downloaded < actual,
+        }
+        print(
+            f"Downloaded {url} to {path}: {actual / 1024**2:.1f} MiB in "
+            f"{seconds:.1f}s ({stats['mib_per_second']} MiB/s, "
+            f"{stats['segments']} segments"
+            f"{', resumed' if stats['resumed'] else ''})"
+        )
+        return stats
+
+    def probe(self, url: str) -> tuple[int | None, str, bool]:
+        """Return the size, ETag and range support of a file"""
+        try:
+            response = self.session.get(
+                url,
+                headers={"Range": "bytes=0-0"},
+                stream=True,
+                allow_redirects=True,
+                timeout=self.timeout,
+            )
+            response.close()
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise DownloadError(f"Could not reach {url}: {e}") from e
+
+        etag = response.headers.get("ETag", "")
+        content_range = response.headers.get("Content-Range", "")
+        if response.status_code == 206 and "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            if total != "*":
+                return int(total), etag, True
+
+        length = response.headers.get("Content-Length")
+        return (int(length) if length else None), etag, False
+
+    def plan(self, size: int) -> list[list[int]]:
+        """Split size bytes into [start, end, done] segments"""
+        count = max(1, min(self.segments, -(-size // self.min_segment_bytes)))
+        step = -(-size // count)
+        return [
+            [start, min(start + step, size) - 1, 0] for start in range(0, size, step)
+        ]
+
+    def load_state(self, part_path: str, url: str, size: int, etag: str) -> dict:
+        """Resume the saved progress of a download, or start a new one"""
+        try:
+            with open(f"{part_path}.json") as f:
+                state = json.load(f)
+            if (
+                state["url"] == url
+                and state["size"] == size
+                and state["etag"] == etag
+                and os.path.getsize(part_path) == size
+            ):
+                return state
+        except (OSError, ValueError, KeyError):
+            pass
+
+        self._discard(part_path)
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+        state = {"url": url, "size": size, "etag": etag, "segments": self.plan(size)}
+        self.save_state(part_path, state)
+        return state
+
+    def save_state(self, part_path: str, state: dict):
+        """Write download progress atomically"""
+        tmp_path = f"{part_path}.json.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, f"{part_path}.json")
+
+    def fetch_segments(self, url: str, part_path: str, state: dict):
+        """Fetch every unfinished segment concurrently into the part file"""
+        lock = threading.Lock()
+        saved_at = [time.monotonic()]
+
+        def progress(segment, written):
+            with lock:
+                segment[2] += written
+                if time.monotonic() - saved_at[0] >= 1:
+                    self.save_state(part_path, state)
+                    saved_at[0] = time.monotonic()
+
+        pending = [s for s in state["segments"] if s[0] + s[2] <= s[1]]
+        fd = os.open(part_path, os.O_WRONLY)
+        try:
+            with ThreadPoolExecutor(max_workers=max(len(pending), 1)) as executor:
+                futures = [
+                    executor.submit(
+                        self.fetch_segment, url, fd, segment, state["etag"], progress
+                    )
+                    for segment in pending
+                ]
+                errors = [f.exception() for f in futures if f.exception()]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+            with lock:
+                self.save_state(part_path, state)
+
+        for error in errors:
+            if isinstance(error, UpstreamChanged):
+                raise error
+        if errors:
+            raise errors[0]
+
+    def fetch_segment(self, url: str, fd: int, segment: list, etag: str, progress):
+        """Fetch one byte range, retrying from where it stopped"""
+        start, end, _ = segment
+        failures = 0
+        while start + segment[2] <= end:
+            offset = start + segment[2]
+            headers = {"Range": f"bytes={offset}-{end}"}
+            # Weak ETags can't be used with If-Range
+            if etag and not etag.startswith("W/"):
+                headers["If-Range"] = etag
+
+            try:
+                with self.session.get(
+                    url, headers=headers, stream=True, timeout=self.timeout
+                ) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206 or not response.headers.get(
+                        "Content-Range", ""
+                    ).startswith(f"bytes {offset}-"):
+                        raise UpstreamChanged(f"{url} changed upstream")
+                    if etag and response.headers.get("ETag", etag) != etag:
+                        raise UpstreamChanged(f"{url} changed upstream")
+
+                    for chunk in response.iter_content(self.chunk_bytes):
+                        chunk = chunk[: end + 1 - offset]
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                        DOWNLOADED_BYTES.inc(len(chunk))
+                        progress(segment, len(chunk))
+                        failures = 0
+                if offset <= end:
+                    raise DownloadError(f"{url}: connection closed at byte {offset}")
+            except UpstreamChanged:
+                raise
+            except (requests.RequestException, DownloadError) as e:
+                failures += 1
+                if failures > self.retries:
+                    raise DownloadError(f"Could not download {url}: {e}") from e
+                print(f"Retrying bytes {offset}-{end} of {url}: {e}")
+                time.sleep(min(2**failures / 2, 10))
+
+    def fetch_whole(self, url: str, part_path: str, size: int | None) -> int:
+        """Fetch a file in a single stream, for servers without ranges"""
+        try:
+            with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                written = 0
+                with open(part_path, "wb") as f:
+                    for chunk in response.iter_content(self.chunk_bytes):
+                        f.write(chunk)
+                        written += len(chunk)
+                        DOWNLOADED_BYTES.inc(len(chunk))
+        except requests.RequestException as e:
+            raise DownloadError(f"Could not download {url}: {e}") from e
+        return written
+
+    def _discard(self, part_path: str):
+        for stale in (part_path, f"{part_path}.json"):
+            if os.path.exists(stale):
+                os.unlink(stale)
+
+
+def download_file(url: str, path: str, **kwargs) -> dict:
+    """Download url to path with a RangeDownloader, see RangeDownloader.download"""
+    return RangeDownloader(**kwargs).download(url, path)
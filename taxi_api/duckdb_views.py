@@ -1,20 +1,266 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from rest_framework import status
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from .services import TaxiDataService
+from .conf import get_setting
+from .executor import async_view
+from .filters import TripFilters
+from .metrics import collect_timings, render_metrics, server_timing, timed
+from .od_matrix import ZONES
+from .parquet_cache import ParquetCache
+from .pool import PoolTimeout, get_connection_pool
+from .renderers import (
+    ArrowStreamRenderer,
+    CSVRenderer,
+    NDJSONRenderer,
+    ParquetRenderer,
+)
+from .services import (
+    TaxiDataService,
+    decode_cursor,
+    month_range,
+    parse_year_month,
+)
+from .singleflight import ColdLoadInProgress
+
+# Errors that clear up on their own, answered with a 503 and Retry-After
+RETRYABLE_ERRORS = (ColdLoadInProgress, PoolTimeout)
 
 
 class TaxiDataAPIView(APIView):
     """
     Base API view for taxi data using DuckDB service
+
+    Published months never change, so responses carry a strong ETag derived
+    from the source file fingerprint and the query, and matching
+    If-None-Match requests get a 304 without touching DuckDB.
+
+    Tabular endpoints can also answer in Arrow IPC or Parquet, chosen with
+    the Accept header or ?format=arrow|parquet; JSON stays the default.
+    Views with columnar = True also accept ?layout=columnar, which sends
+    JSON tables as one array per column under a schema header.
+
+    Stats, summary and heatmap accept ?approx=true to answer from a sample
+    of the month, with a <field>_moe margin of error next to each estimate.
+
+    Every endpoint accepts the trip filters described in get_filters().
+
+    Under ASGI the views are served asynchronously, with the DuckDB work
+    run on a bounded thread pool (see executor.py).
     """
 
+    renderer_classes = [
+        *api_settings.DEFAULT_RENDERER_CLASSES,
+        ArrowStreamRenderer,
+        ParquetRenderer,
+    ]
+    columnar = False
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return async_view(super().as_view(**initkwargs))
+
+    def get_service(self, request) -> TaxiDataService:
+        """Pooled service producing results in the negotiated format"""
+        service = TaxiDataService(pool=get_connection_pool())
+        renderer = getattr(request, "accepted_renderer", None)
+        if renderer and renderer.format in ("arrow", "parquet"):
+            service.output = "arrow"
+        elif self.columnar and request.GET.get("layout") == "columnar":
+            service.output = "columnar"
+        service.filters = self.get_filters(request)
+        # Kept so dispatch_cached() can tell whether every month loaded
+        self.services.append(service)
+        return service
+
+    def get_filters(self, request) -> TripFilters:
+        """
+        Trip filters from date_from/date_to (YYYY-MM-DD), hours (e.g. 7-9,17),
+        pickup_zone, dropoff_zone and payment_type (comma separated IDs)
+        """
+        try:
+            return TripFilters.from_query(request.GET)
+        except ValueError as e:
+            raise ParseError(str(e)) from e
+
+    def get_approx(self, request) -> bool:
+        """Whether the request trades exactness for speed with ?approx=true"""
+        return request.GET.get("approx", "").lower() in ("1", "true", "yes")
+
+    def get_limit(self, request, default, name="limit", clamp=True):
+        """
+        Parse a row limit, capped at TAXI_MAX_PAGE_SIZE unless clamp is False
+
+        A default of None leaves the result unlimited when the parameter is
+        absent.
+        """
+        if name not in request.GET:
+            return default
+        try:
+            limit = int(request.GET[name])
+        except ValueError:
+            raise ParseError(f"{name} must be an integer") from None
+        if limit < 1:
+            raise ParseError(f"{name} must be at least 1")
+        if clamp:
+            limit = min(limit, get_setting("TAXI_MAX_PAGE_SIZE", 1000))
+        return limit
+
     def get_year_month(self, request):
         """Extract year and month from request parameters"""
-        year = int(request.GET.get("year", 2023))
-        month = int(request.GET.get("month", 1))
-        return year, month
+        year = request.GET.get("year", 2023)
+        month = request.GET.get("month", 1)
+        try:
+            return parse_year_month(f"{year}-{month}")
+        except ValueError:
+            raise ParseError(
+                "year and month must be integers, with month from 1 to 12"
+            ) from None
+
+    def get_month_range(self, request):
+        """
+        Extract the first and last month of a request, inclusive
+
+        Accepts either year/month or start=YYYY-MM&end=YYYY-MM.
+        """
+        if "start" not in request.GET:
+            year_month = self.get_year_month(request)
+            return year_month, year_month
+
+        try:
+            start = parse_year_month(request.GET["start"])
+            end = parse_year_month(request.GET.get("end", request.GET["start"]))
+        except ValueError:
+            raise ParseError("start and end must be formatted as YYYY-MM") from None
+
+        max_months = get_setting("TAXI_MAX_RANGE_MONTHS", 24)
+        if end < start:
+            raise ParseError("end must not be before start")
+        if len(month_range(start, end)) > max_months:
+            raise ParseError(f"Ranges are limited to {max_months} months")
+        return start, end
+
+    def get_period(self, start, end) -> dict:
+        """Describe the requested months in the response payload"""
+        period = {"year": start[0], "month": start[1]}
+        if end != start:
+            period["start"] = f"{start[0]}-{start[1]:02d}"
+            period["end"] = f"{end[0]}-{end[1]:02d}"
+        return period
+
+    def retry_later(self, error: Exception) -> Response:
+        """
+        Tell the client to retry once another request finished loading, or
+        a pooled cursor is free again
+        """
+        return Response(
+            {"error": str(error), "retry_after": error.retry_after},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(error.retry_after)},
+        )
+
+    def handle_exception(self, exc):
+        """Answer retryable errors raised outside a view's own handling"""
+        # get_service() checks out a cursor before the view's try block
+        if isinstance(exc, RETRYABLE_ERRORS):
+            return self.retry_later(exc)
+        return super().handle_exception(exc)
+
+    def get_fingerprint(self, request, local_only: bool = False) -> str | None:
+        """Fingerprint of the source data behind a request"""
+        cache = ParquetCache()
+        fingerprints = []
+        for year, month in month_range(*self.get_month_range(request)):
+            if local_only and not cache.is_available(year, month):
+                return None
+            fingerprint = cache.fingerprint(year, month)
+            if not fingerprint:
+                return None
+            fingerprints.append(fingerprint)
+        return ":".join(fingerprints)
+
+    def get_etag(self, request, fingerprint: str) -> str:
+        """Strong ETag for the source data plus the query parameters"""
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        accept = request.META.get("HTTP_ACCEPT", "")
+        digest = hashlib.sha256(
+            f"{request.path}?{query}|{accept}|{fingerprint}".encode()
+        ).hexdigest()
+        return f'"{digest[:32]}"'
+
+    def is_completed_month(self, request) -> bool:
+        """Whether every month the request covers is already over"""
+        _, end = self.get_month_range(request)
+        today = timezone.now().date()
+        return end < (today.year, today.month)
+
+    def add_cache_headers(self, request, response, etag: str | None):
+        """
+        Attach ETag and Cache-Control headers to a response
+
+        Without an ETag the response is only cached briefly, so a partial
+        answer is soon asked for again.
+        """
+        if etag:
+            response["ETag"] = etag
+        if etag and self.is_completed_month(request):
+            patch_cache_control(
+                response, public=True, max_age=365 * 24 * 60 * 60, immutable=True
+            )
+        else:
+            patch_cache_control(response, public=True, max_age=5 * 60)
+        patch_vary_headers(response, ["Accept"])
+
+    def dispatch(self, request, *args, **kwargs):
+        """Serve the request and report how long each stage took"""
+        with collect_timings() as timings:
+            with timed("total"):
+                response = self.dispatch_cached(request, *args, **kwargs)
+                # Render here rather than in Django's handler, so it is timed
+                if hasattr(response, "render") and not response.is_rendered:
+                    with timed("render"):
+                        response.render()
+
+        response["Server-Timing"] = server_timing(timings)
+        return response
+
+    def dispatch_cached(self, request, *args, **kwargs):
+        """Answer conditional GETs from the ETag without touching DuckDB"""
+        self.services = []
+        if request.method not in ("GET", "HEAD"):
+            return super().dispatch(request, *args, **kwargs)
+
+        try:
+            fingerprint = self.get_fingerprint(request)
+        except (ValueError, ParseError):
+            fingerprint = None
+
+        if fingerprint:
+            etag = self.get_etag(request, fingerprint)
+            if_none_match = request.META.get("HTTP_IF_NONE_MATCH", "")
+            if etag in [tag.strip() for tag in if_none_match.split(",")]:
+                response = HttpResponseNotModified()
+                self.add_cache_headers(request, response, etag)
+                return response
+
+        response = super().dispatch(request, *args, **kwargs)
+
+        # Only cache responses built from real data, never the sample fallback
+        if fingerprint and response.status_code == 200:
+            if self.get_fingerprint(request, local_only=True) == fingerprint:
+                # A month that failed to load (or to build its rollup) leaves
+                # partial data, which must not be validated by the ETag
+                complete = all(service.complete for service in self.services)
+                self.add_cache_headers(request, response, etag if complete else None)
+        return response
 
 
 class TripSummaryView(TaxiDataAPIView):
@@ -23,14 +269,20 @@ class TripSummaryView(TaxiDataAPIView):
     Get daily trip summary statistics
     """
 
+    columnar = True
+
     def get(self, request):
-        year, month = self.get_year_month(request)
-        limit = int(request.GET.get("limit", 30))
+        start, end = self.get_month_range(request)
+        limit = self.get_limit(request, 30)
 
-        service = TaxiDataService()
+        service = self.get_service(request)
         try:
-            data = service.get_trip_summary(year, month, limit)
-            return Response({"year": year, "month": month, "data": data})
+            data = service.get_trip_summary(
+                *start, limit, end=end, approx=self.get_approx(request)
+            )
+            return Response({**self.get_period(start, end), "data": data})
+        except RETRYABLE_ERRORS as e:
+            return self.retry_later(e)
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -45,14 +297,20 @@ class HeatmapDataView(TaxiDataAPIView):
     Get pickup location data for heatmap
     """
 
+    columnar = True
+
     def get(self, request):
-        year, month = self.get_year_month(request)
-        limit = int(request.GET.get("limit", 1000))
+        start, end = self.get_month_range(request)
+        limit = self.get_limit(request, 1000)
 
-        service = TaxiDataService()
+        service = self.get_service(request)
         try:
-            data = service.get_heatmap_data(year, month, limit)
-            return Response({"year": year, "month": month, "data": data})
+            data = service.get_heatmap_data(
+                *start, limit, end=end, approx=self.get_approx(request)
+            )
+            return Response({**self.get_period(start, end), "data": data})
+        except RETRYABLE_ERRORS as e:
+            return self.retry_later(e)
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -67,13 +325,18 @@ class RevenueAnalyticsView(TaxiDataAPIView):
     Get revenue analytics by hour and day of week
     """
 
+    # Two tables in one payload, so JSON only
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+
     def get(self, request):
-        year, month = self.get_year_month(request)
+        start, end = self.get_month_range(request)
 
-        service = TaxiDataService()
+        service = self.get_service(request)
         try:
-            data = service.get_revenue_analytics(year, month)
-            return Response({"year": year, "month": month, "data": data})
+            data = service.get_revenue_analytics(*start, end=end)
+            return Response({**self.get_period(start, end), "data": data})
+        except RETRYABLE_ERRORS as e:
+            return self.retry_later(e)
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -89,12 +352,16 @@ class TripStatsView(TaxiDataAPIView):
     """
 
     def get(self, request):
-        year, month = self.get_year_month(request)
+        start, end = self.get_month_range(request)
 
-        service = TaxiDataService()
+        service = self.get_service(request)
         try:
-            data = service.get_trip_stats(year, month)
-            return Response({"year": year, "month": month, "data": data})
+            data = service.get_trip_stats(
+                *start, end=end, approx=self.get_approx(request)
+            )
+            return Response({**self.get_period(start, end), "data": data})
+        except RETRYABLE_ERRORS as e:
+            return self.retry_later(e)
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -106,19 +373,165 @@ class TripStatsView(TaxiDataAPIView):
 class SampleTripsView(TaxiDataAPIView):
     """
     GET /api/taxi-data/trips/
-    Get sample trips for display
+    Get trips newest first, one page at a time
+
+    Pass the "next" cursor of a response as ?cursor= to get the next page.
+    """
+
+    columnar = True
+
+    def get(self, request):
+        start, end = self.get_month_range(request)
+        limit = self.get_limit(request, 100)
+        cursor = self.get_cursor(request)
+
+        service = self.get_service(request)
+        try:
+            data, next_cursor = service.get_sample_trips(
+                *start, limit, end=end, cursor=cursor
+            )
+            count = data["length"] if isinstance(data, dict) else len(data)
+            return Response(
+                {
+                    **self.get_period(start, end),
+                    "count": count,
+                    "next": next_cursor,
+                    "data": data,
+                }
+            )
+        except RETRYABLE_ERRORS as e:
+            return self.retry_later(e)
+        except Exception as e:
+            return Response(
+                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        finally:
+            service.close()
+
+    def get_cursor(self, request):
+        """Decode the ?cursor= parameter, if any"""
+        if "cursor" not in request.GET:
+            return None
+        try:
+            return decode_cursor(request.GET["cursor"])
+        except ValueError as e:
+            raise ParseError(str(e)) from e
+
+
+class FlowsView(TaxiDataAPIView):
     """
+    GET /api/taxi-data/flows/
+    Get the busiest zone-to-zone flows, with median fare and duration
+
+    Pass ?origin=<zone id> for the top destinations of one pickup zone.
+    """
+
+    columnar = True
 
     def get(self, request):
-        year, month = self.get_year_month(request)
-        limit = int(request.GET.get("limit", 100))
+        start, end = self.get_month_range(request)
+        limit = self.get_limit(request, 10)
+        origin = request.GET.get("origin")
+        if origin is not None:
+            try:
+                origin = int(origin)
+            except ValueError:
+                raise ParseError("origin must be an integer") from None
+            if not 1 <= origin < ZONES:
+                raise ParseError(f"origin must be a zone ID from 1 to {ZONES - 1}")
 
-        service = TaxiDataService()
+        service = self.get_service(request)
         try:
-            data = service.get_sample_trips(year, month, limit)
+            data = service.get_flows(*start, origin, limit, end=end)
+            return Response({**self.get_period(start, end), "data": data})
+        except RETRYABLE_ERRORS as e:
+            return self.retry_later(e)
+        except Exception as e:
             return Response(
-                {"year": year, "month": month, "count": len(data), "data": data}
+                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        finally:
+            service.close()
+
+
+class TripExportView(TaxiDataAPIView):
+    """
+    GET /api/taxi-data/trips/export/
+    Stream every trip of a month range as NDJSON (default) or CSV
+
+    Rows are pulled from DuckDB in record batches while the client reads,
+    so a full month is exported without holding it in memory.
+    """
+
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+
+    def get(self, request):
+        start, end = self.get_month_range(request)
+        # An export streams the whole range unless asked for fewer rows
+        limit = self.get_limit(request, None, clamp=False)
+
+        service = self.get_service(request)
+        try:
+            reader = service.get_trip_batches(*start, end=end, limit=limit)
+        except RETRYABLE_ERRORS as e:
+            service.close()
+            return self.retry_later(e)
+        except Exception as e:
+            service.close()
+            return Response(
+                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        if reader is None:
+            service.close()
+            return Response(
+                {"error": "No trip data available for this period"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            self.stream(renderer, reader, service),
+            content_type=f"{renderer.media_type}; charset={renderer.charset}",
+        )
+        period = f"{start[0]}-{start[1]:02d}"
+        if end != start:
+            period += f"_{end[0]}-{end[1]:02d}"
+        response["Content-Disposition"] = (
+            f'attachment; filename="trips_{period}.{renderer.format}"'
+        )
+        return response
+
+    def stream(self, renderer, reader, service):
+        """Encode batches as the client consumes them, then release DuckDB"""
+        try:
+            yield from renderer.render_batches(reader)
+        finally:
+            reader.close()
+            service.close()
+
+
+class DashboardView(TaxiDataAPIView):
+    """
+    GET /api/taxi-data/dashboard/
+    Get summary, heatmap, revenue and stats for a month in one payload
+    """
+
+    # Several tables in one payload, so JSON only
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    columnar = True
+
+    def get(self, request):
+        start, end = self.get_month_range(request)
+        summary_limit = self.get_limit(request, 30, "summary_limit")
+        heatmap_limit = self.get_limit(request, 1000, "heatmap_limit")
+
+        service = self.get_service(request)
+        try:
+            data = service.get_dashboard(*start, summary_limit, heatmap_limit, end=end)
+            return Response({**self.get_period(start, end), "data": data})
+        except RETRYABLE_ERRORS as e:
+            return self.retry_later(e)
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -161,3 +574,17 @@ class DataStatusView(APIView):
                 ),
             }
         )
+
+
+class MetricsView(APIView):
+    """
+    GET /api/taxi-data/metrics/
+    Stage timings, cache and scan counters in the Prometheus text format
+
+    Metrics are kept per worker process, so each worker is scraped on its own.
+    """
+
+    def get(self, request):
+        return HttpResponse(
+            render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
@@ -0,0 +1,77 @@
+"""
+Run the blocking taxi API views off the ASGI event loop
+
+Under ASGI, Django runs every sync view on a single shared thread, so one
+request downloading or materializing a month would stall all the others,
+blog pages included. async_view() turns a view into a coroutine function
+that runs it on a bounded thread pool instead: warm requests keep being
+served while cold loads are in flight, and at most TAXI_VIEW_WORKERS
+requests touch DuckDB at once.
+
+Under WSGI the views keep working; Django simply runs the coroutine to
+completion on the worker thread.
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIRequest
+
+from .conf import get_setting
+
+_view_executor = None
+_view_executor_lock = threading.Lock()
+
+# Marks the end of a streamed response, see iterate_in_executor()
+_DONE = object()
+
+
+def get_view_executor() -> ThreadPoolExecutor:
+    """Bounded thread pool running the blocking part of taxi API requests"""
+    global _view_executor
+    with _view_executor_lock:
+        if _view_executor is None:
+            _view_executor = ThreadPoolExecutor(
+                # One request holds one pooled cursor, so more would only queue
+                max_workers=get_setting(
+                    "TAXI_VIEW_WORKERS", get_setting("TAXI_DUCKDB_POOL_SIZE", 8)
+                ),
+                thread_name_prefix="taxi-view",
+            )
+        return _view_executor
+
+
+async def run_in_executor(func, *args, **kwargs):
+    """Await func(*args, **kwargs) run on the view executor"""
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(get_view_executor(), call)
+
+
+async def iterate_in_executor(iterator):
+    """Async iterator pulling each item of a blocking iterator on the executor"""
+    iterator = iter(iterator)
+    while True:
+        item = await run_in_executor(next, iterator, _DONE)
+        if item is _DONE:
+            return
+        yield item
+
+
+def async_view(view):
+    """Wrap a sync view into an async one that runs it on the view executor"""
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        response = await run_in_executor(view, request, *args, **kwargs)
+        # ASGI would otherwise read a blocking stream to the end up front
+        if isinstance(request, ASGIRequest) and getattr(response, "streaming", False):
+            if not response.is_async:
+                response.streaming_content = iterate_in_executor(
+                    response.streaming_content
+                )
+        return response
+
+    return wrapper
@@ -0,0 +1,137 @@
+"""
+Trip filters shared by every taxi data endpoint
+
+Filters are validated from the query string and turned into predicates on
+the month relations with bound parameters. Comparisons on plain columns
+(pickup time, zones, payment type) are pushed by DuckDB into the parquet
+scan, so row groups outside the filter are skipped rather than read.
+"""
+
+import re
+from datetime import date, datetime, timedelta
+
+
+def parse_int_list(value: str, name: str, low: int, high: int) -> list[int]:
+    """Parse "1,4,7-9" into a sorted list of integers within [low, high]"""
+    numbers = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                first, last = (int(bound) for bound in part.split("-", 1))
+                numbers.update(range(first, last + 1))
+            else:
+                numbers.add(int(part))
+        except ValueError:
+            raise ValueError(f"{name} must be a list of numbers, got {value}") from None
+
+    if not numbers:
+        raise ValueError(f"{name} must not be empty")
+    if min(numbers) < low or max(numbers) > high:
+        raise ValueError(f"{name} values must be between {low} and {high}")
+    return sorted(numbers)
+
+
+class TripFilters:
+    """
+    Validated trip filters and their SQL predicates
+    """
+
+    def __init__(
+        self,
+        date_from: date = None,
+        date_to: date = None,
+        hours: list = None,
+        pickup_zones: list = None,
+        dropoff_zones: list = None,
+        payment_types: list = None,
+    ):
+        if date_from and date_to and date_from > date_to:
+            raise ValueError("date_from must not be after date_to")
+        self.date_from = date_from
+        self.date_to = date_to
+        self.hours = hours
+        self.pickup_zones = pickup_zones
+        self.dropoff_zones = dropoff_zones
+        self.payment_types = payment_types
+
+        self.predicates = []
+        self.params = {}
+        self.build()
+
+    @classmethod
+    def from_query(cls, query) -> "TripFilters":
+        """Parse filters from request query parameters, raising ValueError"""
+
+        def parse_date(name):
+            if not query.get(name):
+                return None
+            try:
+                return date.fromisoformat(query[name])
+            except ValueError:
+                raise ValueError(f"{name} must be formatted as YYYY-MM-DD") from None
+
+        def parse_list(name, low, high):
+            if name not in query:
+                return None
+            return parse_int_list(query[name], name, low, high)
+
+        return cls(
+            date_from=parse_date("date_from"),
+            date_to=parse_date("date_to"),
+            hours=parse_list("hours", 0, 23),
+            pickup_zones=parse_list("pickup_zone", 1, 265),
+            dropoff_zones=parse_list("dropoff_zone", 1, 265),
+            payment_types=parse_list("payment_type", 0, 6),
+        )
+
+    def build(self):
+        """Turn the filters into predicates and their bound parameters"""
+        if self.date_from:
+            self.predicates.append("pickup_datetime >= $date_from")
+            self.params["date_from"] = datetime.combine(
+                self.date_from, datetime.min.time()
+            )
+        if self.date_to:
+            # date_to is inclusive, so compare against the following midnight
+            self.predicates.append("pickup_datetime < $date_to")
+            self.params["date_to"] = datetime.combine(
+                self.date_to + timedelta(days=1), datetime.min.time()
+            )
+        if self.hours:
+            self.predicates.append("list_contains($hours, HOUR(pickup_datetime))")
+            self.params["hours"] = self.hours
+
+        for column, name, values in (
+            ("pickup_location_id", "pickup_zone", self.pickup_zones),
+            ("dropoff_location_id", "dropoff_zone", self.dropoff_zones),
+            ("payment_type", "payment_type", self.payment_types),
+        ):
+            if values:
+                # One parameter per value keeps the IN list pushable
+                names = [f"{name}_{index}" for index in range(len(values))]
+                placeholders = ", ".join(f"${param}" for param in names)
+                self.predicates.append(f"{column} IN ({placeholders})")
+                self.params.update(zip(names, values, strict=True))
+
+    def __bool__(self):
+        return bool(self.predicates)
+
+    def where(self, prefix: str = "WHERE") -> str:
+        """SQL condition combining every filter, empty without filters"""
+        if not self.predicates:
+            return ""
+        return f"{prefix} " + " AND ".join(self.predicates)
+
+    def apply(self, relation: str, alias: str = "trips") -> str:
+        """Relation with only the trips matching the filters"""
+        if not self.predicates:
+            return relation
+        return f"(SELECT * FROM {relation} {self.where()}) {alias}"
+
+    def params_for(self, query: str) -> dict:
+        """Bound parameters referenced by a query"""
+        names = set(re.findall(r"\$(\w+)", query))
+        return {name: value for name, value in self.params.items() if name in names}
@@ -0,0 +1,194 @@
+"""
+Local hive-partitioned parquet lake of NYC taxi trips
+
+Downloaded months are rewritten as
+
+    <lake>/taxi_type=yellow/year=2023/month=1/day=5/data_0.parquet
+
+with every file sorted on pickup time and split into small row groups, so
+file and row group min/max statistics let DuckDB skip everything outside a
+date filter. Trips whose pickup falls outside the file's month, which the
+TLC files do contain, are kept under day=0.
+
+Each build of a month is written to its own directory under _builds and
+records the upstream fingerprint it was built from. The month directory
+is a symlink to the current build, replaced atomically, so readers never
+see a half-written or missing month.
+
+Months are read with hive partitioning, so a predicate on the day
+partition (see partition_days) skips whole files before opening them.
+"""
+
+import calendar
+import glob
+import os
+import shutil
+import tempfile
+import threading
+from datetime import date
+
+from .conf import get_setting
+from .metrics import timed
+
+FINGERPRINT_FILE = "_fingerprint"
+BUILDS_DIR = "_builds"
+
+
+class TaxiLake:
+    """
+    Partitioned, sorted copy of the parquet cache
+    """
+
+    def __init__(self, lake_dir: str = None, row_group_size: int = None):
+        self.lake_dir = lake_dir or get_setting("TAXI_LAKE_DIR", "/tmp/taxi_lake")
+        self.row_group_size = row_group_size or get_setting(
+            "TAXI_LAKE_ROW_GROUP_SIZE", 32_768
+        )
+
+    def month_dir(self, year: int, month: int, taxi_type: str = "yellow") -> str:
+        """Directory holding the day partitions of a month"""
+        return os.path.join(
+            self.lake_dir, f"taxi_type={taxi_type}", f"year={year}", f"month={month}"
+        )
+
+    def month_glob(self, year: int, month: int, taxi_type: str = "yellow") -> str:
+        """Glob matching every parquet file of a month, for read_parquet"""
+        return os.path.join(self.month_dir(year, month, taxi_type), "*", "*.parquet")
+
+    def partition_days(
+        self, year: int, month: int, date_from: date = None, date_to: date = None
+    ) -> list[int] | None:
+        """
+        Day partitions of a month holding trips between two dates, inclusive
+
+        Returns None when every partition may hold such trips. Day 0, the
+        trips outside the file's month, is always kept.
+        """
+        month_start = date(year, month, 1)
+        month_end = date(year, month, calendar.monthrange(year, month)[1])
+        first = max(date_from or month_start, month_start)
+        last = min(date_to or month_end, month_end)
+        if first == month_start and last == month_end:
+            return None
+        if first > last:
+            return [0]
+        return [0, *range(first.day, last.day + 1)]
+
+    def fingerprint(self, year: int, month: int, taxi_type: str = "yellow"):
+        """Upstream fingerprint the month was built from, if it is in the lake"""
+        path = os.path.join(self.month_dir(year, month, taxi_type), FINGERPRINT_FILE)
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def find(
+        self, year: int, month: int, taxi_type: str = "yellow", fingerprint=None
+    ) -> str | None:
+        """
+        Return the month's directory if it is in the lake and up to date
+
+        Without a fingerprint to compare with, e.g. while upstream is
+        unreachable, any built copy of the month is used.
+        """
+        built = self.fingerprint(year, month, taxi_type)
+        if built and (fingerprint is None or built == fingerprint):
+            return self.month_dir(year, month, taxi_type)
+        return None
+
+    def months(self, taxi_type: str = "yellow") -> list[tuple[int, int]]:
+        """List the (year, month) pairs built into the lake"""
+        pattern = os.path.join(
+            self.lake_dir, f"taxi_type={taxi_type}", "year=*", "month=*"
+        )
+        months = []
+        for path in glob.glob(os.path.join(pattern, FINGERPRINT_FILE)):
+            month_dir = os.path.dirname(path)
+            year = os.path.basename(os.path.dirname(month_dir)).split("=")[1]
+            month = os.path.basename(month_dir).split("=")[1]
+            months.append((int(year), int(month)))
+        return sorted(months)
+
+    def build(
+        self,
+        conn,
+        relation: str,
+        year: int,
+        month: int,
+        taxi_type: str,
+        fingerprint: str,
+    ) -> str:
+        """Rewrite a month relation into the lake, replacing any older build"""
+        month_dir = self.month_dir(year, month, taxi_type)
+        parent = os.path.dirname(month_dir)
+        suffix = f"{os.getpid()}.{threading.get_ident()}"
+        builds_dir = os.path.join(self.lake_dir, BUILDS_DIR)
+        # Dot files stay out of the month=* globs of readers
+        tmp_link = os.path.join(parent, f".{os.path.basename(month_dir)}.{suffix}")
+        os.makedirs(parent, exist_ok=True)
+        os.makedirs(builds_dir, exist_ok=True)
+        build_dir = tempfile.mkdtemp(
+            prefix=f"{taxi_type}_{year}-{month:02d}_{fingerprint}.", dir=builds_dir
+        )
+
+        try:
+            with timed("lake_build"):
+                conn.execute(
+                    f"""
+                    COPY (
+                        SELECT
+                            *,
+                            CASE
+                                WHEN YEAR(pickup_datetime) = {year}
+                                    AND MONTH(pickup_datetime) = {month}
+                                THEN DAY(pickup_datetime)
+                                ELSE 0
+                            END AS day
+                        FROM {relation}
+                        ORDER BY pickup_datetime, trip_id
+                    ) TO '{build_dir}' (
+                        FORMAT PARQUET,
+                        PARTITION_BY (day),
+                        ROW_GROUP_SIZE {self.row_group_size},
+                        COMPRESSION ZSTD
+                    )
+                    """
+                )
+            with open(os.path.join(build_dir, FINGERPRINT_FILE), "w") as f:
+                f.write(fingerprint)
+
+            replaced = (
+                os.path.realpath(month_dir) if os.path.islink(month_dir) else None
+            )
+            if os.path.isdir(month_dir) and not replaced:
+                # A month built before builds were versioned
+                shutil.rmtree(month_dir)
+            os.symlink(os.path.relpath(build_dir, parent), tmp_link)
+            os.replace(tmp_link, month_dir)
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+        finally:
+            if os.path.lexists(tmp_link):
+                os.unlink(tmp_link)
+
+        self.remove_stale(year, month, taxi_type, keep=(build_dir, replaced))
+        print(f"Built {month_dir}")
+        return month_dir
+
+    def remove_stale(self, year: int, month: int, taxi_type: str, keep: tuple):
+        """
+        Delete older builds of a month
+
+        The build just replaced is kept until the next one, so queries that
+        listed its files before the swap can still read them.
+        """
+        pattern = os.path.join(
+            self.lake_dir, BUILDS_DIR, f"{taxi_type}_{year}-{month:02d}_*"
+        )
+        for build_dir in glob.glob(pattern):
+            if os.path.realpath(build_dir) not in [
+                os.path.realpath(path) for path in keep if path
+            ]:
+                shutil.rmtree(build_dir, ignore_errors=True)
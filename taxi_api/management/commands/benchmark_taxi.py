@@ -0,0 +1,116 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Settings pointed at the benchmark's own directories, so synthetic months
+# never mix with the real parquet cache and rollups
+ISOLATED_SETTINGS = {
+    "TAXI_CACHE_DIR": "cache",
+    "TAXI_ROLLUP_DIR": "rollups",
+    "TAXI_SORTED_DIR": "sorted",
+    "TAXI_LAKE_DIR": "lake",
+}
+
+
+def run_isolated(work_dir: str, **kwargs) -> dict:
+    """Run one benchmark size in a fresh process with isolated settings"""
+    for name, subdir in ISOLATED_SETTINGS.items():
+        os.environ[name] = os.path.join(work_dir, subdir)
+        # Synthetic months are kept, derived files are rebuilt on cold calls
+        if name != "TAXI_CACHE_DIR":
+            shutil.rmtree(os.environ[name], ignore_errors=True)
+    # Nothing may be fetched from upstream, nor evicted mid-run
+    os.environ["TAXI_BASE_URL"] = "http://127.0.0.1:9/offline"
+    os.environ["TAXI_CACHE_MAX_BYTES"] = str(1024**4)
+    os.environ["TAXI_WARMUP_MONTHS"] = ""
+
+    import django
+
+    django.setup()
+
+    from taxi_api.benchmark import run_benchmark
+
+    # Keep stdout for the JSON report, progress and service logs go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        return run_benchmark(**kwargs)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the taxi data service offline on synthetic parquet months"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            nargs="+",
+            type=int,
+            default=[1_000_000],
+            help="Trips per month, one run per size (e.g. --rows 1000000 10000000)",
+        )
+        parser.add_argument(
+            "--months",
+            type=int,
+            default=1,
+            help="Consecutive months to generate and query, from 2023-01 (default: 1)",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=10,
+            help="Warm calls timed per case after the cold one (default: 10)",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seed of the synthetic data (default: 0)",
+        )
+        parser.add_argument(
+            "--work-dir",
+            default="/tmp/taxi_benchmark",
+            help="Where synthetic months and derived files are kept between runs",
+        )
+        parser.add_argument(
+            "--output",
+            help="Write the JSON report to this file instead of stdout",
+        )
+
+    def handle(self, *args, **options):
+        if options["months"] < 1 or options["iterations"] < 1:
+            raise CommandError("--months and --iterations must be at least 1")
+
+        runs = []
+        for rows in options["rows"]:
+            self.stderr.write(f"Benchmarking {rows:,} rows per month...")
+            work_dir = os.path.join(options["work_dir"], f"{rows}_{options['seed']}")
+
+            # A fresh process per size keeps DuckDB state and peak RSS apart
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                future = executor.submit(
+                    run_isolated,
+                    work_dir,
+                    rows=rows,
+                    months=options["months"],
+                    iterations=options["iterations"],
+                    seed=options["seed"],
+                    progress=None,
+                )
+                try:
+                    runs.append(future.result())
+                except Exception as e:
+                    raise CommandError(f"Benchmark of {rows:,} rows failed: {e}") from e
+
+        report = json.dumps({"runs": runs}, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(report + "\n")
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(report)
@@ -0,0 +1,98 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from taxi_api.management.months import get_months
+from taxi_api.services import TaxiDataService
+from taxi_api.singleflight import get_single_flight
+
+
+class Command(BaseCommand):
+    help = "Rewrite downloaded taxi months into a partitioned, sorted parquet lake"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months",
+            nargs="+",
+            help="Months to build as YYYY-MM (e.g. --months 2023-01 2023-02)",
+        )
+        parser.add_argument("--start", help="First month of a range (YYYY-MM)")
+        parser.add_argument("--end", help="Last month of a range (YYYY-MM)")
+        parser.add_argument(
+            "--taxi-type",
+            default="yellow",
+            help="Taxi type to build (default: yellow)",
+        )
+        parser.add_argument(
+            "--row-group-size",
+            type=int,
+            help="Rows per parquet row group (default: TAXI_LAKE_ROW_GROUP_SIZE)",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Rebuild months that are already up to date in the lake",
+        )
+
+    def handle(self, *args, **options):
+        months = get_months(options)
+        if not months:
+            raise CommandError("Pass --months or --start/--end")
+
+        taxi_type = options["taxi_type"]
+        service = TaxiDataService()
+        if options["row_group_size"]:
+            service.lake.row_group_size = options["row_group_size"]
+        self.stdout.write(f"Building {len(months)} month(s) in {service.lake.lake_dir}")
+
+        built = 0
+        try:
+            for year, month in months:
+                label = f"{taxi_type} {year}-{month:02d}"
+                started = time.monotonic()
+                try:
+                    status = self.build_month(
+                        service, year, month, taxi_type, options["force"]
+                    )
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f"{label} failed: {e}"))
+                    continue
+
+                if status is None:
+                    self.stdout.write(self.style.WARNING(f"{label} is not available"))
+                    continue
+
+                built += 1
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    self.style.SUCCESS(f"{label} {status} in {elapsed:.1f}s")
+                )
+        finally:
+            service.close()
+
+        style = self.style.SUCCESS if built == len(months) else self.style.WARNING
+        self.stdout.write(style(f"{built}/{len(months)} month(s) in the lake"))
+
+    def build_month(self, service, year, month, taxi_type, force):
+        """Rewrite one month unless the lake already has its current version"""
+        parquet_path = service.cache.fetch(year, month, taxi_type)
+        if not parquet_path:
+            return None
+
+        fingerprint = service.cache.fingerprint_from_path(parquet_path)
+        if not force and service.lake.find(year, month, taxi_type, fingerprint):
+            return "already up to date"
+
+        key = service.cache.month_key(year, month, taxi_type)
+        get_single_flight().do(
+            f"lake-{key}",
+            lambda: service.lake.build(
+                service.conn,
+                f"({service.month_source(parquet_path)})",
+                year,
+                month,
+                taxi_type,
+                fingerprint,
+            ),
+        )
+        return "built"
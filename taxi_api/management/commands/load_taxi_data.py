@@ -4,12 +4,35 @@ from decimal import Decimal
 
 import duckdb
 import requests
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import connection
+from django.db import connection, transaction
 from django.db.utils import OperationalError
+from django.utils import timezone
 
+from taxi_api.copy_loader import copy_batches
+from taxi_api.downloader import download_file
 from taxi_api.models import TaxiTrip, TaxiZone
 
+# Cleaned columns written by the COPY path, with the defaults the ORM path
+# applies per row; the coordinate fields are never set and stay NULL
+COPY_COLUMNS = {
+    "vendor_id": "COALESCE(NULLIF(vendor_id, 0), 1)",
+    "pickup_datetime": "pickup_datetime",
+    "dropoff_datetime": "dropoff_datetime",
+    "passenger_count": "TRUNC(COALESCE(NULLIF(passenger_count, 0), 1))::BIGINT",
+    "trip_distance": "COALESCE(trip_distance, 0)",
+    "pickup_location_id": "NULLIF(pickup_location_id, 0)",
+    "dropoff_location_id": "NULLIF(dropoff_location_id, 0)",
+    "fare_amount": "COALESCE(fare_amount, 0)",
+    "extra": "COALESCE(extra, 0)",
+    "mta_tax": "COALESCE(mta_tax, 0)",
+    "tip_amount": "COALESCE(tip_amount, 0)",
+    "tolls_amount": "COALESCE(tolls_amount, 0)",
+    "total_amount": "COALESCE(total_amount, 0)",
+    "payment_type": "COALESCE(NULLIF(payment_type, 0), 1)",
+}
+
 
 class Command(BaseCommand):
     help = "Load NYC Taxi data from parquet files"
@@ -41,6 +64,15 @@ class Command(BaseCommand):
             action="store_true",
             help="Clear existing data before loading",
         )
+        parser.add_argument(
+            "--method",
+            choices=["orm", "copy"],
+            default="orm",
+            help=(
+                "Insert trips with bulk_create, or stream them with PostgreSQL "
+                "COPY through a staging table (default: orm)"
+            ),
+        )
 
     def handle(self, *args, **options):
         sample_size = options["sample_size"]
@@ -49,11 +81,17 @@ class Command(BaseCommand):
         clear_data = options["clear_data"]
         get_all = options["get_all"]
         batch_size = options["batch_size"]
+        method = options["method"]
 
         # Wait for database to be ready
         self.wait_for_db()
 
-        if clear_data:
+        if clear_data and method == "copy":
+            # Swapped out in the same transaction that adds the new trips
+            self.stdout.write(
+                self.style.WARNING("Existing data will be replaced once loaded.")
+            )
+        elif clear_data:
             self.stdout.write(self.style.WARNING("Clearing existing data..."))
             TaxiTrip.objects.all().delete()
             self.stdout.write(self.style.SUCCESS("Existing data cleared."))
@@ -62,7 +100,15 @@ class Command(BaseCommand):
         self.load_taxi_zones()
 
         # Load trip data
-        self.load_trip_data(year, month, sample_size, get_all, batch_size)
+        self.load_trip_data(
+            year,
+            month,
+            sample_size,
+            get_all,
+            batch_size,
+            method=method,
+            replace=clear_data,
+        )
 
     def wait_for_db(self):
         """Wait for database to be available"""
@@ -148,7 +194,16 @@ class Command(BaseCommand):
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"Error loading taxi zones: {str(e)}"))
 
-    def load_trip_data(self, year, month, sample_size, get_all, batch_size):
+    def load_trip_data(
+        self,
+        year,
+        month,
+        sample_size,
+        get_all,
+        batch_size,
+        method="orm",
+        replace=False,
+    ):
         """Load trip data from NYC taxi dataset using DuckDB"""
         self.stdout.write(f"Loading trip data for {year}-{month:02d}...")
 
@@ -161,15 +216,9 @@ class Command(BaseCommand):
         try:
             self.stdout.write(f"Downloading data from: {url}")
 
-            # Download parquet file
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-
-            # Save to temporary file
-            temp_file = "/tmp/taxi_data.parquet"
-            with open(temp_file, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            # Download parquet file as parallel, resumable range requests
+            temp_file = f"/tmp/taxi_data_{year}_{month:02d}.parquet"
+            download_file(url, temp_file)
 
             # Connect to DuckDB
             conn = duckdb.connect()
@@ -184,18 +233,23 @@ class Command(BaseCommand):
             if get_all:
                 self.stdout.write("Loading all records in batches...")
                 records_to_process = total_records
-                self.process_all_records(conn, temp_file, batch_size, total_records)
+                query = self.cleaned_query(temp_file)
             elif sample_size:
                 records_to_process = min(sample_size, total_records)
                 self.stdout.write(f"Loading {records_to_process:,} records...")
-                self.process_sample_records(conn, temp_file, sample_size, batch_size)
+                query = self.cleaned_query(temp_file, sample_size)
             else:
                 # Smaller default sample
                 records_to_process = min(1000, total_records)
                 self.stdout.write(
                     f"Loading default sample of {records_to_process:,} " f"records..."
                 )
-                self.process_sample_records(conn, temp_file, 1000, batch_size)
+                query = self.cleaned_query(temp_file, 1000)
+
+            if method == "copy":
+                self.copy_records(conn, query, batch_size, replace=replace)
+            else:
+                self.process_records(conn, query, batch_size, records_to_process)
 
             conn.close()
 
@@ -207,110 +261,94 @@ class Command(BaseCommand):
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"Error loading trip data: {str(e)}"))
 
-    def process_all_records(self, conn, temp_file, batch_size, total_records):
-        """Process all records in batches using DuckDB"""
-        num_batches = (total_records + batch_size - 1) // batch_size
-        total_loaded = 0
+    def process_records(self, conn, query, batch_size, total_records):
+        """
+        Stream cleaned records into the database one batch at a time
 
-        for batch_idx in range(num_batches):
-            start_idx = batch_idx * batch_size
-            end_idx = min(start_idx + batch_size, total_records)
+        DuckDB scans the file once and hands rows over as they are fetched,
+        so ingest time is linear in rows and memory stays bounded by
+        batch_size however large the month is.
+        """
+        result = conn.execute(query)
+        total_loaded = 0
+        processed = 0
+        batch_num = 0
 
+        while rows := result.fetchmany(batch_size):
+            batch_num += 1
+            start_idx = processed
+            processed += len(rows)
             self.stdout.write(
-                f"Processing batch {batch_idx + 1}/{num_batches}: "
-                f"records {start_idx+1:,} to {end_idx:,}"
+                f"Processing batch {batch_num}: "
+                f"records {start_idx+1:,} to {processed:,}"
             )
 
-            # Use DuckDB to read a chunk with data cleaning
-            chunk_data = self.get_cleaned_chunk(conn, temp_file, start_idx, batch_size)
-
-            if chunk_data:
-                loaded_count = self.load_trips_to_db_duckdb(
-                    chunk_data, batch_num=batch_idx + 1
-                )
-                total_loaded += loaded_count
+            total_loaded += self.load_trips_to_db_duckdb(rows, batch_num=batch_num)
 
-            # Progress update
-            progress = (end_idx / total_records) * 100
+            # Progress update, against the raw row count as cleaning drops some
+            progress = min(processed / max(total_records, 1), 1) * 100
             self.stdout.write(
-                f"Progress: {progress:.1f}% ({end_idx:,}/{total_records:,} " f"records)"
+                f"Progress: {progress:.1f}% ({processed:,}/{total_records:,} records)"
             )
 
-        self.stdout.write(self.style.SUCCESS(f"Loaded {total_loaded:,} valid trips"))
-
-    def process_sample_records(self, conn, temp_file, sample_size, batch_size):
-        """Process a sample of records using DuckDB"""
-        # Get sample data using DuckDB's SAMPLE function
-        sample_data = self.get_cleaned_sample(conn, temp_file, sample_size)
-
-        if not sample_data:
+        if not processed:
             self.stdout.write(self.style.WARNING("No valid data found"))
             return
 
-        # Process in batches
-        total_loaded = 0
-        num_batches = (len(sample_data) + batch_size - 1) // batch_size
+        self.stdout.write(self.style.SUCCESS(f"Loaded {total_loaded:,} valid trips"))
 
-        for batch_idx in range(num_batches):
-            start_idx = batch_idx * batch_size
-            end_idx = min(start_idx + batch_size, len(sample_data))
+    def copy_records(self, conn, query, batch_size, replace=False):
+        """
+        Stream cleaned records into PostgreSQL with COPY, without row objects
 
-            self.stdout.write(
-                f"Processing batch {batch_idx + 1}/{num_batches}: "
-                f"records {start_idx+1:,} to {end_idx:,}"
+        DuckDB applies the ORM path's defaults in SQL and hands over Arrow
+        batches, which copy_batches() streams through a staging table. The
+        trips move into the real table in the same transaction, together
+        with the removal of the old ones when replacing, so readers see
+        either the old trips or all of the new ones.
+        """
+        expressions = ",\n            ".join(
+            f"{expression} AS {name}" for name, expression in COPY_COLUMNS.items()
+        )
+        reader = conn.execute(
+            f"""
+            SELECT
+                {expressions}
+            FROM ({query}) trips
+            """
+        ).to_arrow_reader(batch_size)
+
+        def progress(batch_num, copied):
+            self.stdout.write(f"Copied batch {batch_num}: {copied:,} records")
+
+        started = time.perf_counter()
+        with transaction.atomic(), connection.cursor() as cursor:
+            if settings.USE_TZ:
+                # Naive file timestamps mean the same as they do through the ORM
+                cursor.execute(
+                    "SET LOCAL TIME ZONE %s", [timezone.get_default_timezone_name()]
+                )
+            copied = copy_batches(
+                cursor,
+                reader,
+                TaxiTrip._meta.db_table,
+                [TaxiTrip._meta.get_field(name).column for name in COPY_COLUMNS],
+                replace=replace,
+                progress=progress,
             )
 
-            batch_data = sample_data[start_idx:end_idx]
-            loaded_count = self.load_trips_to_db_duckdb(
-                batch_data, batch_num=batch_idx + 1
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Loaded {copied:,} valid trips in {elapsed:.1f}s "
+                f"({copied / max(elapsed, 1e-6):,.0f} rows/s)"
             )
-            total_loaded += loaded_count
-
-        self.stdout.write(self.style.SUCCESS(f"Loaded {total_loaded:,} valid trips"))
-
-    def get_cleaned_chunk(self, conn, temp_file, offset, limit):
-        """Get a cleaned chunk of data using DuckDB"""
-        query = f"""
-        SELECT 
-            VendorID as vendor_id,
-            tpep_pickup_datetime as pickup_datetime,
-            tpep_dropoff_datetime as dropoff_datetime,
-            passenger_count,
-            trip_distance,
-            NULL as pickup_longitude,
-            NULL as pickup_latitude,
-            NULL as dropoff_longitude,
-            NULL as dropoff_latitude,
-            PULocationID as pickup_location_id,
-            DOLocationID as dropoff_location_id,
-            fare_amount,
-            extra,
-            mta_tax,
-            tip_amount,
-            tolls_amount,
-            total_amount,
-            payment_type
-        FROM (
-            SELECT * FROM read_parquet('{temp_file}')
-            WHERE fare_amount >= 0 
-              AND total_amount >= 0 
-              AND trip_distance >= 0
-              AND passenger_count > 0 
-              AND passenger_count <= 9
-            LIMIT {limit} OFFSET {offset}
-        ) t
-        """
-
-        try:
-            return conn.execute(query).fetchall()
-        except Exception as e:
-            self.stdout.write(self.style.WARNING(f"Error reading chunk: {str(e)}"))
-            return []
+        )
 
-    def get_cleaned_sample(self, conn, temp_file, sample_size):
-        """Get a cleaned sample of data using DuckDB"""
-        # Query adapted for the actual column structure
-        query = f"""
+    def cleaned_query(self, temp_file, sample_size=None):
+        """Query selecting the valid trips of a file, or a sample of them"""
+        sample = f"USING SAMPLE {sample_size}" if sample_size else ""
+        return f"""
         SELECT 
             VendorID as vendor_id,
             tpep_pickup_datetime as pickup_datetime,
@@ -337,16 +375,10 @@ class Command(BaseCommand):
               AND trip_distance >= 0
               AND passenger_count > 0 
               AND passenger_count <= 9
-            USING SAMPLE {sample_size}
+            {sample}
         ) t
         """
 
-        try:
-            return conn.execute(query).fetchall()
-        except Exception as e:
-            self.stdout.write(self.style.WARNING(f"Error reading sample: {str(e)}"))
-            return []
-
     def load_trips_to_db_duckdb(self, data, batch_num=None):
         """Load trips to database from DuckDB results with retry logic"""
         if batch_num:
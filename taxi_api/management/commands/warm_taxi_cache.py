@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from taxi_api.management.months import get_months
+from taxi_api.warmup import warm_months
+
+
+class Command(BaseCommand):
+    help = "Prefetch taxi parquet files and prebuild their rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months",
+            nargs="+",
+            help="Months to warm as YYYY-MM (e.g. --months 2023-01 2023-02)",
+        )
+        parser.add_argument("--start", help="First month of a range (YYYY-MM)")
+        parser.add_argument("--end", help="Last month of a range (YYYY-MM)")
+        parser.add_argument(
+            "--taxi-type",
+            default="yellow",
+            help="Taxi type to warm (default: yellow)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=2,
+            help="Number of months to warm in parallel (default: 2)",
+        )
+
+    def handle(self, *args, **options):
+        months = get_months(options)
+        if not months:
+            raise CommandError("Pass --months or --start/--end")
+
+        self.stdout.write(
+            f"Warming {len(months)} month(s) with {options['workers']} worker(s)..."
+        )
+
+        warmed = warm_months(
+            months,
+            taxi_type=options["taxi_type"],
+            workers=options["workers"],
+            progress=self.progress,
+        )
+
+        style = self.style.SUCCESS if warmed == len(months) else self.style.WARNING
+        self.stdout.write(style(f"Warmed {warmed}/{len(months)} month(s)"))
+
+    def progress(self, message, ok=True):
+        """Write one line of progress output"""
+        style = self.style.SUCCESS if ok else self.style.WARNING
+        self.stdout.write(style(message))
@@ -0,0 +1,19 @@
+"""Month selection shared by the management commands"""
+
+from django.core.management.base import CommandError
+
+from taxi_api.services import month_range, parse_year_month
+
+
+def get_months(options) -> list[tuple[int, int]]:
+    """Collect the months of --months and --start/--end, sorted and unique"""
+    try:
+        months = [parse_year_month(value) for value in options["months"] or []]
+        if options["start"]:
+            start = parse_year_month(options["start"])
+            end = parse_year_month(options["end"] or options["start"])
+            months += month_range(start, end)
+    except ValueError as e:
+        raise CommandError(f"Months must be formatted as YYYY-MM: {e}") from e
+
+    return sorted(set(months))
@@ -0,0 +1,121 @@
+"""
+Memory budget of the DuckDB database shared by a worker's requests
+
+configure_database() applies the memory_limit, threads and spill
+temp_directory settings. MaterializedTables measures the memory each
+month table takes and keeps their total within TAXI_MATERIALIZED_MAX_BYTES
+by dropping the least recently used ones; a dropped month is simply
+registered again, from the parquet cache, the next time it is needed.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .conf import get_setting
+
+
+def configure_database(conn):
+    """Apply the memory, thread and spill settings to a DuckDB database"""
+    memory_limit = get_setting("TAXI_DUCKDB_MEMORY_LIMIT", "")
+    threads = get_setting("TAXI_DUCKDB_THREADS", 0)
+    temp_directory = get_setting("TAXI_DUCKDB_TEMP_DIR", "")
+
+    if memory_limit:
+        conn.execute(f"SET memory_limit = '{memory_limit}'")
+    if threads:
+        conn.execute(f"SET threads = {int(threads)}")
+    if temp_directory:
+        os.makedirs(temp_directory, exist_ok=True)
+        conn.execute(f"SET temp_directory = '{temp_directory}'")
+
+
+def in_memory_bytes(conn) -> int:
+    """Bytes held by every in-memory table of a database"""
+    row = conn.execute(
+        """
+        SELECT memory_usage_bytes
+        FROM duckdb_memory()
+        WHERE tag = 'IN_MEMORY_TABLE'
+        """
+    ).fetchone()
+    return row[0] if row else 0
+
+
+class MaterializedTables:
+    """
+    Least-recently-used accounting of the month tables of one database
+
+    Tables used within the last min_idle_seconds are never dropped, since
+    a request that just looked one up may still be about to query it; the
+    budget can be overshot until they go idle.
+    """
+
+    def __init__(self, max_bytes: int = None, min_idle_seconds: float = None):
+        self.max_bytes = max_bytes or get_setting(
+            "TAXI_MATERIALIZED_MAX_BYTES", 1024**3
+        )
+        self.min_idle_seconds = min_idle_seconds or get_setting(
+            "TAXI_MATERIALIZED_MIN_IDLE_SECONDS", 30
+        )
+        # table name -> (bytes, last used), least recently used first
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+        # Tables are created one at a time so each one's growth is its own
+        self._create_lock = threading.Lock()
+
+    def create(self, conn, table_name: str, query: str):
+        """Create a table from a query, then evict others if over budget"""
+        with self._create_lock:
+            before = in_memory_bytes(conn)
+            conn.execute(f"CREATE OR REPLACE TABLE {table_name} AS {query}")
+            size = max(in_memory_bytes(conn) - before, 0)
+
+        with self._lock:
+            self._tables[table_name] = (size, time.monotonic())
+            self._tables.move_to_end(table_name)
+        print(f"Materialized {table_name}: {size / 1024**2:.0f} MiB")
+        self.evict(conn)
+
+    def touch(self, table_name: str):
+        """Mark a table as recently used"""
+        with self._lock:
+            if table_name in self._tables:
+                self._tables[table_name] = (
+                    self._tables[table_name][0],
+                    time.monotonic(),
+                )
+                self._tables.move_to_end(table_name)
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(size for size, _ in self._tables.values())
+
+    def evict(self, conn):
+        """Drop least recently used idle tables until the budget is met"""
+        while True:
+            idle_before = time.monotonic() - self.min_idle_seconds
+            with self._lock:
+                total = sum(size for size, _ in self._tables.values())
+                victims = [
+                    name
+                    for name, (_, last_used) in self._tables.items()
+                    if last_used < idle_before
+                ]
+                if total <= self.max_bytes or not victims:
+                    return
+                victim = victims[0]
+                del self._tables[victim]
+
+            conn.execute(f"DROP TABLE IF EXISTS {victim}")
+            print(f"Evicted table {victim} from memory")
+
+    def stats(self) -> dict:
+        """Current budget usage"""
+        with self._lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "total_bytes": sum(size for size, _ in self._tables.values()),
+                "tables": {name: size for name, (size, _) in self._tables.items()},
+            }
@@ -0,0 +1,187 @@
+"""
+Stage timings and Prometheus metrics for the taxi data service
+
+Code wraps each expensive stage (download, registration, rollup builds,
+queries, rendering) in timed(stage). The duration feeds a per-process
+histogram, and is also added to the timings of the current request, which
+TaxiDataAPIView sends back as a Server-Timing header.
+
+Metrics are kept per worker process; render_metrics() formats them in the
+Prometheus text exposition format.
+"""
+
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from a cached query to a cold month download
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    """Render a label set as {name="value",...}"""
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        # Unlabelled counters are reported from zero, before the first inc()
+        self._values = {} if labels else {(): 0}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labels, key)} {value}"
+
+
+class Histogram:
+    """Cumulative histogram of observed values, optionally split by labels"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(c), s, n) for key, (c, s, n) in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts, strict=True):
+                labels = format_labels(self.labels, key, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {bucket_count}"
+            labels = format_labels(self.labels, key, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels} {count}"
+            yield f"{self.name}_sum{format_labels(self.labels, key)} {total}"
+            yield f"{self.name}_count{format_labels(self.labels, key)} {count}"
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram(
+    "taxi_stage_seconds", "Time spent in each stage of a request", ("stage",)
+)
+CACHE_REQUESTS = Counter(
+    "taxi_parquet_cache_requests_total",
+    "Parquet cache lookups by result (hit or miss)",
+    ("result",),
+)
+DOWNLOADED_BYTES = Counter(
+    "taxi_downloaded_bytes_total", "Bytes of parquet downloaded from upstream"
+)
+REMOTE_BLOCKS = Counter(
+    "taxi_remote_block_requests_total",
+    "Remote parquet block reads by result (hit or miss)",
+    ("result",),
+)
+ROWS_SCANNED = Counter(
+    "taxi_rows_scanned_total", "Rows read by DuckDB to answer queries"
+)
+ROWS_RETURNED = Counter("taxi_rows_returned_total", "Rows returned by queries")
+
+# Stage durations of the request being served, see collect_timings()
+_timings = contextvars.ContextVar("taxi_timings", default=None)
+
+
+@contextmanager
+def timed(stage: str):
+    """Time a block as one stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+@contextmanager
+def collect_timings():
+    """Collect the stage timings of everything run inside the block"""
+    timings = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def server_timing(timings: list) -> str:
+    """Format stage timings as a Server-Timing header, summing repeated stages"""
+    totals = {}
+    for stage, elapsed in timings:
+        totals[stage] = totals.get(stage, 0) + elapsed
+    return ", ".join(
+        f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in totals.items()
+    )
+
+
+def enable_scan_metrics(conn):
+    """Have DuckDB count the rows each query on a connection scans"""
+    conn.execute("SET enable_profiling = 'no_output'")
+    conn.execute(
+        """SET custom_profiling_settings = '{"CUMULATIVE_ROWS_SCANNED": "true"}'"""
+    )
+
+
+def record_rows_scanned(conn):
+    """Add the rows scanned by the last query of a connection to the metrics"""
+    try:
+        info = json.loads(conn.get_profiling_information(format="json"))
+    except Exception:
+        return
+    ROWS_SCANNED.inc(info.get("cumulative_rows_scanned", 0))
+
+
+def render_metrics() -> str:
+    """Every metric of this process in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,148 @@
+"""
+Zone-to-zone origin-destination matrices of NYC taxi trips
+
+Each month is reduced once to a (3, ZONES, ZONES) float array holding the
+trip count, median fare and median duration of every pickup/dropoff zone
+pair, indexed directly by zone ID. The arrays are saved as .npy files and
+memory-mapped, so answering a query is a row lookup and a partial sort.
+"""
+
+import functools
+import os
+import threading
+
+import numpy as np
+
+from .metrics import timed
+from .rollups import RollupStore
+
+# TLC zone IDs run from 1 to 265, row and column 0 stay empty
+ZONES = 266
+
+TRIPS, MEDIAN_FARE, MEDIAN_DURATION = range(3)
+
+
+class ODMatrixStore(RollupStore):
+    """
+    On-disk store of monthly origin-destination matrices
+    """
+
+    dir_setting = ("TAXI_ROLLUP_DIR", "/tmp/taxi_rollups")
+    extension = "npy"
+    stage = "od_matrix_build"
+
+    def query(self, relation: str) -> str:
+        return f"""
+        SELECT
+            pickup_location_id,
+            dropoff_location_id,
+            COUNT(*) as trips,
+            MEDIAN(fare_amount) as median_fare,
+            MEDIAN(EPOCH(dropoff_datetime - pickup_datetime)) / 60
+                as median_duration
+        FROM {relation}
+        WHERE pickup_location_id BETWEEN 1 AND {ZONES - 1}
+            AND dropoff_location_id BETWEEN 1 AND {ZONES - 1}
+        GROUP BY pickup_location_id, dropoff_location_id
+        """
+
+    def build(self, conn, relation: str, key: str, fingerprint: str) -> str:
+        """Aggregate a month relation into its matrix file"""
+        path = self.path_for(key, fingerprint)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        with timed(self.stage):
+            matrix = to_matrix(conn.execute(self.query(relation)).fetchnumpy())
+
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, matrix)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        self.remove_stale(key, path)
+        print(f"Built {path}")
+        return path
+
+
+def to_matrix(pairs: dict) -> np.ndarray:
+    """Scatter the per zone pair rows of ODMatrixStore.query into a matrix"""
+    origins = pairs["pickup_location_id"].astype(np.intp)
+    destinations = pairs["dropoff_location_id"].astype(np.intp)
+
+    matrix = np.full((3, ZONES, ZONES), np.nan)
+    matrix[TRIPS] = 0
+    matrix[TRIPS, origins, destinations] = pairs["trips"]
+    for index, column in (
+        (MEDIAN_FARE, "median_fare"),
+        (MEDIAN_DURATION, "median_duration"),
+    ):
+        matrix[index, origins, destinations] = np.ma.filled(
+            pairs[column].astype(float), np.nan
+        )
+    return matrix
+
+
+@functools.lru_cache(maxsize=64)
+def load_matrix(path: str) -> np.ndarray:
+    """Memory-map a matrix file, shared by every request of the process"""
+    return np.load(path, mmap_mode="r")
+
+
+def combine(matrices: list) -> np.ndarray:
+    """
+    Merge the matrices of several months
+
+    Counts add up exactly; medians are approximated by the trip-weighted
+    mean of the monthly medians.
+    """
+    if len(matrices) == 1:
+        return matrices[0]
+
+    stacked = np.stack(matrices)
+    trips = stacked[:, TRIPS]
+    combined = np.empty_like(stacked[0])
+    combined[TRIPS] = trips.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for index in (MEDIAN_FARE, MEDIAN_DURATION):
+            weighted = np.nansum(stacked[:, index] * trips, axis=0)
+            combined[index] = weighted / combined[TRIPS]
+    return combined
+
+
+def top_flows(matrix: np.ndarray, origin: int = None, limit: int = 10) -> list:
+    """
+    Busiest zone pairs, optionally only those leaving one origin zone
+
+    Uses a partial sort, so only the top `limit` pairs are ever ordered.
+    """
+    counts = matrix[TRIPS, origin] if origin is not None else matrix[TRIPS].ravel()
+    limit = min(limit, np.count_nonzero(counts))
+    if limit <= 0:
+        return []
+
+    top = np.argpartition(counts, -limit)[-limit:]
+    top = top[np.argsort(counts[top])[::-1]]
+
+    flows = []
+    for index in top:
+        if origin is None:
+            pickup, dropoff = divmod(int(index), ZONES)
+        else:
+            pickup, dropoff = origin, int(index)
+        fare = matrix[MEDIAN_FARE, pickup, dropoff]
+        duration = matrix[MEDIAN_DURATION, pickup, dropoff]
+        flows.append(
+            {
+                "pickup_location_id": pickup,
+                "dropoff_location_id": dropoff,
+                "trip_count": int(matrix[TRIPS, pickup, dropoff]),
+                "median_fare": None if np.isnan(fare) else float(fare),
+                "median_duration_minutes": (
+                    None if np.isnan(duration) else float(duration)
+                ),
+            }
+        )
+    return flows
@@ -0,0 +1,242 @@
+"""
+Persistent on-disk store of monthly NYC taxi parquet files
+
+Files live in a directory shared by every gunicorn worker and are keyed by
+taxi type, year, month and a fingerprint of the upstream size/ETag, so a
+month is downloaded once and read by DuckDB straight from disk afterwards.
+"""
+
+import glob
+import hashlib
+import os
+import threading
+import time
+
+import requests
+
+from .conf import get_setting
+from .downloader import USER_AGENT, DownloadError, download_file
+from .metrics import CACHE_REQUESTS
+from .singleflight import get_single_flight
+
+
+class ParquetCache:
+    """
+    Content-addressed parquet store with least-recently-used eviction
+    """
+
+    # Upstream fingerprints validated by this process: key -> (fingerprint, time)
+    _validated = {}
+    # Recent HEAD lookups, failed ones included: url -> (fingerprint, time)
+    _looked_up = {}
+    _lock = threading.Lock()
+
+    def __init__(self, base_url: str = None, cache_dir: str = None, max_bytes=None):
+        self.base_url = base_url or get_setting(
+            "TAXI_BASE_URL", "https://d37ci6vzurychx.cloudfront.net/trip-data"
+        )
+        self.cache_dir = cache_dir or get_setting("TAXI_CACHE_DIR", "/tmp/taxi_cache")
+        self.max_bytes = max_bytes or get_setting("TAXI_CACHE_MAX_BYTES", 2 * 1024**3)
+        self.revalidate_seconds = get_setting(
+            "TAXI_CACHE_REVALIDATE_SECONDS", 24 * 60 * 60
+        )
+        self.lookup_seconds = get_setting("TAXI_FINGERPRINT_TTL_SECONDS", 60)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_parquet_url(self, year: int, month: int, taxi_type: str = "yellow") -> str:
+        """Get the URL for a specific parquet file"""
+        return f"{self.base_url}/{taxi_type}_tripdata_{year}-{month:02d}.parquet"
+
+    def month_key(self, year: int, month: int, taxi_type: str = "yellow") -> str:
+        """Cache key prefix shared by every fingerprint of one month"""
+        return f"{taxi_type}_{year}-{month:02d}"
+
+    def path_for(self, key: str, fingerprint: str) -> str:
+        """Local path of a month with a given upstream fingerprint"""
+        return os.path.join(self.cache_dir, f"{key}_{fingerprint}.parquet")
+
+    def find(self, year: int, month: int, taxi_type: str = "yellow") -> str | None:
+        """Return the newest cached copy of a month, if any"""
+        key = self.month_key(year, month, taxi_type)
+        paths = glob.glob(os.path.join(self.cache_dir, f"{key}_*.parquet"))
+        if not paths:
+            return None
+        return max(paths, key=os.path.getmtime)
+
+    def is_available(self, year: int, month: int, taxi_type: str = "yellow") -> bool:
+        """Whether a month has been fetched by this process or is cached on disk"""
+        key = self.month_key(year, month, taxi_type)
+        return key in self._validated or self.find(year, month, taxi_type) is not None
+
+    def fingerprint(
+        self, year: int, month: int, taxi_type: str = "yellow"
+    ) -> str | None:
+        """Fingerprint of the month as cached locally, or as published upstream"""
+        key = self.month_key(year, month, taxi_type)
+        validated = self._validated.get(key)
+        if validated:
+            return validated[0]
+
+        path = self.find(year, month, taxi_type)
+        if path:
+            return self.fingerprint_from_path(path)
+        return self.remote_fingerprint(self.get_parquet_url(year, month, taxi_type))
+
+    @staticmethod
+    def fingerprint_from_path(path: str) -> str:
+        """Extract the fingerprint from a cached file name"""
+        return os.path.basename(path).rsplit("_", 1)[1].removesuffix(".parquet")
+
+    @staticmethod
+    def make_fingerprint(size, etag) -> str:
+        """Hash the upstream size and ETag into a short file-name-safe token"""
+        return hashlib.sha1(f"{size}:{etag or ''}".encode()).hexdigest()[:16]
+
+    def remote_fingerprint(self, url: str) -> str | None:
+        """
+        Fingerprint the upstream file, from a HEAD request at most every
+        lookup_seconds
+
+        A request checks the same month from several places, and an
+        unreachable upstream would otherwise cost a timeout each time.
+        """
+        looked_up = self._looked_up.get(url)
+        if looked_up and time.time() - looked_up[1] < self.lookup_seconds:
+            return looked_up[0]
+
+        # Concurrent requests for the month share a single HEAD request
+        fingerprint = get_single_flight().do(
+            f"head-{url}", lambda: self.head_fingerprint(url), shared=False
+        )
+        with self._lock:
+            self._looked_up[url] = (fingerprint, time.time())
+        return fingerprint
+
+    def head_fingerprint(self, url: str) -> str | None:
+        """Fingerprint the upstream file from a HEAD request"""
+        try:
+            response = requests.head(
+                url,
+                allow_redirects=True,
+                timeout=5,
+                headers={"User-Agent": USER_AGENT},
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Could not check {url}: {e}")
+            return None
+
+        size = response.headers.get("Content-Length")
+        etag = response.headers.get("ETag", "").strip('"')
+        if not size and not etag:
+            return None
+        return self.make_fingerprint(size, etag)
+
+    def fetch(self, year: int, month: int, taxi_type: str = "yellow") -> str | None:
+        """Return a local path for a month, downloading it only if needed"""
+        key = self.month_key(year, month, taxi_type)
+        url = self.get_parquet_url(year, month, taxi_type)
+
+        validated = self._validated.get(key)
+        if validated and time.time() - validated[1] < self.revalidate_seconds:
+            path = self.path_for(key, validated[0])
+            if os.path.exists(path):
+                self.touch(path)
+                CACHE_REQUESTS.inc(result="hit")
+                return path
+
+        fingerprint = self.remote_fingerprint(url)
+        if fingerprint is None:
+            # Upstream unreachable: any cached copy beats no data at all
+            path = self.find(year, month, taxi_type)
+            if path:
+                self.touch(path)
+            CACHE_REQUESTS.inc(result="hit" if path else "miss")
+            return path
+
+        path = self.path_for(key, fingerprint)
+        if os.path.exists(path):
+            self.touch(path)
+            CACHE_REQUESTS.inc(result="hit")
+        else:
+            CACHE_REQUESTS.inc(result="miss")
+            if not get_single_flight().do(
+                f"download-{key}", lambda: self.download_once(url, key, path)
+            ):
+                return None
+
+        self.mark_validated(key, fingerprint)
+        return path
+
+    def mark_validated(self, key: str, fingerprint: str):
+        """Trust a fingerprint for a month until it is due for revalidation"""
+        with self._lock:
+            self._validated[key] = (fingerprint, time.time())
+
+    def download_once(self, url: str, key: str, path: str) -> bool:
+        """Download a month unless another worker finished it while we waited"""
+        if os.path.exists(path):
+            return True
+        if not self.download(url, path):
+            return False
+        self.remove_stale(key, keep=path)
+        self.evict(keep=path)
+        return True
+
+    def download(self, url: str, path: str) -> bool:
+        """Download a file and move it into place once complete"""
+        print(f"Downloading parquet file from {url}")
+        try:
+            download_file(url, path)
+        except (DownloadError, OSError) as e:
+            # The partial download is kept and resumed by the next attempt
+            print(f"Download failed: {e}")
+            return False
+        return True
+
+    def touch(self, path: str):
+        """Mark a cached file as recently used"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def remove_stale(self, key: str, keep: str):
+        """Remove copies of a month whose upstream fingerprint has changed"""
+        # Also catches partial downloads, progress and lock files of
+        # fingerprints now out of date, and any left over from keep
+        for path in glob.glob(os.path.join(self.cache_dir, f"{key}_*.parquet*")):
+            if path != keep:
+                self.remove(path)
+
+    def entries(self) -> list[tuple[str, int, float]]:
+        """List cached files as (path, size, last used), oldest first"""
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, "*.parquet")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, keep: str = None):
+        """Remove least recently used files until the cache fits its budget"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self.remove(path)
+            total -= size
+
+    def remove(self, path: str):
+        """Delete a cached file, ignoring files another worker already removed"""
+        try:
+            os.unlink(path)
+            print(f"Evicted {path} from parquet cache")
+        except FileNotFoundError:
+            pass
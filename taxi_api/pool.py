@@ -0,0 +1,138 @@
+"""
+Process-wide pool of DuckDB cursors
+
+All cursors share one long-lived in-memory database, so month tables built
+by one request are still there for the next request served by the worker.
+"""
+
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import duckdb
+
+from .conf import get_setting
+from .memory import MaterializedTables, configure_database
+from .metrics import enable_scan_metrics
+
+
+class PoolTimeout(Exception):
+    """Raised when no DuckDB cursor became available in time"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DuckDBPool:
+    """
+    Bounded pool of DuckDB cursors with checkout/return semantics
+    """
+
+    def __init__(self, size: int = None, timeout: float = None):
+        self.size = size or get_setting("TAXI_DUCKDB_POOL_SIZE", 8)
+        self.timeout = timeout or get_setting("TAXI_DUCKDB_POOL_TIMEOUT", 30)
+        self.retry_after = get_setting("TAXI_DUCKDB_POOL_RETRY_AFTER", 5)
+        self.database = duckdb.connect()
+        configure_database(self.database)
+        # Month tables held in memory by any cursor of the database
+        self.tables = MaterializedTables()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def checkout(self, timeout: float = None):
+        """Take a healthy cursor from the pool, creating one if allowed"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._create() or self._wait(timeout)
+
+        if self.healthy(conn):
+            return conn
+
+        self.discard(conn)
+        return self._create() or self._wait(timeout)
+
+    def checkin(self, conn):
+        """Return a cursor to the pool, dropping it if it is broken"""
+        if self.healthy(conn):
+            self._idle.put(conn)
+        else:
+            self.discard(conn)
+
+    def discard(self, conn):
+        """Close a cursor and free its slot in the pool"""
+        try:
+            conn.close()
+        except duckdb.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """Check out a cursor for the duration of a with block"""
+        conn = self.checkout(timeout)
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def healthy(self, conn) -> bool:
+        """Check that a cursor can still run queries"""
+        try:
+            return conn.execute("SELECT 1").fetchone()[0] == 1
+        except duckdb.Error:
+            return False
+
+    def stats(self) -> dict:
+        """Current pool usage"""
+        return {
+            "size": self.size,
+            "created": self._created,
+            "idle": self._idle.qsize(),
+            "materialized_bytes": self.tables.total_bytes(),
+        }
+
+    def _create(self):
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+
+        try:
+            conn = self.database.cursor()
+            enable_scan_metrics(conn)
+            return conn
+        except duckdb.Error:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _wait(self, timeout: float = None):
+        try:
+            return self._idle.get(timeout=timeout or self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(
+                f"No DuckDB connection available after {timeout or self.timeout}s",
+                self.retry_after,
+            ) from None
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool() -> DuckDBPool:
+    """Return the DuckDB pool of the current worker process"""
+    global _pool, _pool_pid
+
+    # DuckDB handles must not be shared across a fork, so each worker gets its own
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = DuckDBPool()
+            _pool_pid = os.getpid()
+        return _pool
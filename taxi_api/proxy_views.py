@@ -3,12 +3,11 @@ Proxy views to download NYC taxi data from host machine
 since Docker containers are blocked from accessing CloudFront
 """
 
-import os
-import subprocess
-
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, JsonResponse
 from django.views import View
 
+from .downloader import DownloadError, download_file
+
 
 class TaxiDataProxyView(View):
     """Proxy view to download taxi data from host machine"""
@@ -16,32 +15,17 @@ class TaxiDataProxyView(View):
     def get(self, request, year, month):
         """Download and serve parquet data"""
         url = f"https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_{year}-{month:02d}.parquet"
+        tmp_path = f"/tmp/taxi_data_{year}_{month:02d}.parquet"
 
         try:
-            # Use curl from host machine if available
-            tmp_path = f"/tmp/taxi_data_{year}_{month:02d}.parquet"
-
-            # Try to download using curl from host
-            curl_cmd = f"curl -L -o {tmp_path} '{url}'"
-            result = subprocess.run(
-                curl_cmd, shell=True, capture_output=True, text=True
-            )
-
-            if result.returncode == 0 and os.path.exists(tmp_path):
-                # Serve the file
-                with open(tmp_path, "rb") as f:
-                    response = HttpResponse(
-                        f.read(), content_type="application/octet-stream"
-                    )
-                    response["Content-Disposition"] = (
-                        f'attachment; filename="yellow_tripdata_{year}-'
-                        f'{month:02d}.parquet"'
-                    )
-                    return response
-            else:
-                return JsonResponse(
-                    {"error": f"Failed to download: {result.stderr}"}, status=500
-                )
-
-        except Exception as e:
-            return JsonResponse({"error": str(e)}, status=500)
+            download_file(url, tmp_path)
+        except (DownloadError, OSError) as e:
+            return JsonResponse({"error": f"Failed to download: {e}"}, status=500)
+
+        # Stream the file rather than reading it into memory
+        return FileResponse(
+            open(tmp_path, "rb"),
+            as_attachment=True,
+            filename=f"yellow_tripdata_{year}-{month:02d}.parquet",
+            content_type="application/octet-stream",
+        )
@@ -0,0 +1,310 @@
+"""
+Partial reads of remote parquet files over HTTP range requests
+
+In TAXI_ENGINE_MODE=remote a month that is not cached locally is queried
+in place instead of being downloaded first. remote_dataset() exposes the
+upstream file as a pyarrow dataset on an HTTP filesystem: DuckDB pushes
+column projections and filters into the Arrow scan, so pyarrow reads the
+parquet footer and then only the column chunks of the row groups a query
+needs. Every range read goes through a BlockCache, a local on-disk store
+of fixed-size blocks shared by every worker, so a block is fetched once.
+Aggregate endpoints build the month's rollup file from it once, as for a
+downloaded month, and read no more of the remote file afterwards.
+
+Registered Arrow objects are private to a DuckDB connection, so each
+cursor querying a remote month view attaches its dataset with attach_remote().
+"""
+
+import io
+import os
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import requests
+
+from .conf import get_setting
+from .downloader import USER_AGENT
+from .metrics import DOWNLOADED_BYTES, REMOTE_BLOCKS, timed
+
+# Datasets of the remote months known to this process, by relation name
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+
+def is_remote(source: str) -> bool:
+    """Whether a month view source is an upstream URL rather than a local file"""
+    return source.startswith(("http://", "https://"))
+
+
+class BlockCache:
+    """
+    On-disk cache of fixed-size blocks of remote files, least recently used
+    blocks evicted first
+    """
+
+    def __init__(self, cache_dir: str = None, block_bytes=None, max_bytes=None):
+        self.cache_dir = cache_dir or get_setting(
+            "TAXI_REMOTE_CACHE_DIR", "/tmp/taxi_remote_blocks"
+        )
+        self.block_bytes = block_bytes or get_setting(
+            "TAXI_REMOTE_BLOCK_BYTES", 64 * 1024
+        )
+        self.max_bytes = max_bytes or get_setting(
+            "TAXI_REMOTE_CACHE_MAX_BYTES", 1024**3
+        )
+        self.retries = get_setting("TAXI_DOWNLOAD_RETRIES", 5)
+        self.timeout = get_setting("TAXI_DOWNLOAD_TIMEOUT", 30)
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def block_path(self, key: str, index: int) -> str:
+        return os.path.join(self.cache_dir, key, f"{index:06d}")
+
+    def read(self, url: str, key: str, size: int, offset: int, length: int) -> bytes:
+        """Read bytes [offset, offset + length) of a remote file of a given size"""
+        length = min(length, size - offset)
+        if length <= 0:
+            return b""
+        first = offset // self.block_bytes
+        last = (offset + length - 1) // self.block_bytes
+
+        blocks = {}
+        missing = []
+        for index in range(first, last + 1):
+            try:
+                with open(self.block_path(key, index), "rb") as f:
+                    blocks[index] = f.read()
+                os.utime(self.block_path(key, index))
+                REMOTE_BLOCKS.inc(result="hit")
+            except FileNotFoundError:
+                missing.append(index)
+                REMOTE_BLOCKS.inc(result="miss")
+
+        # Consecutive missing blocks are fetched with a single range request
+        runs = []
+        for index in missing:
+            if runs and runs[-1][1] == index - 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        for start, end in runs:
+            blocks.update(self.fetch(url, key, size, start, end))
+        if runs:
+            self.evict()
+
+        data = b"".join(blocks[index] for index in range(first, last + 1))
+        skip = offset - first * self.block_bytes
+        return data[skip : skip + length]
+
+    def fetch(self, url: str, key: str, size: int, first: int, last: int) -> dict:
+        """Fetch blocks first..last of a remote file and store them"""
+        start = first * self.block_bytes
+        end = min((last + 1) * self.block_bytes, size) - 1
+
+        with timed("remote_read"):
+            for attempt in range(self.retries + 1):
+                try:
+                    response = self.session.get(
+                        url,
+                        headers={"Range": f"bytes={start}-{end}"},
+                        timeout=self.timeout,
+                    )
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise OSError(f"{url} does not support range requests")
+                    data = response.content
+                    if len(data) != end - start + 1:
+                        raise requests.RequestException(
+                            f"expected {end - start + 1} bytes, got {len(data)}"
+                        )
+                    break
+                except requests.RequestException as e:
+                    if attempt == self.retries:
+                        raise OSError(f"Could not read {url}: {e}") from e
+                    time.sleep(min(2**attempt / 2, 10))
+        DOWNLOADED_BYTES.inc(len(data))
+
+        os.makedirs(os.path.join(self.cache_dir, key), exist_ok=True)
+        blocks = {}
+        for index in range(first, last + 1):
+            block = data[
+                (index - first) * self.block_bytes : (index - first + 1)
+                * self.block_bytes
+            ]
+            path = self.block_path(key, index)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(block)
+            os.replace(tmp_path, path)
+            blocks[index] = block
+        return blocks
+
+    def evict(self):
+        """Remove least recently used blocks until the cache fits its budget"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """Seekable read-only file over a remote file, read through a BlockCache"""
+
+    def __init__(self, url: str, key: str, size: int, blocks: BlockCache):
+        super().__init__()
+        self.url = url
+        self.key = key
+        self.size = size
+        self.blocks = blocks
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        data = self.blocks.read(
+            self.url, self.key, self.size, self.position, len(buffer)
+        )
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class HTTPRangeFileSystem(pafs.FileSystemHandler):
+    """
+    Read-only pyarrow filesystem of the files under a base URL
+
+    Paths are file names relative to base_url. Files are identified in the
+    block cache by key, which should change whenever the upstream file does.
+    """
+
+    def __init__(self, base_url: str, keys: dict, blocks: BlockCache = None):
+        self.base_url = base_url
+        self.keys = keys
+        self.blocks = blocks or BlockCache()
+        self._sizes = {}
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path}"
+
+    def size(self, path: str) -> int:
+        if path not in self._sizes:
+            response = self.blocks.session.head(
+                self.url(path), allow_redirects=True, timeout=self.blocks.timeout
+            )
+            response.raise_for_status()
+            self._sizes[path] = int(response.headers["Content-Length"])
+        return self._sizes[path]
+
+    def get_type_name(self):
+        return "taxi-http"
+
+    def equals(self, other):
+        return isinstance(other, HTTPRangeFileSystem) and (
+            other.base_url == self.base_url
+        )
+
+    def normalize_path(self, path):
+        return path
+
+    def get_file_info(self, paths):
+        return [
+            pafs.FileInfo(path, pafs.FileType.File, size=self.size(path))
+            for path in paths
+        ]
+
+    def open_input_file(self, path):
+        file = HTTPRangeFile(
+            self.url(path), self.keys[path], self.size(path), self.blocks
+        )
+        return pa.PythonFile(file, mode="r")
+
+    def open_input_stream(self, path):
+        return self.open_input_file(path)
+
+    def get_file_info_selector(self, selector):
+        raise NotImplementedError("Remote files can't be listed")
+
+    def create_dir(self, path, recursive):
+        raise NotImplementedError("Remote files are read only")
+
+    def delete_dir(self, path):
+        raise NotImplementedError("Remote files are read only")
+
+    def delete_dir_contents(self, path, missing_dir_ok=False):
+        raise NotImplementedError("Remote files are read only")
+
+    def delete_root_dir_contents(self):
+        raise NotImplementedError("Remote files are read only")
+
+    def delete_file(self, path):
+        raise NotImplementedError("Remote files are read only")
+
+    def move(self, src, dest):
+        raise NotImplementedError("Remote files are read only")
+
+    def copy_file(self, src, dest):
+        raise NotImplementedError("Remote files are read only")
+
+    def open_output_stream(self, path, metadata):
+        raise NotImplementedError("Remote files are read only")
+
+    def open_append_stream(self, path, metadata):
+        raise NotImplementedError("Remote files are read only")
+
+
+def remote_dataset(url: str, key: str) -> ds.Dataset:
+    """Parquet dataset reading a remote file through the block cache"""
+    base_url, name = url.rsplit("/", 1)
+    filesystem = pafs.PyFileSystem(HTTPRangeFileSystem(base_url, {name: key}))
+    return ds.dataset(name, filesystem=filesystem, format="parquet")
+
+
+def register_remote(conn, name: str, url: str, key: str):
+    """Open the dataset of a remote file and attach it to a connection"""
+    dataset = remote_dataset(url, key)
+    with _datasets_lock:
+        _datasets[name] = dataset
+    conn.register(name, dataset)
+
+
+def attach_remote(conn, name: str) -> bool:
+    """Attach a registered remote dataset to a connection, if there is one"""
+    dataset = _datasets.get(name)
+    if dataset is None:
+        return False
+    conn.register(name, dataset)
+    return True
@@ -0,0 +1,113 @@
+"""
+Columnar response renderers for the taxi data API
+
+Selected with an Accept header or ?format=arrow|parquet. The view payload
+carries a pyarrow Table under "data", which is written out as-is; the
+remaining payload keys (year, month, ...) become schema metadata.
+
+The NDJSON and CSV renderers also encode record batches one at a time, for
+exports streamed straight from a DuckDB reader.
+"""
+
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
+from rest_framework.renderers import BaseRenderer
+
+
+def to_arrow_table(data) -> pa.Table:
+    """Turn a view payload into the Arrow table to send"""
+    metadata = {}
+    if isinstance(data, dict) and "data" in data:
+        metadata = {
+            key: json.dumps(value, default=str)
+            for key, value in data.items()
+            if key != "data"
+        }
+        data = data["data"]
+
+    if isinstance(data, pa.Table):
+        table = data
+    elif isinstance(data, list):
+        table = pa.Table.from_pylist(data)
+    else:
+        # Single-row payloads such as stats or error messages
+        table = pa.Table.from_pylist([data or {}])
+
+    if metadata:
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), **metadata}
+        )
+    return table
+
+
+class ArrowStreamRenderer(BaseRenderer):
+    """Render a payload as an Arrow IPC stream"""
+
+    media_type = "application/vnd.apache.arrow.stream"
+    format = "arrow"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        table = to_arrow_table(data)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+class ParquetRenderer(BaseRenderer):
+    """Render a payload as a Parquet file"""
+
+    media_type = "application/vnd.apache.parquet"
+    format = "parquet"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        sink = pa.BufferOutputStream()
+        pq.write_table(to_arrow_table(data), sink)
+        return sink.getvalue().to_pybytes()
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Render rows as newline-delimited JSON"""
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b"".join(self.render_batches(to_arrow_table(data).to_batches()))
+
+    def render_batches(self, batches):
+        """Encode record batches as they arrive, one chunk per batch"""
+        for batch in batches:
+            lines = [json.dumps(row, default=str) for row in batch.to_pylist()]
+            yield ("\n".join(lines) + "\n").encode()
+
+
+class CSVRenderer(BaseRenderer):
+    """Render rows as CSV with a header line"""
+
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b"".join(self.render_batches(to_arrow_table(data).to_batches()))
+
+    def render_batches(self, batches):
+        """Encode record batches as they arrive, one chunk per batch"""
+        include_header = True
+        for batch in batches:
+            sink = io.BytesIO()
+            pcsv.write_csv(
+                batch, sink, pcsv.WriteOptions(include_header=include_header)
+            )
+            include_header = False
+            yield sink.getvalue()
@@ -0,0 +1,144 @@
+"""
+Precomputed monthly rollups of NYC taxi trips
+
+A month's trips never change once published, so daily, hourly, day-of-week
+and per-zone aggregates are computed once per month and stored as a small
+parquet file next to the parquet cache. Rollups keep sums and non-null
+counts rather than averages so they can be re-aggregated exactly.
+"""
+
+import glob
+import os
+import threading
+
+from .conf import get_setting
+from .metrics import timed
+
+# Grouping key of every rollup grain, in terms of the month relation columns
+GRAINS = {
+    "day": "DATE(pickup_datetime)",
+    "hour": "EXTRACT(HOUR FROM pickup_datetime)",
+    "dow": "EXTRACT(DOW FROM pickup_datetime)",
+    "pickup_zone": "pickup_location_id",
+    "dropoff_zone": "dropoff_location_id",
+}
+
+KEY_TYPES = {
+    "day": "DATE",
+    "hour": "BIGINT",
+    "dow": "BIGINT",
+    "pickup_zone": "BIGINT",
+    "dropoff_zone": "BIGINT",
+}
+
+MEASURES = """
+    COUNT(*) AS trips,
+    SUM(total_amount) AS revenue_sum,
+    SUM(fare_amount) AS fare_sum,
+    COUNT(fare_amount) AS fare_n,
+    SUM(trip_distance) AS distance_sum,
+    COUNT(trip_distance) AS distance_n,
+    SUM(tip_amount) AS tip_sum,
+    COUNT(tip_amount) AS tip_n,
+    SUM(passenger_count) AS passengers_sum,
+    COUNT(passenger_count) AS passengers_n,
+    MIN(pickup_datetime) AS first_pickup,
+    MAX(pickup_datetime) AS last_pickup
+"""
+
+
+def rollup_query(relation: str, grains=tuple(GRAINS)) -> str:
+    """
+    SQL computing the rollup rows of the given grains over a relation
+
+    All grains come out of a single scan of the relation via GROUPING SETS;
+    the grain column names the key that is set on each row.
+    """
+    keys = ",\n            ".join(
+        f"{GRAINS[grain]}::{KEY_TYPES[grain]} AS {grain}" for grain in grains
+    )
+    columns = ", ".join(
+        name if name in grains else f"NULL::{KEY_TYPES[name]} AS {name}"
+        for name in GRAINS
+    )
+    grain_cases = "\n            ".join(
+        f"WHEN GROUPING({grain}) = 0 THEN '{grain}'" for grain in grains
+    )
+    grouping_sets = ", ".join(f"({grain})" for grain in grains)
+
+    return f"""
+    SELECT
+        CASE
+            {grain_cases}
+        END AS grain,
+        {columns},
+        {MEASURES}
+    FROM (
+        SELECT
+            *,
+            {keys}
+        FROM {relation}
+    ) trips
+    GROUP BY GROUPING SETS ({grouping_sets})
+    """
+
+
+class RollupStore:
+    """
+    On-disk store of monthly rollup files, keyed like the parquet cache
+
+    Subclasses store other per-month derived files by overriding the
+    directory setting, query(), the COPY options and the timing stage.
+    """
+
+    dir_setting = ("TAXI_ROLLUP_DIR", "/tmp/taxi_rollups")
+    copy_options = "FORMAT PARQUET"
+    extension = "parquet"
+    stage = "rollup_build"
+
+    def __init__(self, rollup_dir: str = None):
+        self.rollup_dir = rollup_dir or get_setting(*self.dir_setting)
+        os.makedirs(self.rollup_dir, exist_ok=True)
+
+    def query(self, relation: str) -> str:
+        """Query producing the file contents from a month relation"""
+        return rollup_query(relation)
+
+    def path_for(self, key: str, fingerprint: str) -> str:
+        """Rollup file for a month built from a given upstream fingerprint"""
+        return os.path.join(self.rollup_dir, f"{key}_{fingerprint}.{self.extension}")
+
+    def find(self, key: str, fingerprint: str) -> str | None:
+        """Return the rollup file for a month if it has been built"""
+        path = self.path_for(key, fingerprint)
+        return path if os.path.exists(path) else None
+
+    def build(self, conn, relation: str, key: str, fingerprint: str) -> str:
+        """Aggregate a month relation into its file"""
+        path = self.path_for(key, fingerprint)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        try:
+            with timed(self.stage):
+                conn.execute(
+                    f"COPY ({self.query(relation)}) TO '{tmp_path}' "
+                    f"({self.copy_options})"
+                )
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        self.remove_stale(key, path)
+        print(f"Built {path}")
+        return path
+
+    def remove_stale(self, key: str, path: str):
+        """Delete files built from an older upstream version of the month"""
+        pattern = os.path.join(self.rollup_dir, f"{key}_*.{self.extension}")
+        for stale in glob.glob(pattern):
+            if stale != path:
+                try:
+                    os.unlink(stale)
+                except FileNotFoundError:
+                    pass
@@ -1,126 +1,526 @@
+import base64
+import contextvars
+import json
 import os
-import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 import duckdb
-from pylru import lrudecorator
+import pyarrow as pa
+
+from .approx import estimate_mean, estimate_total, sampled
+from .conf import get_setting
+from .downloader import DownloadError, download_file
+from .filters import TripFilters
+from .lake import TaxiLake
+from .memory import MaterializedTables, configure_database
+from .metrics import ROWS_RETURNED, enable_scan_metrics, record_rows_scanned, timed
+from .od_matrix import ODMatrixStore, combine, load_matrix, to_matrix, top_flows
+from .parquet_cache import ParquetCache
+from .remote import attach_remote, is_remote, register_remote
+from .rollups import RollupStore, rollup_query
+from .singleflight import ColdLoadInProgress, get_single_flight
+from .sorted_trips import SortedTripStore, page_query
+
+_month_executor = None
+_month_executor_lock = threading.Lock()
+
+
+def get_month_executor() -> ThreadPoolExecutor:
+    """Bounded thread pool used to load the months of a range concurrently"""
+    global _month_executor
+    with _month_executor_lock:
+        if _month_executor is None:
+            _month_executor = ThreadPoolExecutor(
+                max_workers=get_setting("TAXI_RANGE_WORKERS", os.cpu_count() or 4),
+                thread_name_prefix="taxi-month",
+            )
+        return _month_executor
+
+
+def parse_year_month(value: str) -> tuple[int, int]:
+    """Parse a YYYY-MM string into a (year, month) pair"""
+    year, month = (int(part) for part in value.split("-"))
+    if not 1 <= month <= 12:
+        raise ValueError(f"Invalid month in {value}")
+    return year, month
+
+
+def month_range(start: tuple[int, int], end: tuple[int, int] = None) -> list:
+    """List the (year, month) pairs from start to end inclusive"""
+    year, month = start
+    end = end or start
+    months = []
+    while (year, month) <= end:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def union_all(relations: list[str], alias: str) -> str:
+    """Relation reading several relations with the same columns"""
+    if len(relations) == 1:
+        return relations[0]
+    union = " UNION ALL ".join(f"SELECT * FROM {relation}" for relation in relations)
+    return f"({union}) {alias}"
+
+
+def encode_cursor(
+    year: int, month: int, pickup_datetime: datetime, trip_id: int
+) -> str:
+    """Opaque pagination cursor pointing just past a trip"""
+    payload = json.dumps([year, month, pickup_datetime.isoformat(), trip_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(value: str) -> tuple[int, int, datetime, int]:
+    """Decode a cursor from encode_cursor(), raising ValueError if malformed"""
+    try:
+        padded = value + "=" * (-len(value) % 4)
+        year, month, pickup, trip_id = json.loads(base64.urlsafe_b64decode(padded))
+        return int(year), int(month), datetime.fromisoformat(pickup), int(trip_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {value}") from e
+
+
+def to_columnar(table: pa.Table) -> dict:
+    """
+    Lay a result out as one list per column under a schema header
+
+    Key names are sent once instead of once per row, which roughly halves
+    the JSON for wide results such as the heatmap or trip samples.
+    """
+    return {
+        "schema": [
+            {"name": field.name, "type": str(field.type)} for field in table.schema
+        ],
+        "columns": table.to_pydict(),
+        "length": table.num_rows,
+    }
 
 
 class TaxiDataService:
     """
     Service to query NYC Taxi data directly from parquet files using DuckDB
     No need to load into PostgreSQL - query on demand!
+    Aggregate endpoints are answered from precomputed monthly rollups.
     """
 
-    def __init__(self):
-        self.conn = duckdb.connect()
-        self.base_url = "https://d37ci6vzurychx.cloudfront.net/trip-data"
-        self.data_cache = {}
+    # Parquet file behind each month view registered by this process
+    _view_sources = {}
+    # Rollup file loaded into each rollup table by this process
+    _rollup_sources = {}
+    # Sorted trip file behind each sorted month view of this process
+    _sorted_sources = {}
+
+    def __init__(self, pool=None, conn=None):
+        # Pooled cursors share one database, so tables outlive the request
+        self.pool = pool
+        self.conn = conn or (pool.checkout() if pool else duckdb.connect())
+        if not pool:
+            enable_scan_metrics(self.conn)
+        if not pool and not conn:
+            configure_database(self.conn)
+        # Memory budget of the month tables in this service's database
+        self.tables = pool.tables if pool else MaterializedTables()
+        # Identifies the database for coalescing concurrent loads of a month
+        self.database_key = id(pool.database) if pool else id(self.conn)
+        self.base_url = get_setting(
+            "TAXI_BASE_URL", "https://d37ci6vzurychx.cloudfront.net/trip-data"
+        )
+        self.cache = ParquetCache(base_url=self.base_url)
+        self.rollups = RollupStore()
+        self.sorted_trips = SortedTripStore()
+        self.od_matrices = ODMatrixStore()
+        self.lake = TaxiLake()
+        self.engine_mode = get_setting("TAXI_ENGINE_MODE", "view")
+        self.materialized_months = get_setting("TAXI_MATERIALIZED_MONTHS", "").split(
+            ","
+        )
+        # Result format of the query methods, see fetch_all()
+        self.output = "rows"
+        # Trips the query methods are restricted to, see filters.py
+        self.filters = TripFilters()
+        # Share of each month read by approximate queries
+        self.sample_percent = get_setting("TAXI_APPROX_SAMPLE_PERCENT", 5)
+        # Temporary tables of the current request, dropped by close()
+        self.request_tables = []
+        # False once a month could not be loaded and results fell back to
+        # partial or sample data, which callers must not cache for long
+        self.complete = True
+
+    def loaded(self, relation):
+        """Pass a month's relation through, noting when it could not be loaded"""
+        if not relation:
+            self.complete = False
+        return relation
 
     def get_parquet_url(self, year: int, month: int, taxi_type: str = "yellow") -> str:
         """Get the URL for a specific parquet file"""
-        return f"{self.base_url}/{taxi_type}_tripdata_" f"{year}-{month:02d}.parquet"
+        return f"{self.base_url}/{taxi_type}_tripdata_{year}-{month:02d}.parquet"
 
     def download_parquet_via_host(
         self, year: int, month: int, taxi_type: str = "yellow"
     ) -> str:
-        """Download parquet file via host machine to avoid Docker networking issues"""
+        """Download parquet file to a temporary path outside the cache"""
         url = self.get_parquet_url(year, month, taxi_type)
-
-        # Use curl from host machine via docker exec
         tmp_path = f"/tmp/taxi_data_{year}_{month:02d}.parquet"
 
-        # Download file to host and copy to container
-        host_download_cmd = f"curl -L -o {tmp_path} '{url}'"
-
         try:
-            result = subprocess.run(
-                host_download_cmd, shell=True, capture_output=True, text=True
-            )
-            if result.returncode == 0:
-                return tmp_path
-            else:
-                print(f"Download failed: {result.stderr}")
-                return None
-        except Exception as e:
-            print(f"Error downloading via host: {e}")
+            download_file(url, tmp_path)
+            return tmp_path
+        except (DownloadError, OSError) as e:
+            print(f"Download failed: {e}")
             return None
 
-    @lrudecorator(100)
+    def relation_type(self, name: str) -> str | None:
+        """Return "table" or "view" if the relation exists in the database"""
+        result = self.conn.execute(
+            """
+            SELECT 'table' FROM duckdb_tables() WHERE table_name = $name
+            UNION ALL
+            SELECT 'view' FROM duckdb_views() WHERE view_name = $name
+            """,
+            {"name": name},
+        ).fetchone()
+        return result[0] if result else None
+
+    def relation_exists(self, name: str) -> bool:
+        """Check whether a table or view already exists in the database"""
+        return self.relation_type(name) is not None
+
+    def should_materialize(self, year: int, month: int, taxi_type: str = "yellow"):
+        """Whether a month is loaded as a table rather than a parquet view"""
+        if self.engine_mode == "table":
+            return True
+        return f"{year}-{month:02d}" in self.materialized_months
+
+    def materialize(self, year: int, month: int, taxi_type: str = "yellow") -> str:
+        """Load a hot month into memory regardless of the engine mode"""
+        return self.create_temp_table(year, month, taxi_type, materialize=True)
+
     def create_temp_table(
-        self, year: int, month: int, taxi_type: str = "yellow"
+        self,
+        year: int,
+        month: int,
+        taxi_type: str = "yellow",
+        materialize: bool = None,
+        remote: bool = None,
     ) -> str:
-        """Create a temporary table from parquet file"""
+        """
+        Register a month from its locally cached parquet file
+
+        By default the month becomes a view over read_parquet, so each query
+        only reads the columns and row groups it needs. Hot months (or every
+        month with TAXI_ENGINE_MODE=table) are materialized as a table.
+
+        With TAXI_ENGINE_MODE=remote, a month not cached locally is read in
+        place over HTTP range requests instead (see remote.py). Its trip_id
+        is NULL, so callers relying on it pass remote=False.
+        """
         url = self.get_parquet_url(year, month, taxi_type)
         table_name = f"trips_{taxi_type}_{year}_{month:02d}"
+        if materialize is None:
+            materialize = self.should_materialize(year, month, taxi_type)
+        if remote is None:
+            remote = self.engine_mode == "remote"
+        remote = remote and not materialize
 
         try:
-            # First try to download via host machine using subprocess
-            print(f"Downloading parquet file from {url}")
-            tmp_path = f"/tmp/taxi_data_{year}_{month:02d}.parquet"
-
-            # Use curl from the container but with better headers
-            user_agent = (
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                "(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+            if self.is_registered(table_name, materialize, remote):
+                self.tables.touch(table_name)
+                return table_name
+
+            # Concurrent requests for the same month wait for one registration,
+            # though a remote one is no use to a caller asking for a local copy
+            form = "remote" if remote else "local"
+            return self.loaded(
+                get_single_flight().do(
+                    f"relation-{self.database_key}-{table_name}-{form}",
+                    lambda: self.register_month(
+                        year, month, taxi_type, table_name, materialize, remote
+                    ),
+                    shared=False,
+                )
             )
-            curl_cmd = [
-                "curl",
-                "-L",
-                "-H",
-                f"User-Agent: {user_agent}",
-                "-o",
-                tmp_path,
-                url,
-            ]
 
-            import subprocess
+        except ColdLoadInProgress:
+            raise
+        except Exception as e:
+            print(f"Error creating table from {url}: {e}")
+            return self.loaded(None)
+
+    def is_registered(
+        self, table_name: str, materialize: bool, remote: bool = False
+    ) -> bool:
+        """Whether a month relation exists in the requested form"""
+        existing = self.relation_type(table_name)
+        if existing == "table":
+            return True
+        if existing != "view" or materialize:
+            return False
+
+        source = self._view_sources.get(table_name, "")
+        if is_remote(source):
+            # Each cursor needs its own handle on the remote dataset
+            return remote and attach_remote(self.conn, f"{table_name}_remote")
+        # The cache may have evicted the file behind a view
+        return os.path.exists(source)
+
+    def register_month(
+        self,
+        year: int,
+        month: int,
+        taxi_type: str,
+        table_name: str,
+        materialize: bool,
+        remote: bool = False,
+    ) -> str:
+        """Create the view or table for a month from the lake or parquet cache"""
+        url = self.get_parquet_url(year, month, taxi_type)
+        if self.is_registered(table_name, materialize, remote):
+            return table_name
+
+        # A month rewritten into the local lake is read from there, so date
+        # filters skip the files and row groups they do not need
+        fingerprint = self.cache.fingerprint(year, month, taxi_type)
+        source_path = self.lake.find(year, month, taxi_type, fingerprint)
+        if source_path:
+            source = self.lake_source(self.lake.month_glob(year, month, taxi_type))
+        elif remote and fingerprint and not self.cache.find(year, month, taxi_type):
+            # Query the upstream file in place rather than downloading it all
+            source_path = url
+            remote_name = f"{table_name}_remote"
+            key = self.cache.month_key(year, month, taxi_type)
+            register_remote(self.conn, remote_name, url, f"{key}_{fingerprint}")
+            source = self.remote_source(remote_name)
+        else:
+            source_path = self.cache.fetch(year, month, taxi_type)
+            if not source_path:
+                print(f"No local copy of {url} available")
+                return None
+            source = self.month_source(source_path)
+
+        if self.relation_type(table_name) == "view":
+            self.conn.execute(f"DROP VIEW {table_name}")
+
+        relation = "TABLE" if materialize else "VIEW"
+        with timed("register"):
+            if materialize:
+                self.tables.create(self.conn, table_name, source)
+            else:
+                self.conn.execute(f"CREATE OR REPLACE VIEW {table_name} AS {source}")
+                self._view_sources[table_name] = source_path
 
-            result = subprocess.run(curl_cmd, capture_output=True, text=True)
+        print(f"Successfully created {relation.lower()} {table_name}")
+        return table_name
 
-            if result.returncode == 0 and os.path.exists(tmp_path):
-                print(
-                    f"Downloaded to {tmp_path}, size: {os.path.getsize(tmp_path)} bytes"
+    def month_source(self, parquet_path: str) -> str:
+        """Query reading a downloaded TLC file with the service's column names"""
+        return self.tlc_source(
+            f"read_parquet('{parquet_path}', file_row_number = true)",
+            "file_row_number",
+        )
+
+    def remote_source(self, relation: str) -> str:
+        """Query reading a remote TLC file attached as an Arrow dataset"""
+        # Arrow scans have no row numbers to derive trip ids from. Nor is
+        # there a pickup time predicate, which would make every query fetch
+        # the pickup column even when it doesn't use it.
+        return self.tlc_source(relation, "CAST(NULL AS BIGINT)", where="")
+
+    def tlc_source(
+        self,
+        relation: str,
+        trip_id: str,
+        where: str = "WHERE tpep_pickup_datetime IS NOT NULL",
+    ) -> str:
+        """Query renaming the columns of a TLC file to the service's names"""
+        return f"""
+        SELECT
+            tpep_pickup_datetime as pickup_datetime,
+            tpep_dropoff_datetime as dropoff_datetime,
+            passenger_count,
+            trip_distance,
+            PULocationID as pickup_location_id,
+            DOLocationID as dropoff_location_id,
+            fare_amount,
+            tip_amount,
+            total_amount,
+            payment_type,
+            {trip_id} as trip_id
+        FROM {relation}
+        {where}
+        """
+
+    def lake_source(self, month_glob: str, days: list = None) -> str:
+        """
+        Query reading a month of the lake, which already has those columns
+
+        Given days, only the files of those day partitions are read.
+        """
+        where = f"WHERE day IN ({', '.join(map(str, days))})" if days else ""
+        return f"""
+        SELECT
+            pickup_datetime,
+            dropoff_datetime,
+            passenger_count,
+            trip_distance,
+            pickup_location_id,
+            dropoff_location_id,
+            fare_amount,
+            tip_amount,
+            total_amount,
+            payment_type,
+            trip_id
+        FROM read_parquet('{month_glob}', hive_partitioning = true)
+        {where}
+        """
+
+    def get_rollup(self, year: int, month: int, taxi_type: str = "yellow") -> str:
+        """Load the month's rollup table, building the rollup file only once"""
+        rollup_name = f"rollup_{taxi_type}_{year}_{month:02d}"
+        key = self.cache.month_key(year, month, taxi_type)
+
+        try:
+            if self.is_rollup_loaded(year, month, taxi_type, rollup_name):
+                return rollup_name
+
+            return self.loaded(
+                get_single_flight().do(
+                    f"rollup-{self.database_key}-{rollup_name}",
+                    lambda: self.load_rollup(year, month, taxi_type, rollup_name),
+                    shared=False,
                 )
+            )
+
+        except ColdLoadInProgress:
+            raise
+        except Exception as e:
+            print(f"Error loading rollup for {key}: {e}")
+            return self.loaded(None)
+
+    def is_rollup_loaded(
+        self, year: int, month: int, taxi_type: str, rollup_name: str
+    ) -> bool:
+        """Whether the current rollup file of a month is loaded in the database"""
+        key = self.cache.month_key(year, month, taxi_type)
+        fingerprint = self.cache.fingerprint(year, month, taxi_type)
+        path = fingerprint and self.rollups.find(key, fingerprint)
+        return bool(
+            path
+            and self._rollup_sources.get(rollup_name) == path
+            and self.relation_exists(rollup_name)
+        )
 
-                # Create table from local file
-                query = f"""
-                CREATE OR REPLACE TABLE {table_name} AS
-                SELECT
-                    tpep_pickup_datetime as pickup_datetime,
-                    tpep_dropoff_datetime as dropoff_datetime,
-                    passenger_count,
-                    trip_distance,
-                    PULocationID as pickup_location_id,
-                    DOLocationID as dropoff_location_id,
-                    fare_amount,
-                    tip_amount,
-                    total_amount,
-                    payment_type
-                FROM read_parquet('{tmp_path}')
-                WHERE pickup_datetime IS NOT NULL
+    def load_rollup(
+        self, year: int, month: int, taxi_type: str, rollup_name: str
+    ) -> str:
+        """Load a month's rollup file into a table, building the file if needed"""
+        key = self.cache.month_key(year, month, taxi_type)
+        if self.is_rollup_loaded(year, month, taxi_type, rollup_name):
+            return rollup_name
+
+        fingerprint = self.cache.fingerprint(year, month, taxi_type)
+        path = fingerprint and self.rollups.find(key, fingerprint)
+        if not path:
+            table_name = self.create_temp_table(year, month, taxi_type)
+            if not table_name:
+                return None
+            # The download may have revalidated the upstream fingerprint
+            fingerprint = self.cache.fingerprint(year, month, taxi_type)
+            # Only one worker builds the rollup file, the others reuse it
+            path = get_single_flight().do(
+                f"rollup-{key}",
+                lambda: (
+                    self.rollups.find(key, fingerprint)
+                    or self.rollups.build(self.conn, table_name, key, fingerprint)
+                ),
+            )
+
+        with timed("rollup_load"):
+            self.conn.execute(
+                f"""
+                CREATE OR REPLACE TABLE {rollup_name} AS
+                SELECT * FROM read_parquet('{path}')
                 """
+            )
+        self._rollup_sources[rollup_name] = path
+        return rollup_name
+
+    def for_each_month(self, func, months: list) -> list:
+        """
+        Call func(service, year, month) for every month concurrently
 
-                self.conn.execute(query)
+        Each call gets its own cursor on this service's database, so tables
+        and rollups it creates are visible to this service afterwards.
+        """
+        if len(months) == 1:
+            return [func(self, *months[0])]
 
-                # Clean up temporary file
-                os.unlink(tmp_path)
+        def run(year, month):
+            service = TaxiDataService(conn=self.conn.cursor())
+            service.database_key = self.database_key
+            service.tables = self.tables
+            try:
+                return func(service, year, month)
+            finally:
+                if not service.complete:
+                    self.complete = False
+                service.close()
 
-                print(f"Successfully created table {table_name}")
-                return table_name
-            else:
-                print(f"Curl failed: {result.stderr}")
+        # Each call runs in a copy of the caller's context, so the stages it
+        # times still count towards the current request
+        executor = get_month_executor()
+        futures = [
+            executor.submit(contextvars.copy_context().run, run, year, month)
+            for year, month in months
+        ]
+        return [future.result() for future in futures]
+
+    def get_rollups(
+        self, year: int, month: int, end: tuple = None, taxi_type: str = "yellow"
+    ) -> str:
+        """Relation holding the rollups of every available month in a range"""
+        if self.filters:
+            # Stored rollups cover every trip, so aggregate the filtered
+            # trips into a rollup of the same shape on the fly instead
+            relations = self.get_month_relations(year, month, end)
+            if not relations:
                 return None
+            trips = self.filters.apply(union_all(relations, "trips"))
+            # Callers query the rollup several times, so scan the trips once
+            return self.request_table("filtered_rollup", rollup_query(trips))
 
-        except Exception as e:
-            print(f"Error creating table from {url}: {e}")
+        months = month_range((year, month), end)
+        rollups = self.for_each_month(
+            lambda service, y, m: service.get_rollup(y, m, taxi_type), months
+        )
+        rollups = [rollup for rollup in rollups if rollup]
+        if not rollups:
             return None
+        if len(rollups) < len(months):
+            print(f"Only {len(rollups)} of {len(months)} months are available")
+        return union_all(rollups, "rollups")
 
-    def get_trip_summary(self, year: int, month: int, limit: int = 30) -> list[dict]:
+    def get_trip_summary(
+        self,
+        year: int,
+        month: int,
+        limit: int = 30,
+        end: tuple = None,
+        approx: bool = False,
+    ) -> list[dict]:
         """Get daily trip summary statistics"""
-        table_name = self.create_temp_table(year, month)
-        if not table_name:
+        relations = approx and self.get_month_relations(year, month, end)
+        if relations:
+            return self.summary_from_sample(relations, limit)
+
+        rollup_name = self.get_rollups(year, month, end)
+        if not rollup_name:
             # Return sample data for testing when parquet file is not accessible
-            return [
+            sample = [
                 {
                     "date": f"{year}-{month:02d}-01",
                     "total_trips": 45234,
@@ -167,33 +567,27 @@ class TaxiDataService:
                     "avg_passengers": 1.4,
                 },
             ]
+            return self.from_rows(sample)
 
-        query = f"""
-        SELECT
-            DATE(pickup_datetime) as date,
-            COUNT(*) as total_trips,
-            SUM(total_amount) as total_revenue,
-            AVG(fare_amount) as avg_fare,
-            AVG(trip_distance) as avg_distance,
-            AVG(tip_amount) as avg_tip,
-            AVG(passenger_count) as avg_passengers
-        FROM {table_name}
-        GROUP BY DATE(pickup_datetime)
-        ORDER BY date DESC
-        LIMIT {limit}
-        """
+        return self.summary_from_rollup(rollup_name, limit)
 
-        result = self.conn.execute(query).fetchall()
-        columns = [desc[0] for desc in self.conn.description]
-
-        return [dict(zip(columns, row, strict=False)) for row in result]
-
-    def get_heatmap_data(self, year: int, month: int, limit: int = 1000) -> list[dict]:
+    def get_heatmap_data(
+        self,
+        year: int,
+        month: int,
+        limit: int = 1000,
+        end: tuple = None,
+        approx: bool = False,
+    ) -> list[dict]:
         """Get pickup location data for heatmap (using zone IDs)"""
-        table_name = self.create_temp_table(year, month)
-        if not table_name:
+        relations = approx and self.get_month_relations(year, month, end)
+        if relations:
+            return self.heatmap_from_sample(relations, limit)
+
+        rollup_name = self.get_rollups(year, month, end)
+        if not rollup_name:
             # Return sample data for testing when parquet file is not accessible
-            return [
+            sample = [
                 {
                     "pickup_location_id": 161,
                     "trip_count": 12543,
@@ -255,57 +649,248 @@ class TaxiDataService:
                     "avg_distance": 5.1,
                 },
             ]
+            return self.from_rows(sample)
 
+        return self.heatmap_from_rollup(rollup_name, limit)
+
+    def get_revenue_analytics(self, year: int, month: int, end: tuple = None) -> dict:
+        """Get revenue analytics by hour, day of week, etc."""
+        rollup_name = self.get_rollups(year, month, end)
+        if not rollup_name:
+            return {}
+
+        return self.revenue_from_rollup(rollup_name)
+
+    def get_trip_stats(
+        self, year: int, month: int, end: tuple = None, approx: bool = False
+    ) -> dict:
+        """Get basic trip statistics"""
+        relations = approx and self.get_month_relations(year, month, end)
+        if relations:
+            return self.stats_from_sample(relations)
+
+        rollup_name = self.get_rollups(year, month, end)
+        if not rollup_name:
+            return {}
+
+        return self.stats_from_rollup(rollup_name)
+
+    def get_dashboard(
+        self,
+        year: int,
+        month: int,
+        summary_limit: int = 30,
+        heatmap_limit: int = 1000,
+        end: tuple = None,
+    ) -> dict:
+        """Get summary, heatmap, revenue and stats from one rollup in one call"""
+        rollup_name = self.get_rollups(year, month, end)
+        if not rollup_name:
+            return {
+                "summary": self.get_trip_summary(year, month, summary_limit, end),
+                "heatmap": self.get_heatmap_data(year, month, heatmap_limit, end),
+                "revenue": {},
+                "stats": {},
+            }
+
+        return {
+            "summary": self.summary_from_rollup(rollup_name, summary_limit),
+            "heatmap": self.heatmap_from_rollup(rollup_name, heatmap_limit),
+            "revenue": self.revenue_from_rollup(rollup_name),
+            "stats": self.stats_from_rollup(rollup_name),
+        }
+
+    def get_month_relations(self, year: int, month: int, end: tuple = None) -> list:
+        """Month views or tables of every available month in a range"""
+        months = month_range((year, month), end)
+        relations = self.for_each_month(
+            lambda service, y, m: service.create_temp_table(y, m), months
+        )
+        available = []
+        for (y, m), relation in zip(months, relations, strict=True):
+            if not relation:
+                continue
+            # Remote months were only attached to the cursors that loaded them
+            attach_remote(self.conn, f"{relation}_remote")
+            available.append(self.prune_partitions(relation, y, m))
+        return available
+
+    def prune_partitions(
+        self, relation: str, year: int, month: int, taxi_type: str = "yellow"
+    ) -> str:
+        """Month relation reading only the lake partitions the date filters keep"""
+        month_dir = self.lake.month_dir(year, month, taxi_type)
+        if self._view_sources.get(relation) != month_dir:
+            return relation
+        if self.relation_type(relation) != "view":
+            return relation
+
+        days = self.lake.partition_days(
+            year, month, self.filters.date_from, self.filters.date_to
+        )
+        if days is None:
+            return relation
+        month_glob = self.lake.month_glob(year, month, taxi_type)
+        return f"({self.lake_source(month_glob, days)}) {relation}"
+
+    def sample_ctes(self, relations: list, population_columns: str = "") -> str:
+        """
+        CTEs for approximate queries over the months of a range
+
+        "population" holds the exact trip count, plus population_columns,
+        from a scan of the narrow columns they use only, and "sample" a
+        system sample of every month.
+        """
+        population = union_all(relations, "trips")
+        sample = union_all(
+            [sampled(relation, self.sample_percent) for relation in relations],
+            "trips",
+        )
+        return f"""
+        WITH population AS (
+            SELECT COUNT(*) AS trips {population_columns}
+            FROM {population}
+            {self.filters.where()}
+        ),
+        sample AS MATERIALIZED (
+            SELECT * FROM {sample}
+            {self.filters.where()}
+        )
+        """
+
+    def summary_from_sample(self, relations: list, limit: int = 30) -> list[dict]:
+        """Approximate daily trip summary from a sample of the trips"""
         query = f"""
+        {self.sample_ctes(relations)}
+        SELECT
+            DATE(pickup_datetime) as date,
+            {estimate_total("1", "total_trips", integer=True)},
+            {estimate_total("total_amount", "total_revenue")},
+            {estimate_mean("fare_amount", "avg_fare")},
+            {estimate_mean("trip_distance", "avg_distance")},
+            {estimate_mean("tip_amount", "avg_tip")},
+            {estimate_mean("passenger_count", "avg_passengers")}
+        FROM sample
+        GROUP BY DATE(pickup_datetime)
+        ORDER BY date DESC
+        LIMIT {limit}
+        """
+
+        return self.fetch_all(query)
+
+    def heatmap_from_sample(self, relations: list, limit: int = 1000) -> list[dict]:
+        """Approximate pickup zone aggregates from a sample of the trips"""
+        query = f"""
+        {self.sample_ctes(relations)}
         SELECT
             pickup_location_id,
-            COUNT(*) as trip_count,
-            AVG(fare_amount) as avg_fare,
-            AVG(trip_distance) as avg_distance
-        FROM {table_name}
+            {estimate_total("1", "trip_count", integer=True)},
+            {estimate_mean("fare_amount", "avg_fare")},
+            {estimate_mean("trip_distance", "avg_distance")}
+        FROM sample
         WHERE pickup_location_id IS NOT NULL
         GROUP BY pickup_location_id
         ORDER BY trip_count DESC
         LIMIT {limit}
         """
 
-        result = self.conn.execute(query).fetchall()
-        columns = [desc[0] for desc in self.conn.description]
+        return self.fetch_all(query)
 
-        return [dict(zip(columns, row, strict=False)) for row in result]
+    def stats_from_sample(self, relations: list) -> dict:
+        """Approximate trip statistics from a sample of the trips"""
+        population_columns = """,
+            MIN(pickup_datetime) AS earliest_trip,
+            MAX(pickup_datetime) AS latest_trip,
+            COUNT(DISTINCT pickup_location_id) AS unique_pickup_locations,
+            COUNT(DISTINCT dropoff_location_id) AS unique_dropoff_locations
+        """
+        query = f"""
+        {self.sample_ctes(relations, population_columns)}
+        SELECT
+            population.trips as total_trips,
+            estimates.*,
+            population.* EXCLUDE (trips)
+        FROM population, (
+            SELECT
+                {estimate_total("total_amount", "total_revenue")},
+                {estimate_mean("fare_amount", "avg_fare")},
+                {estimate_mean("trip_distance", "avg_distance")},
+                {estimate_mean("tip_amount", "avg_tip")}
+            FROM sample
+        ) estimates
+        """
 
-    def get_revenue_analytics(self, year: int, month: int) -> dict:
-        """Get revenue analytics by hour, day of week, etc."""
-        table_name = self.create_temp_table(year, month)
-        if not table_name:
-            return {}
+        return self.fetch_one(query)
 
+    def summary_from_rollup(self, rollup_name: str, limit: int = 30) -> list[dict]:
+        """Daily trip summary from a rollup table"""
+        query = f"""
+        SELECT
+            day as date,
+            SUM(trips)::BIGINT as total_trips,
+            SUM(revenue_sum) as total_revenue,
+            SUM(fare_sum) / NULLIF(SUM(fare_n), 0) as avg_fare,
+            SUM(distance_sum) / NULLIF(SUM(distance_n), 0) as avg_distance,
+            SUM(tip_sum) / NULLIF(SUM(tip_n), 0) as avg_tip,
+            SUM(passengers_sum) / NULLIF(SUM(passengers_n), 0) as avg_passengers
+        FROM {rollup_name}
+        WHERE grain = 'day'
+        GROUP BY day
+        ORDER BY date DESC
+        LIMIT {limit}
+        """
+
+        return self.fetch_all(query)
+
+    def heatmap_from_rollup(self, rollup_name: str, limit: int = 1000) -> list[dict]:
+        """Pickup zone aggregates from a rollup table"""
+        query = f"""
+        SELECT
+            pickup_zone as pickup_location_id,
+            SUM(trips)::BIGINT as trip_count,
+            SUM(fare_sum) / NULLIF(SUM(fare_n), 0) as avg_fare,
+            SUM(distance_sum) / NULLIF(SUM(distance_n), 0) as avg_distance
+        FROM {rollup_name}
+        WHERE grain = 'pickup_zone' AND pickup_zone IS NOT NULL
+        GROUP BY pickup_zone
+        ORDER BY trip_count DESC
+        LIMIT {limit}
+        """
+
+        return self.fetch_all(query)
+
+    def revenue_from_rollup(self, rollup_name: str) -> dict:
+        """Revenue by hour and day of week from a rollup table"""
         # Revenue by hour
         hourly_query = f"""
         SELECT
-            EXTRACT(HOUR FROM pickup_datetime) as hour,
-            COUNT(*) as trips,
-            SUM(total_amount) as revenue,
-            AVG(fare_amount) as avg_fare
-        FROM {table_name}
-        GROUP BY EXTRACT(HOUR FROM pickup_datetime)
+            hour,
+            SUM(trips)::BIGINT as trips,
+            SUM(revenue_sum) as revenue,
+            SUM(fare_sum) / NULLIF(SUM(fare_n), 0) as avg_fare
+        FROM {rollup_name}
+        WHERE grain = 'hour'
+        GROUP BY hour
         ORDER BY hour
         """
 
         # Revenue by day of week
         daily_query = f"""
         SELECT
-            EXTRACT(DOW FROM pickup_datetime) as day_of_week,
-            COUNT(*) as trips,
-            SUM(total_amount) as revenue,
-            AVG(fare_amount) as avg_fare
-        FROM {table_name}
-        GROUP BY EXTRACT(DOW FROM pickup_datetime)
+            dow as day_of_week,
+            SUM(trips)::BIGINT as trips,
+            SUM(revenue_sum) as revenue,
+            SUM(fare_sum) / NULLIF(SUM(fare_n), 0) as avg_fare
+        FROM {rollup_name}
+        WHERE grain = 'dow'
+        GROUP BY dow
         ORDER BY day_of_week
         """
 
-        hourly_result = self.conn.execute(hourly_query).fetchall()
-        daily_result = self.conn.execute(daily_query).fetchall()
+        hourly_result = self.execute(hourly_query).fetchall()
+        record_rows_scanned(self.conn)
+        daily_result = self.execute(daily_query).fetchall()
+        record_rows_scanned(self.conn)
 
         return {
             "hourly": [
@@ -318,36 +903,220 @@ class TaxiDataService:
             ],
         }
 
-    def get_trip_stats(self, year: int, month: int) -> dict:
-        """Get basic trip statistics"""
-        table_name = self.create_temp_table(year, month)
-        if not table_name:
-            return {}
-
+    def stats_from_rollup(self, rollup_name: str) -> dict:
+        """Overall trip statistics from a rollup table"""
+        # Totals come from the day grain, distinct zones from the zone grains
         query = f"""
         SELECT
-            COUNT(*) as total_trips,
-            SUM(total_amount) as total_revenue,
-            AVG(fare_amount) as avg_fare,
-            AVG(trip_distance) as avg_distance,
-            AVG(tip_amount) as avg_tip,
-            MIN(pickup_datetime) as earliest_trip,
-            MAX(pickup_datetime) as latest_trip,
-            COUNT(DISTINCT pickup_location_id) as unique_pickup_locations,
-            COUNT(DISTINCT dropoff_location_id) as unique_dropoff_locations
-        FROM {table_name}
+            SUM(trips)::BIGINT as total_trips,
+            SUM(revenue_sum) as total_revenue,
+            SUM(fare_sum) / NULLIF(SUM(fare_n), 0) as avg_fare,
+            SUM(distance_sum) / NULLIF(SUM(distance_n), 0) as avg_distance,
+            SUM(tip_sum) / NULLIF(SUM(tip_n), 0) as avg_tip,
+            MIN(first_pickup) as earliest_trip,
+            MAX(last_pickup) as latest_trip,
+            (
+                SELECT COUNT(DISTINCT pickup_zone) FROM {rollup_name}
+                WHERE grain = 'pickup_zone'
+            ) as unique_pickup_locations,
+            (
+                SELECT COUNT(DISTINCT dropoff_zone) FROM {rollup_name}
+                WHERE grain = 'dropoff_zone'
+            ) as unique_dropoff_locations
+        FROM {rollup_name}
+        WHERE grain = 'day'
+        """
+
+        return self.fetch_one(query)
+
+    def get_sample_trips(
+        self,
+        year: int,
+        month: int,
+        limit: int = 100,
+        end: tuple = None,
+        cursor: tuple = None,
+    ) -> tuple:
         """
+        Get one page of trips, newest first, and the cursor of the next page
+
+        Pages are read month by month, newest month first, from files sorted
+        on (pickup_datetime, trip_id), so any page is a short range scan.
+        The next cursor is None once the range is exhausted.
+        """
+        months = sorted(month_range((year, month), end), reverse=True)
+        if cursor:
+            months = [ym for ym in months if ym <= cursor[:2]]
+
+        pages = []
+        remaining = limit
+        for y, m in months:
+            view_name = self.get_sorted_trips(y, m)
+            if not view_name:
+                continue
+
+            after = cursor is not None and (y, m) == cursor[:2]
+            params = {"pickup": cursor[2], "trip_id": cursor[3]} if after else None
+            page = self.execute(
+                page_query(view_name, remaining, after, self.filters), params
+            ).fetch_arrow_table()
+            record_rows_scanned(self.conn)
+            if page.num_rows:
+                pages.append((y, m, page))
+                remaining -= page.num_rows
+            if remaining <= 0:
+                break
+
+        if not pages:
+            return self.from_rows([]), None
+
+        next_cursor = None
+        if remaining <= 0:
+            y, m, page = pages[-1]
+            next_cursor = encode_cursor(
+                y,
+                m,
+                page.column("pickup_datetime")[-1].as_py(),
+                page.column("trip_id")[-1].as_py(),
+            )
+        table = pa.concat_tables([page for _, _, page in pages])
+        return self.from_table(table), next_cursor
 
-        result = self.conn.execute(query).fetchone()
-        columns = [desc[0] for desc in self.conn.description]
+    def get_sorted_trips(self, year: int, month: int, taxi_type: str = "yellow") -> str:
+        """View over the month's trips sorted newest first, built only once"""
+        view_name = f"trips_sorted_{taxi_type}_{year}_{month:02d}"
+        key = self.cache.month_key(year, month, taxi_type)
 
-        return dict(zip(columns, result, strict=False))
+        def load():
+            fingerprint = self.cache.fingerprint(year, month, taxi_type)
+            path = fingerprint and self.sorted_trips.find(key, fingerprint)
+            if not path:
+                # Pages are keyed on trip_id, which remote months don't have
+                table_name = self.create_temp_table(
+                    year, month, taxi_type, remote=False
+                )
+                if not table_name:
+                    return None
+                fingerprint = self.cache.fingerprint(year, month, taxi_type)
+                # Only one worker sorts the month, the others reuse the file
+                path = get_single_flight().do(
+                    f"sorted-{key}",
+                    lambda: (
+                        self.sorted_trips.find(key, fingerprint)
+                        or self.sorted_trips.build(
+                            self.conn, table_name, key, fingerprint
+                        )
+                    ),
+                )
+
+            if self._sorted_sources.get(view_name) != path or not (
+                self.relation_exists(view_name)
+            ):
+                self.conn.execute(
+                    f"""
+                    CREATE OR REPLACE VIEW {view_name} AS
+                    SELECT * FROM read_parquet('{path}')
+                    """
+                )
+                self._sorted_sources[view_name] = path
+            return view_name
+
+        try:
+            return self.loaded(
+                get_single_flight().do(
+                    f"sorted-{self.database_key}-{view_name}", load, shared=False
+                )
+            )
+        except ColdLoadInProgress:
+            raise
+        except Exception as e:
+            print(f"Error loading sorted trips for {key}: {e}")
+            return self.loaded(None)
+
+    def get_flows(
+        self,
+        year: int,
+        month: int,
+        origin: int = None,
+        limit: int = 10,
+        end: tuple = None,
+    ) -> list[dict]:
+        """Busiest zone-to-zone flows, optionally from a single pickup zone"""
+        if self.filters:
+            # Stored matrices cover every trip, so build this one on the fly
+            relations = self.get_month_relations(year, month, end)
+            if not relations:
+                return self.from_rows([])
+            trips = self.filters.apply(union_all(relations, "trips"))
+            pairs = self.execute(self.od_matrices.query(trips)).fetchnumpy()
+            record_rows_scanned(self.conn)
+            return self.from_rows(top_flows(to_matrix(pairs), origin, limit))
+
+        months = month_range((year, month), end)
+        paths = self.for_each_month(
+            lambda service, y, m: service.get_od_matrix(y, m), months
+        )
+        matrices = [load_matrix(path) for path in paths if path]
+        if not matrices:
+            return self.from_rows([])
 
-    def get_sample_trips(self, year: int, month: int, limit: int = 100) -> list[dict]:
-        """Get sample trips for display"""
-        table_name = self.create_temp_table(year, month)
-        if not table_name:
-            return []
+        return self.from_rows(top_flows(combine(matrices), origin, limit))
+
+    def get_od_matrix(self, year: int, month: int, taxi_type: str = "yellow") -> str:
+        """Path of the month's origin-destination matrix, built only once"""
+        key = self.cache.month_key(year, month, taxi_type)
+
+        try:
+            fingerprint = self.cache.fingerprint(year, month, taxi_type)
+            path = fingerprint and self.od_matrices.find(key, fingerprint)
+            if path:
+                return path
+
+            table_name = self.create_temp_table(year, month, taxi_type)
+            if not table_name:
+                return None
+            fingerprint = self.cache.fingerprint(year, month, taxi_type)
+            # Only one worker builds the matrix, the others reuse the file
+            return self.loaded(
+                get_single_flight().do(
+                    f"od-{key}",
+                    lambda: (
+                        self.od_matrices.find(key, fingerprint)
+                        or self.od_matrices.build(
+                            self.conn, table_name, key, fingerprint
+                        )
+                    ),
+                )
+            )
+
+        except ColdLoadInProgress:
+            raise
+        except Exception as e:
+            print(f"Error loading OD matrix for {key}: {e}")
+            return self.loaded(None)
+
+    def get_trip_batches(
+        self,
+        year: int,
+        month: int,
+        end: tuple = None,
+        limit: int = None,
+        batch_size: int = None,
+    ):
+        """
+        Open a reader over every trip of a month range, or None if unavailable
+
+        The reader pulls record batches from DuckDB as they are consumed, so
+        memory stays bounded by batch_size however many trips are exported.
+        It runs on this service's connection, so close the service only once
+        the reader is exhausted.
+        """
+        relations = self.get_month_relations(year, month, end)
+        if not relations:
+            return None
+        table_name = union_all(relations, "trips")
+        limit_clause = f"LIMIT {limit}" if limit else ""
+        batch_size = batch_size or get_setting("TAXI_EXPORT_BATCH_SIZE", 50_000)
 
         query = f"""
         SELECT
@@ -359,18 +1128,102 @@ class TaxiDataService:
             dropoff_location_id,
             fare_amount,
             tip_amount,
-            total_amount
+            total_amount,
+            payment_type
         FROM {table_name}
-        ORDER BY pickup_datetime DESC
-        LIMIT {limit}
+        {self.filters.where()}
+        {limit_clause}
         """
 
-        result = self.conn.execute(query).fetchall()
-        columns = [desc[0] for desc in self.conn.description]
+        return self.execute(query).to_arrow_reader(batch_size)
+
+    def request_table(self, name: str, query: str) -> str:
+        """Materialize a query into a temporary table kept until close()"""
+        self.execute(f"CREATE OR REPLACE TEMP TABLE {name} AS {query}")
+        record_rows_scanned(self.conn)
+        if name not in self.request_tables:
+            self.request_tables.append(name)
+        return name
+
+    def execute(self, query: str, params: dict = None):
+        """
+        Run a query, binding the filter parameters it references
+
+        DuckDB only finishes counting the rows a query scanned once its
+        result is fetched, so callers record_rows_scanned() afterwards.
+        """
+        params = {**self.filters.params_for(query), **(params or {})}
+        with timed("query"):
+            return self.conn.execute(query, params or None)
+
+    def fetch_all(self, query: str, params=None):
+        """
+        Run a query and return its result in the service's output format
+
+        "rows" gives a list of dicts; "arrow" hands DuckDB's Arrow result
+        over as-is, without building a Python object per row; "columnar"
+        gives one list per column (see to_columnar).
+        """
+        result = self.execute(query, params)
+        with timed("fetch"):
+            if self.output == "rows":
+                rows = result.fetchall()
+                columns = [desc[0] for desc in result.description]
+                data = [dict(zip(columns, row, strict=False)) for row in rows]
+            else:
+                data = result.fetch_arrow_table()
+        record_rows_scanned(self.conn)
+        ROWS_RETURNED.inc(len(data) if self.output == "rows" else data.num_rows)
+
+        if self.output == "columnar":
+            return to_columnar(data)
+        return data
+
+    def fetch_one(self, query: str, params=None):
+        """Run a single-row query and return it in the service's output format"""
+        if self.output == "arrow":
+            return self.fetch_all(query, params)
+
+        result = self.execute(query, params)
+        # Exhaust the result, DuckDB only reports the rows scanned afterwards
+        rows = result.fetchall()
+        record_rows_scanned(self.conn)
+        if not rows:
+            return {}
+        row = rows[0]
+        ROWS_RETURNED.inc()
+        columns = [desc[0] for desc in result.description]
+        return dict(zip(columns, row, strict=False))
+
+    def from_rows(self, rows: list[dict]):
+        """Convert rows built in Python to the service's output format"""
+        if self.output == "rows":
+            return rows
+        return self.from_table(pa.Table.from_pylist(rows))
 
-        return [dict(zip(columns, row, strict=False)) for row in result]
+    def from_table(self, table: pa.Table):
+        """Convert an Arrow table to the service's output format"""
+        if self.output == "arrow":
+            return table
+        if self.output == "columnar":
+            return to_columnar(table)
+        return table.to_pylist()
 
     def close(self):
-        """Close the DuckDB connection"""
-        if self.conn:
+        """Close the DuckDB connection, or return it to the pool"""
+        if not self.conn:
+            return
+        # Pooled cursors outlive the request, its temporary tables must not
+        for name in self.request_tables:
+            try:
+                self.conn.execute(f"DROP TABLE IF EXISTS temp.{name}")
+            except duckdb.Error:
+                pass
+        self.request_tables = []
+        if self.pool:
+            # Tables kept past the budget while in use can go once idle
+            self.tables.evict(self.conn)
+            self.pool.checkin(self.conn)
+        else:
             self.conn.close()
+        self.conn = None
@@ -0,0 +1,118 @@
+"""
+Single-flight coalescing of expensive cold loads
+
+When several requests need the same uncached month at once, only one of
+them downloads or builds it. Other threads of the same process wait for
+that result, and other worker processes wait on a lock file in the cache
+directory. Waiters that run out of patience get a retry hint instead.
+"""
+
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .conf import get_setting
+
+
+class ColdLoadInProgress(Exception):
+    """Raised when another request is still loading the same data"""
+
+    def __init__(self, key: str, retry_after: int):
+        super().__init__(f"{key} is still loading, retry in {retry_after}s")
+        self.key = key
+        self.retry_after = retry_after
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Run at most one call per key at a time
+    """
+
+    def __init__(self, lock_dir: str = None, wait: float = None):
+        cache_dir = get_setting("TAXI_CACHE_DIR", "/tmp/taxi_cache")
+        self.lock_dir = lock_dir or os.path.join(cache_dir, "locks")
+        self.wait = get_setting("TAXI_COLD_LOAD_WAIT", 60) if wait is None else wait
+        self.retry_after = get_setting("TAXI_COLD_LOAD_RETRY_AFTER", 10)
+        self._calls = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def do(self, key: str, func, shared: bool = True):
+        """
+        Call func() unless a call for the same key is already running
+
+        Threads arriving while the call runs get its result (or exception).
+        With shared=True the call also holds a lock file, so other worker
+        processes run it one at a time; func should therefore re-check for
+        a result another process may have produced in the meantime.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(self.wait):
+                raise ColdLoadInProgress(key, self.retry_after)
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            if shared:
+                with self.file_lock(key):
+                    call.result = func()
+            else:
+                call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    @contextmanager
+    def file_lock(self, key: str):
+        """Hold an exclusive lock file shared by every worker process"""
+        path = os.path.join(self.lock_dir, f"{key}.lock")
+        deadline = time.monotonic() + self.wait
+
+        with open(path, "a") as lock_file:
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        raise ColdLoadInProgress(key, self.retry_after) from None
+                    time.sleep(0.1)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Return the single-flight group of the current process"""
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
@@ -0,0 +1,61 @@
+"""
+Month trip files physically sorted on pickup time, newest first
+
+Keyset pagination reads pages straight off these files: with rows in
+(pickup_datetime, trip_id) order, parquet row group statistics let DuckDB
+skip to the cursor, and a LIMIT without ORDER BY stops after one page
+instead of sorting the whole month on every request.
+"""
+
+from .rollups import RollupStore
+
+# Small row groups keep the statistics fine-grained enough to seek with
+ROW_GROUP_SIZE = 16_384
+
+TRIP_COLUMNS = """
+    trip_id,
+    pickup_datetime,
+    dropoff_datetime,
+    passenger_count,
+    trip_distance,
+    pickup_location_id,
+    dropoff_location_id,
+    fare_amount,
+    tip_amount,
+    total_amount,
+    payment_type
+"""
+
+
+class SortedTripStore(RollupStore):
+    """
+    On-disk store of month trip files sorted for keyset pagination
+    """
+
+    dir_setting = ("TAXI_SORTED_DIR", "/tmp/taxi_sorted")
+    copy_options = f"FORMAT PARQUET, ROW_GROUP_SIZE {ROW_GROUP_SIZE}"
+    stage = "sort_build"
+
+    def query(self, relation: str) -> str:
+        return f"""
+        SELECT {TRIP_COLUMNS}
+        FROM {relation}
+        ORDER BY pickup_datetime DESC, trip_id DESC
+        """
+
+
+def page_query(relation: str, limit: int, after: bool = False, filters=None) -> str:
+    """
+    Next page of a sorted trip file, optionally after a ($pickup, $trip_id) key
+
+    Relies on DuckDB preserving insertion order for scans without ORDER BY,
+    so rows come back in file order and the scan ends at the LIMIT.
+    """
+    conditions = list(filters.predicates) if filters else []
+    if after:
+        conditions += [
+            "pickup_datetime <= $pickup",
+            "(pickup_datetime < $pickup OR trip_id < $trip_id)",
+        ]
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"SELECT {TRIP_COLUMNS} FROM {relation} {where} LIMIT {limit}"
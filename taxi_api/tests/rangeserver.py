@@ -0,0 +1,118 @@
+"""
+Local HTTP server of the files in a directory, for offline tests
+
+Supports HEAD, single byte Range requests, ETags and If-Range like the TLC
+CDN does, counts the bytes it sends, and can drop connections part way
+through a response to simulate a flaky network.
+"""
+
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RangeServer:
+    """
+    Serve root over HTTP on a free local port, in a background thread
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        # ETag of every file, change one to simulate a new upstream version
+        self.etags = {}
+        # Answer Range requests with 206, or ignore them like some servers do
+        self.ranges = True
+        # Number of responses longer than drop_after bytes to cut off there
+        self.drops = 0
+        self.drop_after = 0
+        self.bytes_sent = 0
+        self.requests = []
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def etag(self, name: str) -> str:
+        return self.etags.get(name, '"v1"')
+
+    def take_drop(self) -> bool:
+        """Whether the response being sent should be cut off"""
+        with self._lock:
+            if self.drops <= 0:
+                return False
+            self.drops -= 1
+            return True
+
+    def sent(self, count: int):
+        with self._lock:
+            self.bytes_sent += count
+
+    def byte_range(self, headers, size: int, etag: str) -> tuple[int, int, int]:
+        """First byte, last byte and status of the response to a request"""
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", headers["Range"] or "")
+        if not self.ranges or not match or headers.get("If-Range") not in (None, etag):
+            return 0, size - 1, 200
+        end = int(match[2]) if match[2] else size - 1
+        return int(match[1]), min(end, size - 1), 206
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self.serve(body=False)
+
+            def do_GET(self):
+                self.serve(body=True)
+
+            def serve(self, body: bool):
+                name = os.path.basename(self.path)
+                path = os.path.join(server.root, name)
+                server.requests.append((self.command, self.headers.get("Range")))
+                if not os.path.isfile(path):
+                    self.send_error(404)
+                    return
+
+                size = os.path.getsize(path)
+                etag = server.etag(name)
+                start, end, status = server.byte_range(self.headers, size, etag)
+
+                self.send_response(status)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(end - start + 1))
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                self.end_headers()
+                if not body:
+                    return
+
+                length = end - start + 1
+                if length > server.drop_after and server.take_drop():
+                    length = min(length, server.drop_after)
+                    self.close_connection = True
+                with open(path, "rb") as f:
+                    f.seek(start)
+                    data = f.read(length)
+                try:
+                    self.wfile.write(data)
+                except ConnectionError:
+                    # The client stopped reading, as on an If-Range mismatch
+                    return
+                server.sent(len(data))
+
+        return Handler
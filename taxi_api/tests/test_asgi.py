@@ -0,0 +1,57 @@
+from asgiref.sync import iscoroutinefunction
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.test import SimpleTestCase, override_settings
+
+from portfolio_blog.middleware import AsyncWhiteNoiseMiddleware
+
+STATIC_FILE = settings.BASE_DIR / "blog" / "static" / "evan_headshot.jpeg"
+
+
+# Serve from the finders, so the test does not need collectstatic
+@override_settings(WHITENOISE_AUTOREFRESH=True, WHITENOISE_USE_FINDERS=True)
+class AsyncWhiteNoiseTests(SimpleTestCase):
+    """Static files are served by the async middleware under ASGI"""
+
+    async def get(self, path: str) -> tuple[int, bytes]:
+        # Built here rather than imported, so it picks up the settings above
+        application = ASGIHandler()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "headers": [(b"host", b"testserver")],
+            "server": ("testserver", 80),
+            "client": ("127.0.0.1", 1234),
+        }
+        communicator = ApplicationCommunicator(application, scope)
+        await communicator.send_input({"type": "http.request", "body": b""})
+        start = await communicator.receive_output(timeout=5)
+        body = b""
+        while True:
+            message = await communicator.receive_output(timeout=5)
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        await communicator.wait(timeout=5)
+        return start["status"], body
+
+    async def test_static_file_is_served(self):
+        status, body = await self.get("/static/evan_headshot.jpeg")
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body, STATIC_FILE.read_bytes())
+
+    def test_middleware_is_async_under_asgi(self):
+        async def get_response(request):
+            pass
+
+        middleware = AsyncWhiteNoiseMiddleware(get_response)
+
+        self.assertTrue(iscoroutinefunction(middleware))
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+from unittest import skipUnless
+
+import duckdb
+from django.test import SimpleTestCase
+
+from taxi_api.benchmark import generate_month
+from taxi_api.copy_loader import copy_batches
+
+# e.g. "host=127.0.0.1 port=5432 dbname=postgres user=postgres"
+DSN = os.getenv("TAXI_TEST_POSTGRES_DSN")
+
+TABLE = "taxi_copy_loader_test"
+COLUMNS = ["pickup_datetime", "pickup_location_id", "fare_amount"]
+
+
+@skipUnless(DSN, "Set TAXI_TEST_POSTGRES_DSN to run the PostgreSQL COPY tests")
+class CopyBatchesTests(SimpleTestCase):
+    """COPY loads of a small synthetic month into a real PostgreSQL table"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp()
+        cls.month_path = os.path.join(cls.root, "yellow_tripdata_2023-03.parquet")
+        generate_month(cls.month_path, 2023, 3, 20_000)
+        cls.expected = duckdb.sql(
+            f"SELECT COUNT(*), SUM(fare_amount) FROM '{cls.month_path}'"
+        ).fetchone()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        import psycopg2
+
+        self.db = psycopg2.connect(DSN)
+        with self.db, self.db.cursor() as cursor:
+            cursor.execute(
+                f"""
+                DROP TABLE IF EXISTS {TABLE};
+                CREATE TABLE {TABLE} (
+                    id BIGSERIAL PRIMARY KEY,
+                    pickup_datetime TIMESTAMP NOT NULL,
+                    pickup_location_id INTEGER,
+                    fare_amount NUMERIC(10, 2) NOT NULL
+                )
+                """
+            )
+
+    def tearDown(self):
+        with self.db, self.db.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        self.db.close()
+
+    def batches(self):
+        return duckdb.execute(
+            f"""
+            SELECT tpep_pickup_datetime, PULocationID, fare_amount
+            FROM '{self.month_path}'
+            """
+        ).to_arrow_reader(3_000)
+
+    def load(self, batches, replace=False) -> int:
+        with self.db, self.db.cursor() as cursor:
+            return copy_batches(cursor, batches, TABLE, COLUMNS, replace=replace)
+
+    def table_stats(self):
+        with self.db, self.db.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*), SUM(fare_amount) FROM {TABLE}")
+            count, fares = cursor.fetchone()
+        return count, float(fares or 0)
+
+    def test_every_row_is_copied(self):
+        self.assertEqual(self.load(self.batches()), self.expected[0])
+
+        count, fares = self.table_stats()
+        self.assertEqual(count, self.expected[0])
+        self.assertAlmostEqual(fares, self.expected[1], places=2)
+
+    def test_replacing_is_idempotent(self):
+        self.load(self.batches())
+        self.load(self.batches(), replace=True)
+        self.assertEqual(self.table_stats()[0], self.expected[0])
+
+        self.load(self.batches())
+        self.assertEqual(self.table_stats()[0], 2 * self.expected[0])
+
+    def test_failed_replace_keeps_the_old_rows(self):
+        self.load(self.batches())
+
+        def failing():
+            reader = self.batches()
+            yield reader.read_next_batch()
+            raise OSError("connection to upstream lost")
+
+        with self.assertRaises(OSError):
+            self.load(failing(), replace=True)
+        self.assertEqual(self.table_stats()[0], self.expected[0])
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from taxi_api.downloader import DownloadError, RangeDownloader
+from taxi_api.parquet_cache import ParquetCache
+
+from .rangeserver import RangeServer
+
+NAME = "yellow_tripdata_2023-03.parquet"
+SIZE = 1_000_000
+
+
+class DownloaderTests(SimpleTestCase):
+    """Downloads against a local range server that drops connections"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.upstream = os.path.join(self.root, "upstream")
+        os.makedirs(self.upstream)
+        self.write_upstream(os.urandom(SIZE))
+        self.server = RangeServer(self.upstream).__enter__()
+        self.url = f"{self.server.base_url}/{NAME}"
+        self.path = os.path.join(self.root, NAME)
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def write_upstream(self, data: bytes):
+        self.data = data
+        with open(os.path.join(self.upstream, NAME), "wb") as f:
+            f.write(data)
+
+    def downloader(self, **kwargs) -> RangeDownloader:
+        kwargs = {"segments": 2, "min_segment_bytes": 1, "chunk_bytes": 1024, **kwargs}
+        return RangeDownloader(**kwargs)
+
+    def assertDownloaded(self):
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(sorted(os.listdir(self.root)), sorted(["upstream", NAME]))
+
+    def test_dropped_connection_resumes_from_last_chunk(self):
+        self.server.drops = 1
+        self.server.drop_after = 100_000
+
+        stats = self.downloader(retries=1).download(self.url, self.path)
+
+        self.assertDownloaded()
+        self.assertEqual(stats["downloaded_bytes"], SIZE)
+        # Only the bytes of the last incomplete chunk are fetched twice
+        self.assertLessEqual(self.server.bytes_sent, SIZE + 1 + 1024)
+
+    def test_interrupted_download_resumes_on_next_attempt(self):
+        self.server.drops = 2
+        self.server.drop_after = 100_000
+        with self.assertRaises(DownloadError):
+            self.downloader(retries=0).download(self.url, self.path)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(os.path.exists(f"{self.path}.part.json"))
+
+        stats = self.downloader().download(self.url, self.path)
+
+        self.assertDownloaded()
+        self.assertTrue(stats["resumed"])
+        self.assertLessEqual(stats["downloaded_bytes"], SIZE - 2 * 97 * 1024)
+
+    def test_changed_upstream_is_fetched_again(self):
+        self.server.drops = 2
+        self.server.drop_after = 100_000
+        with self.assertRaises(DownloadError):
+            self.downloader(retries=0).download(self.url, self.path)
+
+        self.write_upstream(os.urandom(SIZE))
+        self.server.etags[NAME] = '"v2"'
+        stats = self.downloader().download(self.url, self.path)
+
+        self.assertDownloaded()
+        self.assertFalse(stats["resumed"])
+
+    def test_if_range_restarts_when_upstream_changes_mid_download(self):
+        server = self.server
+        changes = []
+
+        class Changing(RangeDownloader):
+            def probe(self, url):
+                probed = super().probe(url)
+                if not changes:
+                    # The file changes between the probe and the segments
+                    changes.append(True)
+                    server.etags[NAME] = '"v2"'
+                return probed
+
+        stats = Changing(segments=2, min_segment_bytes=1).download(self.url, self.path)
+
+        self.assertDownloaded()
+        self.assertEqual(stats["bytes"], SIZE)
+        # The stale segment requests carried If-Range and got the whole file
+        self.assertEqual(len([r for r in server.requests if r[1] == "bytes=0-0"]), 2)
+
+    def test_server_without_ranges_gets_a_single_stream(self):
+        self.server.ranges = False
+
+        stats = self.downloader().download(self.url, self.path)
+
+        self.assertDownloaded()
+        self.assertEqual(stats["segments"], 1)
+
+
+class RemoveStaleTests(SimpleTestCase):
+    def test_leftovers_of_every_fingerprint_are_removed(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ParquetCache(cache_dir=cache_dir)
+            key = cache.month_key(2023, 3)
+            keep = cache.path_for(key, "new")
+            old = cache.path_for(key, "old")
+            for path in (
+                keep,
+                f"{keep}.part.lock",
+                old,
+                f"{old}.part",
+                f"{old}.part.json",
+                f"{old}.part.lock",
+            ):
+                open(path, "w").close()
+
+            cache.remove_stale(key, keep=keep)
+
+            self.assertEqual(os.listdir(cache_dir), [os.path.basename(keep)])
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+
+import duckdb
+from django.test import SimpleTestCase, override_settings
+
+from taxi_api.benchmark import generate_month
+from taxi_api.parquet_cache import ParquetCache
+from taxi_api.remote import BlockCache, register_remote
+from taxi_api.services import TaxiDataService
+
+from .rangeserver import RangeServer
+
+MONTH_FILE = "yellow_tripdata_2023-03.parquet"
+
+
+class RemoteModeTests(SimpleTestCase):
+    """Remote months are queried over range requests against a local server"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp()
+        cls.upstream = os.path.join(cls.root, "upstream")
+        os.makedirs(cls.upstream)
+        cls.month_path = os.path.join(cls.upstream, MONTH_FILE)
+        generate_month(cls.month_path, 2023, 3, 100_000)
+        cls.server = RangeServer(cls.upstream).__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.__exit__(None, None, None)
+        shutil.rmtree(cls.root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        work = tempfile.mkdtemp(dir=self.root)
+        self.overrides = override_settings(
+            TAXI_BASE_URL=self.server.base_url,
+            TAXI_ENGINE_MODE="remote",
+            TAXI_CACHE_DIR=os.path.join(work, "cache"),
+            TAXI_ROLLUP_DIR=os.path.join(work, "rollups"),
+            TAXI_LAKE_DIR=os.path.join(work, "lake"),
+            TAXI_SORTED_DIR=os.path.join(work, "sorted"),
+            TAXI_REMOTE_CACHE_DIR=os.path.join(work, "blocks"),
+        )
+        self.overrides.enable()
+        ParquetCache._validated.clear()
+        ParquetCache._looked_up.clear()
+        TaxiDataService._view_sources.clear()
+        TaxiDataService._rollup_sources.clear()
+        self.server.bytes_sent = 0
+
+    def tearDown(self):
+        self.overrides.disable()
+
+    def test_query_reads_only_the_columns_it_needs(self):
+        conn = duckdb.connect()
+        register_remote(
+            conn, "remote_month", f"{self.server.base_url}/{MONTH_FILE}", "k"
+        )
+        query = """
+        SELECT PULocationID, COUNT(*), SUM(fare_amount)
+        FROM {} GROUP BY 1 ORDER BY 1
+        """
+
+        remote = conn.execute(query.format("remote_month")).fetchall()
+        local = conn.execute(query.format(f"'{self.month_path}'")).fetchall()
+
+        self.assertEqual(remote, local)
+        self.assertLess(self.server.bytes_sent, os.path.getsize(self.month_path) / 2)
+
+    def test_blocks_are_fetched_once(self):
+        url = f"{self.server.base_url}/{MONTH_FILE}"
+        size = os.path.getsize(self.month_path)
+        blocks = BlockCache(block_bytes=4096)
+
+        first = blocks.read(url, "k", size, 10_000, 20_000)
+        sent = self.server.bytes_sent
+        second = blocks.read(url, "k", size, 12_000, 10_000)
+
+        with open(self.month_path, "rb") as f:
+            f.seek(10_000)
+            self.assertEqual(first, f.read(20_000))
+        self.assertEqual(second, first[2_000:12_000])
+        self.assertEqual(self.server.bytes_sent, sent)
+
+    def test_rollup_is_built_once_without_downloading_the_month(self):
+        service = TaxiDataService()
+        try:
+            heatmap = service.get_heatmap_data(2023, 3, limit=5)
+        finally:
+            service.close()
+
+        sent = self.server.bytes_sent
+        service = TaxiDataService()
+        try:
+            dashboard = service.get_dashboard(2023, 3)
+        finally:
+            service.close()
+
+        # Answered from the persisted rollup, without another range request
+        self.assertEqual(self.server.bytes_sent, sent)
+        self.assertEqual(dashboard["heatmap"][:5], heatmap)
+        self.assertFalse(ParquetCache().find(2023, 3))
+
+        expected = duckdb.sql(
+            f"""
+            SELECT SUM(total_amount), COUNT(*) FROM '{self.month_path}'
+            WHERE tpep_pickup_datetime IS NOT NULL
+            """
+        ).fetchone()
+        stats = dashboard["stats"]
+        self.assertAlmostEqual(stats["total_revenue"], expected[0], places=4)
+        self.assertEqual(stats["total_trips"], expected[1])
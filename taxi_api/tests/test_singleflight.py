@@ -0,0 +1,132 @@
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from taxi_api.duckdb_views import TripSummaryView
+from taxi_api.parquet_cache import ParquetCache
+from taxi_api.services import TaxiDataService
+from taxi_api.singleflight import ColdLoadInProgress, SingleFlight
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Concurrent cold loads of the same key run once"""
+
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def tearDown(self):
+        self.release.set()
+        shutil.rmtree(self.lock_dir, ignore_errors=True)
+
+    def slow_load(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return "month"
+
+    def run_threads(self, flight: SingleFlight, count: int, func=None) -> list:
+        """Call do() from a leader and count - 1 waiters, returning outcomes"""
+        outcomes = [None] * count
+
+        def call(index):
+            try:
+                outcomes[index] = flight.do("yellow_2023-01", func or self.slow_load)
+            except Exception as e:
+                outcomes[index] = e
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+        threads[0].start()
+        self.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        return threads, outcomes
+
+    def test_concurrent_callers_share_one_call(self):
+        threads, outcomes = self.run_threads(SingleFlight(self.lock_dir, wait=5), 8)
+        # Let the waiters reach the call before it finishes
+        time.sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, ["month"] * 8)
+
+    def test_waiters_get_the_error_of_the_call(self):
+        flight = SingleFlight(self.lock_dir, wait=5)
+        failure = RuntimeError("upstream down")
+
+        def failing_load():
+            self.slow_load()
+            raise failure
+
+        threads, outcomes = self.run_threads(flight, 3, failing_load)
+        time.sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, [failure] * 3)
+
+    @override_settings(TAXI_COLD_LOAD_RETRY_AFTER=7)
+    def test_waiter_times_out_with_a_retry_hint(self):
+        threads, outcomes = self.run_threads(SingleFlight(self.lock_dir, wait=0.1), 2)
+        threads[1].join(5)
+
+        self.assertIsInstance(outcomes[1], ColdLoadInProgress)
+        self.assertEqual(outcomes[1].retry_after, 7)
+
+        self.release.set()
+        threads[0].join(5)
+        self.assertEqual(outcomes[0], "month")
+        self.assertEqual(self.calls, 1)
+
+    def test_lock_file_excludes_other_processes(self):
+        # Separate groups share nothing but the lock file, like two workers
+        holder = SingleFlight(self.lock_dir, wait=5)
+        other = SingleFlight(self.lock_dir, wait=0.2)
+
+        with holder.file_lock("yellow_2023-01"):
+            with self.assertRaises(ColdLoadInProgress):
+                other.do("yellow_2023-01", self.slow_load)
+        self.assertEqual(self.calls, 0)
+
+        self.release.set()
+        self.assertEqual(other.do("yellow_2023-01", self.slow_load), "month")
+
+
+class RetryLaterTests(SimpleTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.overrides = override_settings(
+            TAXI_BASE_URL="http://127.0.0.1:9", TAXI_CACHE_DIR=self.cache_dir
+        )
+        self.overrides.enable()
+        ParquetCache._validated.clear()
+        ParquetCache._looked_up.clear()
+
+    def tearDown(self):
+        self.overrides.disable()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    async def test_cold_load_in_progress_is_a_503_with_retry_after(self):
+        request = APIRequestFactory().get("/api/taxi-data/summary/", {"month": 3})
+        with mock.patch.object(
+            TaxiDataService,
+            "get_trip_summary",
+            side_effect=ColdLoadInProgress("yellow_2023-03", 7),
+        ):
+            response = await TripSummaryView.as_view()(request)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertEqual(response.data["retry_after"], 7)
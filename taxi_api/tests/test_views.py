@@ -0,0 +1,372 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import mock
+
+import duckdb
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from rest_framework.exceptions import ParseError
+from rest_framework.test import APIRequestFactory
+
+from taxi_api.benchmark import generate_month
+from taxi_api.duckdb_views import (
+    FlowsView,
+    SampleTripsView,
+    TaxiDataAPIView,
+    TripSummaryView,
+)
+from taxi_api.filters import TripFilters
+from taxi_api.parquet_cache import ParquetCache
+from taxi_api.pool import DuckDBPool
+from taxi_api.services import TaxiDataService, decode_cursor, encode_cursor
+from taxi_api.singleflight import SingleFlight
+
+from .rangeserver import RangeServer
+
+
+class LimitTests(SimpleTestCase):
+    """Row limits are validated and clamped before any query runs"""
+
+    def get_limit(self, query, *args, **kwargs):
+        request = RequestFactory().get("/", query)
+        return TaxiDataAPIView().get_limit(request, *args, **kwargs)
+
+    def test_default_when_absent(self):
+        self.assertEqual(self.get_limit({}, 30), 30)
+        self.assertIsNone(self.get_limit({}, None, clamp=False))
+
+    def test_invalid_limits_are_rejected(self):
+        for value in ("-1", "0", "ten", "1.5", ""):
+            with self.subTest(value=value), self.assertRaises(ParseError):
+                self.get_limit({"limit": value}, 30)
+
+    @override_settings(TAXI_MAX_PAGE_SIZE=500)
+    def test_large_limits_are_clamped(self):
+        self.assertEqual(self.get_limit({"limit": "200"}, 30), 200)
+        self.assertEqual(self.get_limit({"limit": "10000000"}, 30), 500)
+        self.assertEqual(
+            self.get_limit({"heatmap_limit": "9999"}, 1000, "heatmap_limit"), 500
+        )
+        self.assertEqual(self.get_limit({"limit": "10000"}, None, clamp=False), 10000)
+
+
+class YearMonthTests(SimpleTestCase):
+    """year/month are validated like start/end"""
+
+    def get_month_range(self, query):
+        request = RequestFactory().get("/", query)
+        return TaxiDataAPIView().get_month_range(request)
+
+    def test_valid_months(self):
+        self.assertEqual(self.get_month_range({}), ((2023, 1), (2023, 1)))
+        self.assertEqual(
+            self.get_month_range({"year": "2024", "month": "12"}),
+            ((2024, 12), (2024, 12)),
+        )
+
+    def test_invalid_months_are_rejected(self):
+        for query in (
+            {"year": "x"},
+            {"month": "x"},
+            {"month": "0"},
+            {"month": "13"},
+            {"month": "1.5"},
+            {"year": "2023-01"},
+            {"year": ""},
+        ):
+            with self.subTest(query=query), self.assertRaises(ParseError):
+                self.get_month_range(query)
+
+
+class OfflineViewTestCase(SimpleTestCase):
+    """Views with nothing cached and the upstream unreachable"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.overrides = override_settings(
+            TAXI_BASE_URL="http://127.0.0.1:9", TAXI_CACHE_DIR=self.cache_dir
+        )
+        self.overrides.enable()
+        ParquetCache._validated.clear()
+        ParquetCache._looked_up.clear()
+
+    def tearDown(self):
+        self.overrides.disable()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+class FlowsViewTests(OfflineViewTestCase):
+    """Bad origin zones are a 400, not an error from the matrix lookup"""
+
+    async def test_invalid_origins_are_rejected(self):
+        for origin in ("abc", "1.5", "0", "-3", "266", "100000"):
+            with self.subTest(origin=origin):
+                request = APIRequestFactory().get(
+                    "/api/taxi-data/flows/", {"origin": origin}
+                )
+                response = await FlowsView.as_view()(request)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("origin", response.data["detail"])
+
+
+class PoolTimeoutTests(OfflineViewTestCase):
+    @override_settings(TAXI_DUCKDB_POOL_RETRY_AFTER=3)
+    async def test_exhausted_pool_is_a_503_with_retry_after(self):
+        pool = DuckDBPool(size=1, timeout=0.1)
+        busy = pool.checkout()
+        request = APIRequestFactory().get("/api/taxi-data/summary/")
+        with mock.patch("taxi_api.duckdb_views.get_connection_pool", lambda: pool):
+            response = await TripSummaryView.as_view()(request)
+        pool.checkin(busy)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "3")
+        self.assertEqual(response.data["retry_after"], 3)
+
+
+class FixtureViewTestCase(SimpleTestCase):
+    """Views over a small synthetic month served by a local upstream"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp()
+        cls.upstream = os.path.join(cls.root, "upstream")
+        os.makedirs(cls.upstream)
+        generate_month(
+            os.path.join(cls.upstream, "yellow_tripdata_2023-03.parquet"),
+            2023,
+            3,
+            5_000,
+        )
+        cls.server = RangeServer(cls.upstream).__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.__exit__(None, None, None)
+        shutil.rmtree(cls.root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        work = tempfile.mkdtemp(dir=self.root)
+        self.overrides = override_settings(
+            TAXI_BASE_URL=self.server.base_url,
+            TAXI_CACHE_DIR=os.path.join(work, "cache"),
+            TAXI_ROLLUP_DIR=os.path.join(work, "rollups"),
+            TAXI_LAKE_DIR=os.path.join(work, "lake"),
+            TAXI_SORTED_DIR=os.path.join(work, "sorted"),
+        )
+        self.overrides.enable()
+        # The process-wide group keeps its lock files under the first cache
+        flight = SingleFlight(os.path.join(work, "locks"))
+        patcher = mock.patch("taxi_api.singleflight._single_flight", flight)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ParquetCache._validated.clear()
+        ParquetCache._looked_up.clear()
+        TaxiDataService._view_sources.clear()
+        TaxiDataService._rollup_sources.clear()
+        TaxiDataService._sorted_sources.clear()
+
+    def tearDown(self):
+        self.overrides.disable()
+
+
+class CacheHeaderTests(FixtureViewTestCase):
+    """Completed months are cached for good, but only once fully loaded"""
+
+    url = "/api/taxi-data/summary/"
+    query = {"year": "2023", "month": "3"}
+
+    async def get(self, **headers):
+        request = APIRequestFactory().get(self.url, self.query, **headers)
+        return await TripSummaryView.as_view()(request)
+
+    async def test_etag_round_trip(self):
+        response = await self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        etag = response["ETag"]
+
+        response = await self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        response = await self.get(HTTP_IF_NONE_MATCH='"stale", ' + etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = await self.get(HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    async def test_failed_rollup_is_not_cached_for_long(self):
+        with mock.patch(
+            "taxi_api.services.RollupStore.build", side_effect=OSError("disk full")
+        ):
+            response = await self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+        self.assertNotIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=300", response["Cache-Control"])
+
+
+class CursorTests(SimpleTestCase):
+    """Keyset cursors survive the round trip and reject anything else"""
+
+    def test_round_trip(self):
+        key = (2023, 3, datetime(2023, 3, 31, 23, 59, 7), 4321)
+        cursor = encode_cursor(*key)
+        self.assertNotIn("=", cursor)
+        self.assertEqual(decode_cursor(cursor), key)
+
+    def test_malformed_cursors_are_rejected(self):
+        for value in ("", "abc", "W10", encode_cursor(2023, 3, datetime.min, 1)[:-2]):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                decode_cursor(value)
+
+
+class KeysetPaginationTests(FixtureViewTestCase):
+    """Paging through a month returns every trip once, ties included"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Round pickups to the hour, so many trips share a pickup time
+        # and pages regularly end in the middle of a tie
+        march = os.path.join(cls.upstream, "yellow_tripdata_2023-03.parquet")
+        april = os.path.join(cls.upstream, "yellow_tripdata_2023-04.parquet")
+        duckdb.execute(
+            f"""
+            COPY (
+                SELECT * REPLACE (
+                    DATE_TRUNC('hour', tpep_pickup_datetime)
+                        + INTERVAL 1 MONTH AS tpep_pickup_datetime
+                )
+                FROM read_parquet('{march}')
+            ) TO '{april}' (FORMAT PARQUET)
+            """
+        )
+
+    async def get_page(self, cursor=None):
+        query = {"year": "2023", "month": "4", "limit": "97"}
+        if cursor:
+            query["cursor"] = cursor
+        request = APIRequestFactory().get("/api/taxi-data/trips/", query)
+        response = await SampleTripsView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    async def test_pages_neither_skip_nor_repeat_trips(self):
+        pages = []
+        page = await self.get_page()
+        pages.append(page["data"])
+        while page["next"]:
+            page = await self.get_page(page["next"])
+            pages.append(page["data"])
+
+        keys = [
+            (trip["pickup_datetime"], trip["trip_id"])
+            for data in pages
+            for trip in data
+        ]
+        self.assertEqual(keys, sorted(keys, reverse=True))
+        self.assertEqual(len(set(keys)), len(keys))
+
+        service = TaxiDataService()
+        try:
+            table = service.create_temp_table(2023, 4)
+            (count,) = service.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+        finally:
+            service.close()
+        self.assertEqual(len(keys), count)
+
+        # The fixture must actually exercise ties across page boundaries
+        ties = sum(
+            before[-1]["pickup_datetime"] == after[0]["pickup_datetime"]
+            for before, after in zip(pages, pages[1:], strict=False)
+        )
+        self.assertGreater(ties, 0)
+
+    async def test_invalid_cursor_is_a_400(self):
+        request = APIRequestFactory().get(
+            "/api/taxi-data/trips/", {"year": "2023", "month": "4", "cursor": "abc"}
+        )
+        response = await SampleTripsView.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+
+
+INJECTIONS = (
+    "1; DROP TABLE trips",
+    "1 OR 1=1",
+    "1) OR (1=1",
+    "7-9' OR '1'='1",
+    "$hours",
+    "1,2,3--",
+)
+
+
+class FilterTests(SimpleTestCase):
+    """Filter values only ever reach SQL as bound parameters"""
+
+    def test_injection_shaped_values_are_rejected(self):
+        for name in ("hours", "pickup_zone", "dropoff_zone", "payment_type"):
+            for value in INJECTIONS:
+                with self.subTest(name=name, value=value):
+                    with self.assertRaises(ValueError):
+                        TripFilters.from_query({name: value})
+
+        for value in ("2023-03-01'; DROP TABLE trips; --", "2023-03-01 OR 1=1"):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                TripFilters.from_query({"date_from": value})
+
+    def test_values_are_bound_not_inlined(self):
+        filters = TripFilters.from_query(
+            {
+                "date_from": "2023-03-02",
+                "hours": "17-19",
+                "pickup_zone": "161,237",
+                "payment_type": "2",
+            }
+        )
+        where = filters.where()
+        for value in ("2023", "17", "161", "237"):
+            self.assertNotIn(value, where)
+        self.assertEqual(filters.params["hours"], [17, 18, 19])
+        self.assertEqual(
+            [filters.params["pickup_zone_0"], filters.params["pickup_zone_1"]],
+            [161, 237],
+        )
+        self.assertEqual(filters.params_for(where), filters.params)
+
+
+class FilteredViewTests(FixtureViewTestCase):
+    """Filters narrow the results, and bad ones are a 400 before any query"""
+
+    async def get_summary(self, **filters):
+        query = {"year": "2023", "month": "3", "limit": "100", **filters}
+        request = APIRequestFactory().get("/api/taxi-data/summary/", query)
+        return await TripSummaryView.as_view()(request)
+
+    async def test_injection_shaped_filters_are_a_400(self):
+        for value in INJECTIONS:
+            with self.subTest(value=value):
+                response = await self.get_summary(pickup_zone=value)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("pickup_zone", response.data["detail"])
+
+    async def test_filters_match_a_direct_count(self):
+        response = await self.get_summary(pickup_zone="161,237", hours="7-9")
+        self.assertEqual(response.status_code, 200)
+        total = sum(day["total_trips"] for day in response.data["data"])
+
+        march = os.path.join(self.upstream, "yellow_tripdata_2023-03.parquet")
+        (expected,) = duckdb.execute(
+            f"""
+            SELECT COUNT(*) FROM read_parquet('{march}')
+            WHERE PULocationID IN (161, 237)
+            AND HOUR(tpep_pickup_datetime) BETWEEN 7 AND 9
+            """
+        ).fetchone()
+        self.assertGreater(expected, 0)
+        self.assertEqual(total, expected)
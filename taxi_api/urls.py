@@ -1,10 +1,14 @@
 from django.urls import path
 
 from .duckdb_views import (
+    DashboardView,
     DataStatusView,
+    FlowsView,
     HeatmapDataView,
+    MetricsView,
     RevenueAnalyticsView,
     SampleTripsView,
+    TripExportView,
     TripStatsView,
     TripSummaryView,
 )
@@ -24,5 +28,9 @@ urlpatterns = [
     ),
     path("taxi-data/stats/", TripStatsView.as_view(), name="trip-stats"),
     path("taxi-data/trips/", SampleTripsView.as_view(), name="sample-trips"),
+    path("taxi-data/trips/export/", TripExportView.as_view(), name="trip-export"),
+    path("taxi-data/dashboard/", DashboardView.as_view(), name="dashboard"),
+    path("taxi-data/flows/", FlowsView.as_view(), name="flows"),
     path("taxi-data/status/", DataStatusView.as_view(), name="data-status"),
+    path("taxi-data/metrics/", MetricsView.as_view(), name="metrics"),
 ]
@@ -0,0 +1,96 @@
+"""
+Prefetch and prebuild months before users ask for them
+
+Warming a month downloads it into the parquet cache and builds its rollup,
+which every process shares. Inside a server worker, months configured to
+be held in memory (see TaxiDataService.should_materialize) are also
+materialized in the worker's shared DuckDB database.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .conf import get_setting
+from .pool import get_connection_pool
+from .services import TaxiDataService, parse_year_month
+
+
+def warm_month(
+    year: int, month: int, taxi_type: str = "yellow", materialize: bool = False
+) -> bool:
+    """
+    Load one month into the cache and rollups, and with materialize=True
+    into this process's database if it is configured as a table
+    """
+    service = TaxiDataService(pool=get_connection_pool())
+    try:
+        if (
+            materialize
+            and service.should_materialize(year, month, taxi_type)
+            and not service.materialize(year, month, taxi_type)
+        ):
+            return False
+        return service.get_rollup(year, month, taxi_type) is not None
+    finally:
+        service.close()
+
+
+def warm_months(
+    months: list,
+    taxi_type: str = "yellow",
+    workers: int = 2,
+    materialize: bool = False,
+    progress=None,
+) -> int:
+    """Warm several months in parallel and report each one as it finishes"""
+    progress = progress or (lambda message, ok=True: print(message))
+    warmed = 0
+
+    def run(year, month):
+        started = time.monotonic()
+        return warm_month(year, month, taxi_type, materialize), (
+            time.monotonic() - started
+        )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(run, year, month): (year, month) for year, month in months
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            year, month = futures[future]
+            label = f"[{done}/{len(months)}] {taxi_type} {year}-{month:02d}"
+            try:
+                ok, elapsed = future.result()
+            except Exception as e:
+                progress(f"{label} failed: {e}", ok=False)
+                continue
+
+            if ok:
+                warmed += 1
+                progress(f"{label} ready in {elapsed:.1f}s", ok=True)
+            else:
+                progress(f"{label} is not available", ok=False)
+
+    return warmed
+
+
+def start_background_warmup():
+    """Warm TAXI_WARMUP_MONTHS on a daemon thread, if any are configured"""
+    setting = get_setting("TAXI_WARMUP_MONTHS", "")
+    months = [parse_year_month(value) for value in setting.split(",") if value]
+    if not months:
+        return None
+
+    def progress(message, ok=True):
+        print(f"Warmup {message}")
+
+    thread = threading.Thread(
+        target=warm_months,
+        args=(months,),
+        kwargs={"workers": 1, "materialize": True, "progress": progress},
+        name="taxi-warmup",
+        daemon=True,
+    )
+    thread.start()
+    return thread
@@ -35,7 +35,7 @@ def test_duckdb_service():
 
         # Test 3: Get sample trips
         print("\n🚕 Testing sample trips...")
-        trips = service.get_sample_trips(2023, 1, limit=3)
+        trips, _ = service.get_sample_trips(2023, 1, limit=3)
         print(f"Found {len(trips)} sample trips")
         if trips:
             print(f"Sample trip: {trips[0]}")